@@ -0,0 +1,119 @@
+"""
+Benchmarks for data_cleaner and directory_cleaner on synthetic sessions (see
+synthetic_sessions).
+
+For each scale (number of sessions) it writes a pickled and a text directory
+of sessions to a temporary directory, then times:
+    load_obj, load_txt, load_txt_fast - loading every file
+    df_to_entry - making an Entry of every profile
+    clean_data - cleaning every Entry
+    merge_entry, clean_data merged - merging constant-current runs of every
+        Entry (see profile_resampling), then cleaning the merged Entries
+    clean_batch - cleaning every session packed into flat arrays
+    clean_directory - end to end on the pickled and text directories
+and prints sessions/sec and peak memory (Python and numpy allocations, in
+this process only) of each. Each benchmark runs once timed and once with
+memory tracing.
+
+Usage: python benchmark.py [scale ...] [--workers N]
+Example: python benchmark.py 100 1000 10000 --workers 4
+"""
+# For arguments passed to library if name = main
+import sys
+import os
+import time
+import tempfile
+import tracemalloc
+
+import data_cleaner as dc
+import directory_cleaner as dir_c
+import synthetic_sessions as synth
+import profile_resampling as pr
+
+DefaultScales = [100, 1000]
+
+
+def measure(fun, *args):
+    """
+    Returns (result, seconds, peak memory in bytes) of fun(*args). Runs fun
+    twice, as tracing memory slows it down: once timed and once traced.
+    """
+    start = time.perf_counter()
+    result = fun(*args)
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    fun(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return (result, seconds, peak)
+
+
+def report(name, n_sessions, seconds, peak):
+    rate = n_sessions / seconds if seconds > 0 else float('inf')
+    print("%-28s %8d %10.3f %12.1f %10.1f" % \
+          (name, n_sessions, seconds, rate, peak / 2.0 ** 20))
+
+
+def run_scale(root, n_sessions, workers = 1):
+    """
+    Writes n_sessions synthetic sessions under root and prints the time of
+    each benchmark. Needs the current directory to be root/run so
+    clean_directory finds the station tables in ../Data/.
+    """
+    pkl_dir = os.path.join(root, "Data", "pkl-%d" % n_sessions) + "/"
+    txt_dir = os.path.join(root, "Data", "txt-%d" % n_sessions) + "/"
+    pkl_files = synth.write_directory(pkl_dir, n_sessions, "pkl")
+    txt_files = synth.write_directory(txt_dir, n_sessions, "txt")
+
+    dfs, seconds, peak = measure(lambda: [dir_c.load_obj(p) for p in pkl_files])
+    report("load_obj", n_sessions, seconds, peak)
+    _, seconds, peak = measure(lambda: [dir_c.load_txt(p) for p in txt_files])
+    report("load_txt", n_sessions, seconds, peak)
+    _, seconds, peak = measure(lambda: [dir_c.load_txt_fast(p) \
+                                        for p in txt_files])
+    report("load_txt_fast", n_sessions, seconds, peak)
+    _, seconds, peak = measure(dir_c.load_txt_batch, txt_files)
+    report("load_txt_batch", n_sessions, seconds, peak)
+
+    entries, seconds, peak = measure(lambda: [dc.df_to_entry(df) \
+                                              for df in dfs])
+    report("df_to_entry", n_sessions, seconds, peak)
+    _, seconds, peak = measure(lambda: [dc.clean_data(e) for e in entries])
+    report("clean_data", n_sessions, seconds, peak)
+    merged, seconds, peak = measure(lambda: [pr.merge_entry(e) \
+                                             for e in entries])
+    report("merge_entry", n_sessions, seconds, peak)
+    _, seconds, peak = measure(lambda: [dc.clean_data(e) for e in merged])
+    report("clean_data merged", n_sessions, seconds, peak)
+
+    packed = dc.pack_profiles(dfs)
+    _, seconds, peak = measure(dc.clean_batch, *packed)
+    report("clean_batch", n_sessions, seconds, peak)
+
+    for name, directory in (("pkl", pkl_dir), ("txt", txt_dir)):
+        _, seconds, peak = measure(dir_c.clean_directory, directory, \
+                                   dir_c.datapoint_length_vals, workers)
+        report("clean_directory %s" % name, n_sessions, seconds, peak)
+
+
+def main():
+    args = sys.argv[1:]
+    workers = int(dir_c.pop_option(args, "--workers", "1"))
+    scales = [int(arg) for arg in args] or DefaultScales
+
+    with tempfile.TemporaryDirectory() as root:
+        synth.write_station_tables(os.path.join(root, "Data"))
+        os.makedirs(os.path.join(root, "run"))
+        cwd = os.getcwd()
+        os.chdir(os.path.join(root, "run"))
+        try:
+            print("%-28s %8s %10s %12s %10s" % \
+                  ("benchmark", "sessions", "seconds", "sessions/s", "peak MB"))
+            for n_sessions in scales:
+                run_scale(root, n_sessions, workers)
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+This module records where the time of a directory_cleaner run goes.
+
+CleanStats keeps cumulative seconds per stage (finding files, loading, making
+Entries, each clean_data check, station lookup, writing, ...), counts of each
+error, bytes read and sessions per second. Pass one to
+directory_cleaner.clean_directory or iter_rows to fill it. Nothing is timed
+when no CleanStats is given: NoStats, which does nothing, is used instead.
+"""
+import json
+import time
+from collections import defaultdict
+
+
+class CleanStats:
+    """
+    Timings and counters of one run.
+
+    Attributes:
+    stage_seconds : dict of stage name to cumulative seconds.
+    check_seconds : dict of data_cleaner error name to cumulative seconds spent
+    in the clean_data check for it.
+    errors : dict of error (from the 'error' column of rows) to count.
+    sessions : Number of sessions checked, including cached ones.
+    cached : Number of sessions whose rows came from a result cache.
+    bytes_read : Bytes of session data read.
+    wall_seconds : Time from start() to stop().
+    """
+
+    def __init__(self):
+        self.stage_seconds = defaultdict(float)
+        self.check_seconds = defaultdict(float)
+        self.errors = defaultdict(int)
+        self.sessions = 0
+        self.cached = 0
+        self.bytes_read = 0
+        self.wall_seconds = 0.0
+        self._started = None
+
+    def start(self):
+        self._started = time.perf_counter()
+
+    def stop(self):
+        if self._started is not None:
+            self.wall_seconds += time.perf_counter() - self._started
+            self._started = None
+
+    def add_time(self, stage, seconds):
+        self.stage_seconds[stage] += seconds
+
+    def add_bytes(self, count):
+        self.bytes_read += count
+
+    def add_check_time(self, error, seconds):
+        """ Used as data_cleaner's check timer, see data_cleaner.set_check_timer. """
+        self.check_seconds[error] += seconds
+
+    def timer(self, stage):
+        """ Returns a context manager adding the time of its block to stage. """
+        return _StageTimer(self, stage)
+
+    def merge(self, other):
+        """ Adds the counts and times of another CleanStats to this one. """
+        for stage, seconds in other.stage_seconds.items():
+            self.stage_seconds[stage] += seconds
+        for error, seconds in other.check_seconds.items():
+            self.check_seconds[error] += seconds
+        for error, count in other.errors.items():
+            self.errors[error] += count
+        self.sessions += other.sessions
+        self.cached += other.cached
+        self.bytes_read += other.bytes_read
+
+    @property
+    def sessions_per_sec(self):
+        if self.wall_seconds == 0: return 0.0
+        return self.sessions / self.wall_seconds
+
+    def to_dict(self):
+        return {'wall_seconds' : self.wall_seconds, \
+                'sessions' : self.sessions, \
+                'cached' : self.cached, \
+                'sessions_per_sec' : self.sessions_per_sec, \
+                'bytes_read' : self.bytes_read, \
+                'stage_seconds' : dict(self.stage_seconds), \
+                'check_seconds' : dict(self.check_seconds), \
+                'errors' : dict(self.errors)}
+
+    def dump_json(self, filename):
+        with open(filename, 'w') as file:
+            json.dump(self.to_dict(), file, indent = 2)
+
+    def summary(self):
+        """ Returns a printable summary. """
+        lines = ["%d sessions (%d cached) in %.2f s, %.1f sessions/s, " \
+                 "%.1f MB read" % (self.sessions, self.cached, \
+                                   self.wall_seconds, self.sessions_per_sec, \
+                                   self.bytes_read / 2.0 ** 20)]
+        # Stage times may add to more than the wall time with workers
+        lines.append("Stage seconds (summed over workers):")
+        for stage, seconds in sorted(self.stage_seconds.items(), \
+                                     key = lambda item: -item[1]):
+            lines.append("    %-16s %10.3f" % (stage, seconds))
+        if self.check_seconds:
+            lines.append("clean_data check seconds:")
+            for error, seconds in sorted(self.check_seconds.items(), \
+                                         key = lambda item: -item[1]):
+                lines.append("    %-16s %10.3f" % (error, seconds))
+        if self.errors:
+            lines.append("Errors:")
+            for error, count in sorted(self.errors.items(), \
+                                       key = lambda item: -item[1]):
+                lines.append("    %-16s %10d" % (error, count))
+        return "\n".join(lines)
+
+
+class _StageTimer:
+    def __init__(self, stats, stage):
+        self.stats = stats
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.stats.add_time(self.stage, time.perf_counter() - self.start)
+
+
+class _NullTimer:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class _NoStats:
+    """ Stands in for CleanStats when a run is not instrumented. """
+    _timer = _NullTimer()
+
+    def timer(self, stage):
+        return self._timer
+
+    def add_time(self, stage, seconds):
+        pass
+
+    def add_bytes(self, count):
+        pass
+
+    def add_check_time(self, error, seconds):
+        pass
+
+NoStats = _NoStats()
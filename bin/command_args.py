@@ -0,0 +1,34 @@
+"""
+This module reads the command line options shared by the scripts in bin, such
+as --workers 4 or --stream, and holds the exceptions they raise for bad
+arguments.
+
+Each script's main pops its options from a copy of sys.argv with pop_option
+and pop_flag, so whatever is left are its positional arguments.
+"""
+
+
+class InvalidArgs(Exception): pass
+class InvalidDirectory(InvalidArgs): pass
+
+
+def pop_flag(args, name):
+    """
+    Removes '--name' from args and returns True, or False if not given.
+    """
+    if name not in args: return False
+    args.remove(name)
+    return True
+
+
+def pop_option(args, name, default = None):
+    """
+    Removes '--name value' from args and returns value, or default if not
+    given. Raises InvalidArgs if name is the last argument.
+    """
+    if name not in args: return default
+    i = args.index(name)
+    if i + 1 >= len(args): raise InvalidArgs( "%s needs a value" % name )
+    value = args[i + 1]
+    del args[i : i + 2]
+    return value
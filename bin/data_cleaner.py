@@ -3,7 +3,32 @@
 This module finds the validity and features of individual charging
 sessions.All functions use data of type Entry. To create an instance
 of Entry from a charging profile dataframe, use 'df_to_entry'.
+
+Many sessions can be cleaned at once with 'clean_batch', which works on
+sessions packed into flat arrays by 'pack_profiles'.
+
+Live sessions can be cleaned as their datapoints arrive with
+'SessionValidator'.
+
+Sessions can also be cleaned from their 'SessionMetrics' alone, the few
+values clean_data looks at, without their profile. See 'entry_metrics' and
+the metrics_sidecar module.
+
+Every gap of a session, with a histogram of their lengths, is given by
+'session_gaps', or 'batch_gaps' for packed sessions.
+
+'RuleSet' checks sessions against a list of 'Rule', clean_data's checks or
+any others, trying cheap checks first and computing only the metrics it
+needs. See Sec 7.
+
+'CleaningConfig' checks clean_data's criteria once and works out the checks
+and metrics they need, for is_clean, clean_data, clean_batch and
+directory_cleaner to share. See Sec 8.
 """
+import time
+import datetime
+import numbers
+import operator
 import numpy as np
 
 # Sec 0. Reasons for data to be invaid, in the order they are checked.
@@ -15,6 +40,12 @@ LittleEnergyUsed = "LittleEnergyUsed"
 PowerTooLow = "PowerTooLow"
 ValidData = "ValidData"
 
+# Profiles are in mA. Assume 208 V.
+# Energy in AV per mA*hour of integrated current.
+mA_to_A_V = 1/10000.0 * 208
+# Power in W per mA.
+mA_to_W = 1/1000.0 * 208
+
 # Sec 1. Data Manager
 class Entry:
     """
@@ -30,19 +61,152 @@ class Entry:
     
     profile : pandas.DataFrame with pandas.Timestamp index and
     column "mamps_last" corresponding to the current charging (in mA) at a
-    given time. Fine if other columns exist too.
+    given time. Fine if other columns exist too. For an Entry made from arrays
+    (see arrays_to_entry), this is only built when it is first used.
+
+    times : Times of the datapoints. The profile's index, or a numpy
+    datetime64 array.
+
+    currents : numpy array of the currents (in mA) at 'times'. Taken from
+    the profile's "mamps_last" column when first used.
+
+    point_index : None, or for a profile with datapoints merged away (see
+    profile_resampling), the index in the original profile of each of
+    'times'.
+
+    n_points, length, max_gap_info, average_gap, max_power, outages : See
+    properties below.
+
+    energyDemand and the properties are computed the first time they are used
+    and kept, so sessions rejected by an early check never integrate their
+    profile.
     """
+    __slots__ = ('startTime', 'endTime', 'times', '_currents', 'point_index', \
+                 '_profile', '_energyDemand', '_n_points', '_length', \
+                 '_max_gap_info', '_average_gap', '_max_power', '_outages')
     
-    def __init__ (self, start, end, profile, energyDemand):
-        """ Returns an instance of Entry with parameters as given. """
+    def __init__ (self, start, end, profile, energyDemand = None, \
+                  times = None, currents = None, n_points = None, \
+                  point_index = None):
+        """
+        Returns an instance of Entry with parameters as given. 'times' and
+        'currents' are taken from 'profile' if not given. energyDemand is
+        computed when first used if None. n_points is the number of datapoints
+        of the original profile, len(times) if None.
+        """
         
         self.startTime = start
         self.endTime = end
-        self.energyDemand = energyDemand
-        self.profile = profile
+        self._energyDemand = energyDemand
+        self._profile = profile
+        if times is None: times = profile.index
+        self.times = times
+        # Taken from the profile when first used, so a profile loaded without
+        # its currents can still be checked on its times
+        self._currents = currents
+        self.point_index = point_index
+        self._n_points = n_points
+        self._length = None
+        self._max_gap_info = None
+        self._average_gap = None
+        self._max_power = None
+        self._outages = None
         # The module could get rewritten to only use functions defined in
         # the Entry, for which the following line could be useful
         # self.get_curr = lambda time: profile_fetch(time, self.profile)
+
+    @property
+    def profile(self):
+        if self._profile is None:
+            import pandas as pd
+            self._profile = pd.DataFrame(\
+                {'mamps_last' : self.currents}, \
+                index = pd.DatetimeIndex(self.times, name = 'time'))
+        return self._profile
+
+    @property
+    def currents(self):
+        if self._currents is None:
+            self._currents = self._profile['mamps_last'].values
+        return self._currents
+
+    @property
+    def energyDemand(self):
+        if self._energyDemand is None:
+            self._energyDemand = _energy(self.times, self.currents)
+        return self._energyDemand
+
+    @energyDemand.setter
+    def energyDemand(self, value):
+        self._energyDemand = value
+
+    @property
+    def n_points(self):
+        """ Number of datapoints in the original profile. """
+        if self._n_points is None:
+            self._n_points = len(self.times)
+        return self._n_points
+
+    @property
+    def length(self):
+        """ Time from the first datapoint to the last. """
+        if self._length is None:
+            self._length = self.endTime - self.startTime
+        return self._length
+
+    @property
+    def max_gap_info(self):
+        """
+        (max gap, fraction, time) of the largest gap between consecutive
+        datapoints, as max_gap with more_info.
+        """
+        if self._max_gap_info is None:
+            times = self.times
+            difference = np.diff(times)
+            # If difference is empty, no gap (this is case with one datapoint)
+            if difference.size == 0:
+                self._max_gap_info = (np.timedelta64(0, 's'), 0, times[0])
+            else:
+                # Get the index of the first instance of the maximum value of
+                # gaps between points
+                ind = np.argmax(difference)
+                position = ind
+                if self.point_index is not None:
+                    position = self.point_index[ind]
+                self._max_gap_info = (difference[ind], \
+                                      position/float(self.n_points), \
+                                      times[ind])
+        return self._max_gap_info
+
+    @property
+    def average_gap(self):
+        """ Session length over number of datapoints. """
+        if self._average_gap is None:
+            profileTime = self.length
+            if profileTime == np.timedelta64(0, 's'):
+                self._average_gap = profileTime
+            else:
+                self._average_gap = np.timedelta64(profileTime / \
+                                                   self.n_points)
+        return self._average_gap
+
+    @property
+    def max_power(self):
+        """ Maximum power of the profile in W, assuming 208 V. """
+        if self._max_power is None:
+            self._max_power = np.nanmax(self.currents) * mA_to_W
+        return self._max_power
+
+    @property
+    def outages(self):
+        """
+        (number, total time) of the gaps of at least OutageGap, see
+        session_gaps.
+        """
+        if self._outages is None:
+            gaps = session_gaps(self)
+            self._outages = (gaps['outages'], gaps['outage_time'])
+        return self._outages
     
 
 def df_to_entry ( df ):
@@ -56,27 +220,51 @@ def df_to_entry ( df ):
     One session's charging profile with provided current in mA over time.
     
     Returns:
-    Instance of Entry with values calculated from profile and energyDemand from
-    integrating 'df' and assuming 208 V.
+    Instance of Entry with values calculated from profile. energyDemand is
+    found by integrating column "mamps_last" of 'df', assuming 208 V, when it
+    is first used.
 
     """
     start = df.index[0]
     end = df.index[-1]
-    # For more with dataframes : https://www.shanelynn.ie/select-pandas-dataframe-rows-and-columns-using-iloc-loc-and-ix/
-    # Assumes current is 0th column, and in mA
-    # Demand in W*hr = A * V * hr. Assume 208 V.
-    mA_to_A_V = 1/10000.0 * 208
-    integral = np.trapz(df.iloc[:,0], df.index)
-    hour = np.timedelta64(1, 'h')
-    demand = integral / hour * mA_to_A_V
 
     # The lambda function to fetch the current from the dataframe, if this is
     # ever needed
     # profile_fetch = lambda time, profile: profile.loc[time][0]
     
-    entry = Entry(start, end, df, demand)
+    entry = Entry(start, end, df)
     return entry
 
+def arrays_to_entry ( times, currents, n_points = None, point_index = None ):
+    """
+    Creates an instance of Entry from arrays of a charging session, without
+    copying them. Useful for read-only views of memory-mapped data, such as
+    session_store.SessionStore.entry gives.
+
+    Parameters:
+    times : numpy.datetime64 array of datapoint times.
+    currents : numpy array of current in mA at each time.
+    n_points, point_index : For a profile with datapoints merged away, see
+    Entry.
+
+    Returns:
+    Instance of Entry as df_to_entry would give for the same profile. The
+    profile DataFrame is only built if Entry.profile is used.
+    """
+    return Entry(times[0], times[-1], None, None, times, currents, n_points, \
+                 point_index)
+
+def _energy(times, currents):
+    """
+    Integral of 'currents' (mA) over 'times', as energy in AV assuming 208 V.
+    Trapezoid rule, as np.trapz.
+    """
+    ns = np.asarray(times, dtype='datetime64[ns]').view(np.int64)
+    currents = np.asarray(currents, dtype=float)
+    integral = np.dot(np.diff(ns), (currents[:-1] + currents[1:]) / 2.0)
+    hour = np.timedelta64(1, 'h') / np.timedelta64(1, 'ns')
+    return integral / hour * mA_to_A_V
+
 
 # Sec 2. Cleaning functions and sub-functions
 
@@ -86,21 +274,22 @@ def is_clean(   data, \
                 max_gap_allowed = np.timedelta64(5, 'm'), \
                 min_energy = 1, \
                 min_maxpower = 2000, \
-                max_time = np.timedelta64(20, 'h')):
+                max_time = np.timedelta64(20, 'h'), \
+                config = None):
     """
     Returns True or False based on whether the data meets all given criteria or
     not, respectively.
     
     
     Parameters:
-    data (Entry) - One charging session
+    data (Entry or SessionMetrics) - One charging session
     
     min_charge_time (numpy.timedelta64)  - Minimum length of session to be
     valid. This criterion will be ignored if None. Default: 20 minutes
     
     
-    max_time (numpy.timedelta64) - Minimum length of session to be valid.
-    Default: 1 minute. This criterion will be ignored if None.
+    max_time (numpy.timedelta64) - Maximum length of session to be valid.
+    Default: 20 hours. This criterion will be ignored if None.
     
     max_gap_allowed (numpy.timedelta64) - Maximum gap between consecutive points
     in a profile to be valid. This criterion will be ignored if None.
@@ -118,12 +307,14 @@ def is_clean(   data, \
     
     
     min_energy (number) - Minumum energy consumed in the session to be
-    considered valid, in kWh. This criterion will be ignored if 0.
+    considered valid, in kWh. This criterion will be ignored if 0 or None.
     Default: 1 (kWh).
     
     min_maxpower (number) - Minimum power reached for session to be valid, in
-    Watts. This criterion will be ignored if 0. Default: 2000 (W)    
+    Watts. This criterion will be ignored if 0 or None. Default: 2000 (W)    
     
+    config (CleaningConfig) - Criteria to use instead of the ones above, which
+    are then not looked at. Default: None.
     
     
     Returns: Boolean, True is the data has no problems, False otherwise.
@@ -134,7 +325,8 @@ def is_clean(   data, \
                         max_gap_allowed, \
                         min_energy, \
                         min_maxpower, \
-                        max_time)[0]
+                        max_time, \
+                        config = config)[0]
 
                 
 
@@ -145,7 +337,8 @@ def clean_data( data, \
                 min_energy = 1, \
                 min_maxpower = 2000, \
                 max_time = np.timedelta64(20, 'h'), \
-                other_tests = False
+                other_tests = False, \
+                config = None
                 ):
     """
     Returns a tuple with information about whether the data meets all given
@@ -155,14 +348,14 @@ def clean_data( data, \
     
     Parameters:
     
-    data (Entry) - One charging session
+    data (Entry or SessionMetrics) - One charging session
     
     min_charge_time (numpy.timedelta64)  - Minimum length of session to be
     valid. This criterion will be ignored if None. Default: 20 minutes
     
     
-    max_time (numpy.timedelta64) - Minimum length of session to be valid.
-    Default: 1 minute. This criterion will be ignored if None.
+    max_time (numpy.timedelta64) - Maximum length of session to be valid.
+    Default: 20 hours. This criterion will be ignored if None.
     
     max_gap_allowed (numpy.timedelta64) - Maximum gap between consecutive points
     in a profile to be valid. This criterion will be ignored if None.
@@ -180,11 +373,11 @@ def clean_data( data, \
     
     
     min_energy (number) - Minumum energy consumed in the session to be
-    considered valid, in kWh. This criterion will be ignored if 0.
+    considered valid, in kWh. This criterion will be ignored if 0 or None.
     Default: 1 (kWh).
     
     min_maxpower (number) - Minimum power reached for session to be valid, in
-    Watts. This criterion will be ignored if 0. Default: 2000 (W)    
+    Watts. This criterion will be ignored if 0 or None. Default: 2000 (W)    
     
     other_tests (list of functions with:
                     input data (Entry) and output: anything)
@@ -195,6 +388,11 @@ def clean_data( data, \
     No other tests will be performed if other_tests is False or [].
     Default: False.
 
+    config (CleaningConfig) - Criteria to use instead of the ones above, which
+    are then not looked at. Default: None, for a CleaningConfig of the ones
+    above. Checks turned off are skipped without looking at 'data', and no
+    metric is found for a check that is not done.
+
     
     
     
@@ -211,26 +409,24 @@ def clean_data( data, \
     of each function in 'other_tests', in order.
     
     """
-    # Check charge period is long enough
-    if not _long_enough(data, min_charge_time): result = (False, ShortTime)
-    
-    # Check that all gaps are small enough
-    elif not _no_gap(data, max_gap_allowed): result = (False, BigGap)
-    
-    # Check if charge session is too long
-    elif not _short_enough(data, max_time): result = (False, LongTime)
-   
-    # Check the profile has enough data points (loss of datapoints)
-    elif not _enough_points(data, min_average_time_gap): result = (False, LostDatapoints)
+    # Criteria are checked once for all the sessions using them, see Sec 8
+    if config is None:
+        config = _config_of((min_charge_time, min_average_time_gap, \
+                             max_gap_allowed, min_energy, min_maxpower, \
+                             max_time))
 
-    # Check the profile consumed enough energy
-    elif not _enough_energy_used(data, min_energy): result = (False, LittleEnergyUsed)
-
-    # Check the profile had high enough maximum power
-    elif not _enough_power(data, min_maxpower): result = (False, PowerTooLow)
-
-    # If all of the previous functions passed, then valid data.
-    else: result = (True, ValidData)
+    # If all of the checks pass, then valid data.
+    result = (True, ValidData)
+    for check, criterion, error in config._checks:
+        if _check_timer is None:
+            passed = check(data, criterion)
+        else:
+            start = time.perf_counter()
+            passed = check(data, criterion)
+            _check_timer(error, time.perf_counter() - start)
+        if not passed:
+            result = (False, error)
+            break
     
     # Other tests to do on an Entry
     if other_tests:
@@ -241,6 +437,21 @@ def clean_data( data, \
     else: 
         return result
 
+# Called as _check_timer(error, seconds) after each clean_data check if not
+# None. See set_check_timer.
+_check_timer = None
+
+def set_check_timer(timer):
+    """
+    Sets a function called as timer(error, seconds) with the time each
+    clean_data check takes, named by the error it finds. None to stop timing.
+    Returns the previous timer.
+    """
+    global _check_timer
+    previous = _check_timer
+    _check_timer = timer
+    return previous
+
 # Sec 2.1. Sub-functions for clean_data
 
 def _long_enough (data, min_time):
@@ -252,22 +463,23 @@ def _long_enough (data, min_time):
     # Check initial case
     if min_time == None: return True
 
-    return (data.endTime - data.startTime) >= min_time
+    return data.length >= min_time
 
 def _no_gap(data, max_gap_allowed):
     """
     Takes data : Entry and a max_gap : np.timedelta64 and returns {True | False}
     Returns True if the profile has no gaps greater than max_gap.
     """
-    if max_gap_allowed == None: True
+    if max_gap_allowed == None: return True
     return max_gap(data) < max_gap_allowed
 
 def _short_enough (data, max_time):
     """
     Takes data and returns True if the charging profile spans less than or equal
-    to max_time (as a numpy timedelta64).
+    to max_time (as a numpy timedelta64). If max_time is None, return True.
     """
-    return (data.endTime - data.startTime) <= max_time
+    if max_time == None: return True
+    return data.length <= max_time
 
 def _enough_points(data, min_average_time_gap):
     """ Check the profile has enough data points (loss of datapoints). """
@@ -285,22 +497,20 @@ def _enough_energy_used(data, min_energy):
     then returns True. Else returns False.
     """
     # Check initial case
-    if min_energy == 0: return True
+    if min_energy == None or min_energy == 0: return True
 
     return data.energyDemand > min_energy
 
 def _enough_power (data, min_power):
     """
     Takes data of type Entry and returns True if the maximum power of the 
-    charging profile uses more than or equal to to min_power. If min_power is 0,
-    return True.
+    charging profile uses more than or equal to to min_power. If min_power is 0
+    or None, return True.
     """
     # Check initial case
-    if min_power == 0: return True
+    if min_power == None or min_power == 0: return True
     
-    # Profile in mA. To get power, divide by 1000, multiply by 208
-    maxPower = data.profile['mamps_last'].max() / 1000.0 * 208
-    return maxPower >= min_power
+    return data.max_power >= min_power
 
 # Sec 2.2 Helper functions or more info functions that take data in the form
 # Entry.
@@ -310,7 +520,7 @@ def session_length (data):
     Takes data of type Entry 
     Returns the length of time from the first datapoint to last in a profile.
     """
-    return data.endTime - data.startTime
+    return data.length
 
 def datapoint_fraction(data, supposed_time_gap = np.timedelta64(10, 's')):
     """
@@ -321,9 +531,9 @@ def datapoint_fraction(data, supposed_time_gap = np.timedelta64(10, 's')):
     points expected based on the length of time and given 'supposed_time_gap'.
     """
      # Actual # of points
-    numPoints = data.profile.shape[0] # Number of rows. Assumes a dataframe.
+    numPoints = data.n_points
     # Theoretical # of points
-    profileTime = data.endTime - data.startTime
+    profileTime = data.length
     if profileTime == np.timedelta64(0, 's'): return 1
     # Some sessions had >1, so ignore for now.
     return min (numPoints / (profileTime / supposed_time_gap), 1)
@@ -336,13 +546,7 @@ def average_gap(data):
     Returns the average gap in time between consecutive datapoints in the
     data.profile as numpy.timedelta64.
     """
-     # Actual # of points
-    numPoints = data.profile.shape[0] # Number of rows. Assumes a dataframe.
-    # Theoretical # of points
-    profileTime = data.endTime - data.startTime
-    if profileTime == np.timedelta64(0, 's'): return profileTime
-    ave_gap = np.timedelta64(profileTime / numPoints)
-    return ave_gap
+    return data.average_gap
 
 
 def max_gap(data, more_info = False):
@@ -355,21 +559,995 @@ def max_gap(data, more_info = False):
     (max difference, fraction from 0 to 1, pandas.TimeStamp) where
     fraction is how far into the session (as fraction of whole session)
         the first lare gap was and
-    the pandas.Timestamp is what time the first large gap occurred.
-    """
-    profile = data.profile
-    times = data.profile.index
-    difference = np.diff(times)
-    # If difference is empty, return no gap (this is case with one datapoint)
-    if difference.size == 0:
-        if more_info: return (np.timedelta64(0, 's'), 0, times[0])
-        else: return np.timedelta64(0, 's')
+    the pandas.Timestamp is what time the first large gap occurred. For an
+    Entry made from arrays, the time is a numpy.datetime64.
+    """
+    if more_info: return data.max_gap_info
+    else: return data.max_gap_info[0] # A numpy timedelta64
+
+def outages(data):
+    """
+    Takes data of type Entry.
+
+    Returns a tuple of (number, total time) of the gaps between consecutive
+    datapoints of at least OutageGap (5 minutes), the total time as
+    numpy.timedelta64. To find every gap, see session_gaps.
+    """
+    return data.outages
+
+
+# Sec 3. Batch cleaning
+# Many sessions packed into flat arrays:
+#   times : numpy.datetime64[ns] array of every session's datapoints, in order
+#   currents : array of the matching 'mamps_last' values, in mA
+#   offsets : integer array of length (number of sessions + 1). Session k is
+#             times[offsets[k]:offsets[k+1]].
+
+def pack_profiles(profiles):
+    """
+    Takes an iterable of charging profiles, as pandas DataFrames like those
+    given to df_to_entry or as Entry.
+
+    Returns (times, currents, offsets) packing the profiles in order, for use
+    with batch_metrics and clean_batch. Currents are from column "mamps_last".
+    """
+    times = []
+    currents = []
+    offsets = [0]
+    for profile in profiles:
+        if not isinstance(profile, Entry):
+            profile = Entry(None, None, profile, None)
+        times.append(np.asarray(profile.times, dtype='datetime64[ns]'))
+        currents.append(np.asarray(profile.currents, dtype=float))
+        offsets.append(offsets[-1] + len(profile.times))
+    if len(times) == 0:
+        return (np.array([], dtype='datetime64[ns]'), np.array([]), \
+                np.array(offsets, dtype=np.int64))
+    return (np.concatenate(times), np.concatenate(currents), \
+            np.array(offsets, dtype=np.int64))
+
+def batch_metrics(times, currents, offsets):
+    """
+    Takes sessions packed as described in Sec 3.
+
+    Returns a dict of arrays with one value per session:
+    'n_points' - number of datapoints.
+    'length' - numpy.timedelta64 as session_length.
+    'max_gap' - numpy.timedelta64 as max_gap.
+    'average_gap' - numpy.timedelta64 as average_gap.
+    'energy' - energy used in AV as Entry.energyDemand.
+    'max_power' - maximum power in W, as used by _enough_power.
+
+    Every session needs at least one datapoint.
+    """
+    packed = _Packed(times, currents, offsets)
+    n_points = _packed_n_points(packed)
+    if np.any(n_points < 1):
+        raise ValueError("Every session needs at least one datapoint")
+    if n_points.size == 0:
+        empty_td = np.array([], dtype='timedelta64[ns]')
+        return {'n_points' : n_points, 'length' : empty_td, \
+                'max_gap' : empty_td, 'average_gap' : empty_td, \
+                'energy' : np.array([]), 'max_power' : np.array([])}
+    return {'n_points' : n_points, \
+            'length' : _packed_length(packed), \
+            'max_gap' : _packed_max_gap(packed), \
+            'average_gap' : _packed_average_gap(packed), \
+            'energy' : _packed_energy(packed), \
+            'max_power' : _packed_max_power(packed)}
+
+class _Packed:
+    """
+    Sessions packed as described in Sec 3, with times as int nanoseconds and
+    the gaps between datapoints computed once, when first used, for every
+    metric that needs them.
+    """
+    __slots__ = ('ns', 'currents', 'offsets', 'starts', 'ends', '_gaps')
+
+    def __init__(self, times, currents, offsets):
+        self.ns = np.asarray(times, dtype='datetime64[ns]').view(np.int64)
+        self.currents = np.asarray(currents, dtype=float)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.starts = self.offsets[:-1]
+        self.ends = self.offsets[1:] - 1
+        self._gaps = None
+
+    @property
+    def gaps(self):
+        """
+        Gap after each datapoint. The last point of a session has no gap, so
+        each segment [start, end] of gaps only holds gaps inside the session.
+        """
+        if self._gaps is None:
+            gaps = np.zeros(self.ns.size, dtype=np.int64)
+            gaps[:-1] = np.diff(self.ns)
+            gaps[self.ends] = 0
+            self._gaps = gaps
+        return self._gaps
+
+    def take(self, which):
+        """ Returns a _Packed of the sessions where bool array which is True. """
+        counts = np.diff(self.offsets)[which]
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        index = np.repeat(self.starts[which] - offsets[:-1], counts) + \
+                np.arange(offsets[-1])
+        return _Packed(self.ns[index].view('datetime64[ns]'), \
+                       self.currents[index], offsets)
+
+# Each metric of batch_metrics, from a _Packed with at least one session
+
+def _packed_n_points(packed):
+    return np.diff(packed.offsets)
+
+def _packed_length(packed):
+    length = packed.ns[packed.ends] - packed.ns[packed.starts]
+    return length.astype('timedelta64[ns]')
+
+def _packed_max_gap(packed):
+    max_gap = np.maximum.reduceat(packed.gaps, packed.starts)
+    return max_gap.astype('timedelta64[ns]')
+
+def _packed_average_gap(packed):
+    # Same as average_gap: session length over number of points
+    length = packed.ns[packed.ends] - packed.ns[packed.starts]
+    return (length // _packed_n_points(packed)).astype('timedelta64[ns]')
+
+def _packed_energy(packed):
+    # Trapezoid rule on each interval, as np.trapz in df_to_entry
+    gaps = packed.gaps
+    currents = packed.currents
+    areas = np.zeros(gaps.size)
+    areas[:-1] = gaps[:-1] * ((currents[:-1] + currents[1:]) / 2.0)
+    areas[packed.ends] = 0
+    hour = np.timedelta64(1, 'h') / np.timedelta64(1, 'ns')
+    return np.add.reduceat(areas, packed.starts) / hour * mA_to_A_V
+
+def _packed_max_power(packed):
+    # fmax skips NaN as pandas' max does
+    return np.fmax.reduceat(packed.currents, packed.starts) * mA_to_W
+
+def clean_batch(times, currents, offsets, \
+                min_charge_time = np.timedelta64(20, 'm'), \
+                min_average_time_gap = np.timedelta64(11, 's'), \
+                max_gap_allowed = np.timedelta64(5, 'm'), \
+                min_energy = 1, \
+                min_maxpower = 2000, \
+                max_time = np.timedelta64(20, 'h')):
+    """
+    Cleans many sessions at once. Same as clean_data on each session, without
+    other_tests.
+
+    Parameters:
+    times, currents, offsets - Sessions packed as described in Sec 3. See
+    pack_profiles.
+
+    Other parameters are as clean_data, with None (or 0 for min_energy and
+    min_maxpower) ignoring the criterion.
+
+    Returns: (is_valid, error)
+    is_valid (numpy bool array) - True for each session passing all criteria.
+    error (numpy object array) - The error clean_data would give each session.
+    """
+    # Metrics are only found for the sessions the checks before need them,
+    # see RuleSet
+    config = _config_of((min_charge_time, min_average_time_gap, \
+                         max_gap_allowed, min_energy, min_maxpower, max_time))
+    return config.check_batch(times, currents, offsets)
+
+def batch_verdict(metrics, \
+                  min_charge_time = np.timedelta64(20, 'm'), \
+                  min_average_time_gap = np.timedelta64(11, 's'), \
+                  max_gap_allowed = np.timedelta64(5, 'm'), \
+                  min_energy = 1, \
+                  min_maxpower = 2000, \
+                  max_time = np.timedelta64(20, 'h')):
+    """
+    Takes a dict of arrays as returned by batch_metrics and criteria as
+    clean_batch. Returns (is_valid, error) as clean_batch.
+    """
+    criteria = {'min_charge_time' : min_charge_time, \
+                'min_average_time_gap' : min_average_time_gap, \
+                'max_gap_allowed' : max_gap_allowed, \
+                'min_energy' : min_energy, \
+                'min_maxpower' : min_maxpower, \
+                'max_time' : max_time}
+    checks = [(criterion, error) for criterion, error in BatchOrder \
+              if not batch_ignores(criterion, criteria[criterion])]
+
+    n = metrics['n_points'].size
+    error = np.full(n, ValidData, dtype=object)
+    undecided = np.ones(n, dtype=bool)
+    for criterion, reason in checks:
+        failed = undecided & batch_fails(metrics, criterion, \
+                                         criteria[criterion])
+        error[failed] = reason
+        undecided &= ~failed
+    return (undecided, error)
+
+# (criterion, error) of each check, in the order clean_data checks them.
+# criterion is the name of the clean_data argument the check uses.
+BatchOrder = (('min_charge_time', ShortTime), \
+              ('max_gap_allowed', BigGap), \
+              ('max_time', LongTime), \
+              ('min_average_time_gap', LostDatapoints), \
+              ('min_energy', LittleEnergyUsed), \
+              ('min_maxpower', PowerTooLow))
+
+def batch_ignores(criterion, value):
+    """
+    Returns True if the clean_data argument 'criterion' set to value turns
+    its check off: None, or 0 for min_energy and min_maxpower.
+    """
+    if value is None: return True
+    if criterion in ('min_energy', 'min_maxpower'): return value == 0
+    return False
+
+def batch_fails(metrics, criterion, value):
+    """
+    Takes a dict of arrays as returned by batch_metrics. Returns a numpy bool
+    array, True for each session failing the check of the clean_data argument
+    'criterion' set to value, whatever the checks before it found.
+    """
+    if criterion == 'min_charge_time':
+        return metrics['length'] < value
+    if criterion == 'max_gap_allowed':
+        return metrics['max_gap'] >= value
+    if criterion == 'max_time':
+        return metrics['length'] > value
+    if criterion == 'min_average_time_gap':
+        return metrics['average_gap'] >= value
+    if criterion == 'min_energy':
+        return ~(metrics['energy'] > value)
+    if criterion == 'min_maxpower':
+        return ~(metrics['max_power'] >= value)
+    raise ValueError("Unknown criterion %s" % criterion)
+
+
+# Sec 4. Streaming validation
+# Sessions checked as their datapoints arrive, without keeping the profile.
+
+class SessionValidator:
+    """
+    Validates one charging session from its datapoints as they arrive, in
+    time order. Keeps only running values (first and last time, number of
+    points, trapezoid integral, largest gap and peak current), so any number
+    of live sessions can be followed without buffering their profiles.
+
+    BigGap and LongTime are known as soon as the datapoint causing them
+    arrives, and are added to 'flags' then. The final verdict, from 'result',
+    is the one clean_data gives the whole session, in clean_data's order: a
+    session flagged BigGap that ends up too short is still ShortTime.
+
+    A validator has the attributes and properties of Entry that clean_data
+    uses (startTime, endTime, n_points, length, max_gap_info, average_gap,
+    energyDemand and max_power) and outages, so it can be passed to clean_data
+    and to the Sec 2.2 functions. There is no profile.
+
+    Attributes:
+    criteria : Criteria as given to clean_data, in its argument order.
+    n_points : Number of datapoints added.
+    flags : Errors found before the session ended, in the order found.
+    """
+    __slots__ = ('criteria', 'n_points', 'flags', '_start', '_last', \
+                 '_last_current', '_area', '_max_gap', '_max_gap_index', \
+                 '_max_gap_time', '_peak', '_outages', '_outage_time')
+
+    def __init__(self, \
+                 min_charge_time = np.timedelta64(20, 'm'), \
+                 min_average_time_gap = np.timedelta64(11, 's'), \
+                 max_gap_allowed = np.timedelta64(5, 'm'), \
+                 min_energy = 1, \
+                 min_maxpower = 2000, \
+                 max_time = np.timedelta64(20, 'h')):
+        """ Returns a validator of a new session. Criteria as clean_data. """
+        self.criteria = (min_charge_time, min_average_time_gap, \
+                         max_gap_allowed, min_energy, min_maxpower, max_time)
+        self.n_points = 0
+        self.flags = []
+        # Times are int nanoseconds since the epoch
+        self._start = None
+        self._last = None
+        self._last_current = None
+        # Trapezoid integral in mA * ns
+        self._area = 0.0
+        # Largest gap, the index of the datapoint before it and its time
+        self._max_gap = None
+        self._max_gap_index = 0
+        self._max_gap_time = None
+        self._peak = np.nan
+        # Gaps of at least OutageGap, and their total in ns
+        self._outages = 0
+        self._outage_time = 0
+
+    def add(self, time, mamps):
+        """
+        Adds the datapoint 'mamps' (current in mA) at 'time' (anything
+        numpy.datetime64 takes, such as a pandas.Timestamp). Returns a tuple
+        of the errors this datapoint raised, usually empty.
+        """
+        t = int(np.datetime64(time, 'ns').astype(np.int64))
+        mamps = float(mamps)
+        if self._last is None:
+            self._start = t
+        else:
+            gap = t - self._last
+            self._area += gap * ((self._last_current + mamps) / 2.0)
+            if self._max_gap is None or gap > self._max_gap:
+                self._max_gap = gap
+                self._max_gap_index = self.n_points - 1
+                self._max_gap_time = self._last
+            if gap >= OutageGap / np.timedelta64(1, 'ns'):
+                self._outages += 1
+                self._outage_time += gap
+        self._last = t
+        self._last_current = mamps
+        # fmax skips NaN as nanmax does
+        self._peak = np.fmax(self._peak, mamps)
+        self.n_points += 1
+        return self._new_flags()
+
+    def add_many(self, times, currents):
+        """
+        Adds datapoints from arrays, as many calls of add. Returns a tuple of
+        the errors they raised.
+        """
+        times = np.asarray(times, dtype='datetime64[ns]').view(np.int64)
+        currents = np.asarray(currents, dtype=float)
+        added = times.size
+        if added == 0: return ()
+        if self._last is None:
+            self._start = int(times[0])
+            first = 0
+        else:
+            times = np.concatenate(([self._last], times))
+            currents = np.concatenate(([self._last_current], currents))
+            first = self.n_points - 1
+        gaps = np.diff(times)
+        if gaps.size > 0:
+            self._area += float(np.dot(gaps, \
+                                       (currents[:-1] + currents[1:]) / 2.0))
+            ind = np.argmax(gaps)
+            if self._max_gap is None or gaps[ind] > self._max_gap:
+                self._max_gap = int(gaps[ind])
+                self._max_gap_index = first + int(ind)
+                self._max_gap_time = int(times[ind])
+            big = gaps[gaps >= OutageGap / np.timedelta64(1, 'ns')]
+            self._outages += big.size
+            self._outage_time += int(big.sum())
+        self._last = int(times[-1])
+        self._last_current = float(currents[-1])
+        self._peak = np.fmax(self._peak, np.fmax.reduce(currents))
+        self.n_points += added
+        new = self._new_flags()
+        if len(new) == 2:
+            # Both found by these datapoints: keep the order add finds them in
+            big_at = 1 + np.argmax(gaps.view('timedelta64[ns]') >= \
+                                   self.criteria[2])
+            long_at = np.argmax((times - self._start).view('timedelta64[ns]') \
+                                > self.criteria[5])
+            if long_at < big_at:
+                new = (LongTime, BigGap)
+                self.flags[-2:] = new
+        return new
+
+    def _new_flags(self):
+        """ Adds BigGap and LongTime to flags once each. Returns those added. """
+        new = ()
+        max_gap_allowed = self.criteria[2]
+        max_time = self.criteria[5]
+        if max_gap_allowed is not None and BigGap not in self.flags and \
+           self._max_gap is not None and \
+           np.timedelta64(self._max_gap, 'ns') >= max_gap_allowed:
+            new += (BigGap,)
+        if max_time is not None and LongTime not in self.flags and \
+           np.timedelta64(self._last - self._start, 'ns') > max_time:
+            new += (LongTime,)
+        self.flags.extend(new)
+        return new
+
+    @property
+    def startTime(self):
+        return np.datetime64(self._start, 'ns')
+
+    @property
+    def endTime(self):
+        return np.datetime64(self._last, 'ns')
+
+    @property
+    def length(self):
+        """ Time from the first datapoint to the last. """
+        return np.timedelta64(self._last - self._start, 'ns')
+
+    @property
+    def max_gap_info(self):
+        """ As Entry.max_gap_info. """
+        if self.n_points < 2:
+            return (np.timedelta64(0, 's'), 0, self.startTime)
+        return (np.timedelta64(self._max_gap, 'ns'), \
+                self._max_gap_index / float(self.n_points), \
+                np.datetime64(self._max_gap_time, 'ns'))
+
+    @property
+    def average_gap(self):
+        """ Session length over number of datapoints. """
+        profileTime = self.length
+        if profileTime == np.timedelta64(0, 's'): return profileTime
+        return np.timedelta64(profileTime / self.n_points)
+
+    @property
+    def energyDemand(self):
+        """ Energy used so far in AV, as Entry.energyDemand. """
+        hour = np.timedelta64(1, 'h') / np.timedelta64(1, 'ns')
+        return self._area / hour * mA_to_A_V
+
+    @property
+    def max_power(self):
+        """ Maximum power so far in W, assuming 208 V. """
+        return self._peak * mA_to_W
+
+    @property
+    def outages(self):
+        """ (number, total time) of gaps of at least OutageGap so far. """
+        return (self._outages, np.timedelta64(self._outage_time, 'ns'))
+
+    def result(self, other_tests = False):
+        """
+        Returns clean_data's result for the datapoints added so far, as
+        (is_clean, error, other_results*). Call once the session has ended.
+        """
+        if self.n_points == 0:
+            raise ValueError("Session has no datapoints")
+        return clean_data(self, *self.criteria, other_tests = other_tests)
+
+
+# Sec 5. Session metrics
+# The values clean_data looks at, kept without the profile.
+
+class SessionMetrics:
+    """
+    The metrics of one charging session that clean_data uses, without its
+    profile. Made from an Entry with entry_metrics, and kept for whole
+    directories by metrics_sidecar.
+
+    Has the attributes and properties of Entry that clean_data uses, so it
+    can be passed to is_clean, clean_data and the Sec 2.2 functions, and gives
+    the same results as the Entry it was made from. There is no profile.
+
+    Attributes:
+    startTime, endTime : Times of the first and last datapoints.
+    n_points : Number of datapoints in the original profile.
+    max_gap_info : (max gap, fraction, time) as Entry.max_gap_info.
+    average_gap : As Entry.average_gap.
+    energyDemand : Energy used in AV, as Entry.energyDemand.
+    max_power : Maximum power in W, as Entry.max_power.
+    outages : (number, total time) of gaps of at least OutageGap, as
+    Entry.outages.
+    """
+    __slots__ = ('startTime', 'endTime', 'n_points', 'max_gap_info', \
+                 'average_gap', 'energyDemand', 'max_power', 'outages')
+
+    def __init__(self, start, end, n_points, max_gap_info, average_gap, \
+                 energyDemand, max_power, outages):
+        self.startTime = start
+        self.endTime = end
+        self.n_points = n_points
+        self.max_gap_info = max_gap_info
+        self.average_gap = average_gap
+        self.energyDemand = energyDemand
+        self.max_power = max_power
+        self.outages = outages
+
+    @property
+    def length(self):
+        """ Time from the first datapoint to the last. """
+        return self.endTime - self.startTime
+
+def entry_metrics(data):
+    """
+    Takes data of type Entry, or anything with the same metrics such as a
+    SessionValidator.
+
+    Returns its SessionMetrics. Computes every metric not yet computed.
+    """
+    return SessionMetrics(data.startTime, data.endTime, data.n_points, \
+                          data.max_gap_info, data.average_gap, \
+                          data.energyDemand, data.max_power, data.outages)
+
+
+# Sec 6. Gap analysis
+# Every gap of a session, not only the largest, for sessions packed as in
+# Sec 3 or one at a time.
+
+# Smallest gap counted as an outage by default. Same as clean_data's default
+# max_gap_allowed, so a session with an outage is BigGap.
+OutageGap = np.timedelta64(5, 'm')
+
+# Edges of the gap histogram bins. Bin k counts the gaps with
+# GapEdges[k] <= gap < GapEdges[k + 1], and the last bin every longer gap.
+GapEdges = np.array([0, 10, 20, 30, 60, 300, 600, 1800, 3600], \
+                    dtype='timedelta64[s]')
+
+def _gap_table(ns, offsets, positions, n_points, real, min_gap, edges):
+    """
+    batch_gaps on int nanosecond times. positions is the index in its
+    original profile of each datapoint, n_points the number of datapoints of
+    each original profile, and real None or, for each gap, whether it is one
+    of the original profile.
+    """
+    sessions = offsets.size - 1
+    edges = np.asarray(edges, dtype='timedelta64[ns]').view(np.int64)
+    # Gap after each datapoint, and the session it is in. The gap after the
+    # last datapoint of a session is not one.
+    gaps = np.diff(ns)
+    inside = np.ones(gaps.size, dtype=bool)
+    inside[offsets[1:-1] - 1] = False
+    if real is not None: inside &= real
+    session = np.repeat(np.arange(sessions), np.diff(offsets))[:-1]
+
+    bins = np.searchsorted(edges, gaps, side = 'right') - 1
+    counted = inside & (bins >= 0)
+    histogram = np.bincount(session[counted] * edges.size + bins[counted], \
+                            minlength = sessions * edges.size)
+    big = np.flatnonzero(inside & \
+                         (gaps >= min_gap / np.timedelta64(1, 'ns')))
+    outage_time = np.zeros(sessions, dtype=np.int64)
+    np.add.at(outage_time, session[big], gaps[big])
+    return {'session' : session[big], \
+            'start' : ns[big].view('datetime64[ns]'), \
+            'end' : ns[big + 1].view('datetime64[ns]'), \
+            'duration' : gaps[big].view('timedelta64[ns]'), \
+            'position' : positions[big] / n_points[session[big]].astype(float), \
+            'histogram' : histogram.reshape(sessions, edges.size), \
+            'outages' : np.bincount(session[big], minlength = sessions), \
+            'outage_time' : outage_time.view('timedelta64[ns]')}
+
+def batch_gaps(times, offsets, min_gap = OutageGap, edges = GapEdges):
+    """
+    Takes sessions packed as described in Sec 3 (only times and offsets are
+    needed), a gap length min_gap (numpy.timedelta64) and histogram edges as
+    GapEdges.
+
+    Returns a dict of arrays with one value per gap of at least min_gap, in
+    order:
+    'session' - the session the gap is in.
+    'start', 'end' - numpy.datetime64[ns] times of the datapoints around it.
+    'duration' - numpy.timedelta64[ns] length of the gap.
+    'position' - how far into its session the gap is, as the fraction given
+    by max_gap with more_info.
+    and with one value per session:
+    'histogram' - row of the number of gaps in each bin of edges, counting
+    every gap of the session.
+    'outages' - number of gaps of at least min_gap.
+    'outage_time' - numpy.timedelta64[ns] total length of those gaps.
+    """
+    ns = np.asarray(times, dtype='datetime64[ns]').view(np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_points = np.diff(offsets)
+    positions = np.arange(ns.size) - np.repeat(offsets[:-1], n_points)
+    return _gap_table(ns, offsets, positions, n_points, None, min_gap, edges)
+
+def session_gaps(data, min_gap = OutageGap, edges = GapEdges):
+    """
+    Takes data of type Entry. Returns batch_gaps of the one session, without
+    'session', with 'histogram' a single row and 'outages' and 'outage_time'
+    single values.
+
+    For an Entry with datapoints merged away (see Entry.point_index), only
+    the gaps between datapoints next to each other in the original profile
+    are seen.
+    """
+    ns = np.asarray(data.times, dtype='datetime64[ns]').view(np.int64)
+    offsets = np.array([0, ns.size], dtype=np.int64)
+    if data.point_index is None:
+        positions = np.arange(ns.size)
+        real = None
+    else:
+        positions = np.asarray(data.point_index)
+        real = np.diff(positions) == 1
+    gaps = _gap_table(ns, offsets, positions, \
+                      np.array([data.n_points], dtype=np.int64), real, \
+                      min_gap, edges)
+    del gaps['session']
+    gaps['histogram'] = gaps['histogram'][0]
+    gaps['outages'] = int(gaps['outages'][0])
+    gaps['outage_time'] = gaps['outage_time'][0]
+    return gaps
+
+
+
+# Sec 7. Rule sets
+# clean_data's checks, and any others, as data. A RuleSet tries them in order
+# of cost and computes each metric at most once, only for the sessions still
+# needing it, but gives the error of the first rule failed in the order the
+# rules are listed, as clean_data does.
+
+class RuleMetric:
+    """
+    A metric rules can check.
+
+    Attributes:
+    name : Name rules use for it.
+    of_entry : Function giving the metric of one session (an Entry, or
+    anything with the same attributes such as SessionMetrics).
+    of_batch : None, or function giving an array of the metric of each
+    session of a _Packed (sessions packed as in Sec 3). Without one, batches
+    are checked an Entry at a time.
+    cost : Relative cost of the metric. 0 for metrics taking no pass over the
+    datapoints, 1 for one simple pass.
+    """
+    __slots__ = ('name', 'of_entry', 'of_batch', 'cost')
+
+    def __init__(self, name, of_entry, of_batch = None, cost = 1):
+        self.name = name
+        self.of_entry = of_entry
+        self.of_batch = of_batch
+        self.cost = cost
+
+# Metrics rules can check, by name. See register_metric.
+RuleMetrics = {}
+
+def register_metric(name, of_entry, of_batch = None, cost = 1):
+    """
+    Adds a metric rules can check by name, or replaces the one named so.
+    See RuleMetric for the arguments. Returns the RuleMetric.
+    """
+    metric = RuleMetric(name, of_entry, of_batch, cost)
+    RuleMetrics[name] = metric
+    return metric
+
+register_metric('length', lambda data: data.length, _packed_length, 0)
+register_metric('n_points', lambda data: data.n_points, _packed_n_points, 0)
+register_metric('average_gap', lambda data: data.average_gap, \
+                _packed_average_gap, 0)
+register_metric('max_gap', lambda data: data.max_gap_info[0], \
+                _packed_max_gap, 1)
+register_metric('max_power', lambda data: data.max_power, \
+                _packed_max_power, 1)
+# Integration takes more work per datapoint than the other passes
+register_metric('energy', lambda data: data.energyDemand, _packed_energy, 2)
+
+class Rule:
+    """
+    One check of a RuleSet. A session fails it, with 'error', unless
+    passes(value of its metric, threshold) is True.
+
+    Attributes:
+    error : Error given to sessions failing the rule, such as ShortTime.
+    metric : Name of the metric checked, see RuleMetrics.
+    passes : Function of (value, threshold) giving True if the value
+    passes. Given arrays of values when checking batches, it must then give
+    a bool array, as the operator module's comparisons do.
+    threshold : Value passed to 'passes'.
+    """
+    __slots__ = ('error', 'metric', 'passes', 'threshold')
+
+    def __init__(self, error, metric, passes, threshold):
+        self.error = error
+        self.metric = metric
+        self.passes = passes
+        self.threshold = threshold
+
+# Metric and test of each clean_data criterion, as in Sec 2.1
+CriterionTests = {'min_charge_time' : ('length', operator.ge), \
+                  'max_gap_allowed' : ('max_gap', operator.lt), \
+                  'max_time' : ('length', operator.le), \
+                  'min_average_time_gap' : ('average_gap', operator.lt), \
+                  'min_energy' : ('energy', operator.gt), \
+                  'min_maxpower' : ('max_power', operator.ge)}
+
+def default_rules(min_charge_time = np.timedelta64(20, 'm'), \
+                  min_average_time_gap = np.timedelta64(11, 's'), \
+                  max_gap_allowed = np.timedelta64(5, 'm'), \
+                  min_energy = 1, \
+                  min_maxpower = 2000, \
+                  max_time = np.timedelta64(20, 'h')):
+    """
+    Returns a list of the Rules of clean_data's checks with the given
+    criteria, in clean_data's order. Criteria are as clean_data, and checks
+    turned off (see batch_ignores) are left out.
+    """
+    criteria = {'min_charge_time' : min_charge_time, \
+                'min_average_time_gap' : min_average_time_gap, \
+                'max_gap_allowed' : max_gap_allowed, \
+                'min_energy' : min_energy, \
+                'min_maxpower' : min_maxpower, \
+                'max_time' : max_time}
+    return [Rule(error, CriterionTests[criterion][0], \
+                 CriterionTests[criterion][1], criteria[criterion]) \
+            for criterion, error in BatchOrder \
+            if not batch_ignores(criterion, criteria[criterion])]
+
+class RuleSet:
+    """
+    Checks sessions against a list of Rules, compiled once for any number of
+    sessions.
+
+    The error given is that of the first rule failed, in the order of
+    'rules', as clean_data gives, or ValidData. Rules are tried cheapest
+    metric first. Once a session fails a rule, rules listed after it are not
+    tried on it, so expensive metrics such as energy are only found for
+    sessions passing every cheaper rule listed before them. Each metric is
+    found at most once per session, whichever rules check it.
+
+    Use as:
+        rules = RuleSet(default_rules(min_energy = 5) + \
+                        [Rule("FewPoints", 'n_points', operator.ge, 100)])
+        rules.check(entry)                       # (False, ShortTime)
+        rules.check_batch(times, currents, offsets)
+
+    Attributes:
+    rules : Tuple of the Rules, in the order their errors take precedence.
+    order : Positions in rules of the rules in the order they are tried.
+    """
+
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+        for rule in self.rules:
+            if rule.metric not in RuleMetrics:
+                raise ValueError("Unknown metric %s of rule %s, see " \
+                                 "register_metric" % (rule.metric, rule.error))
+        self._metrics = [RuleMetrics[rule.metric] for rule in self.rules]
+        # Cheapest first, and in listed order for the same cost
+        self.order = tuple(sorted(range(len(self.rules)), key = lambda k: \
+                                  (self._metrics[k].cost, k)))
+
+    def check(self, data):
+        """
+        Checks one session, an Entry or anything with the attributes its
+        rules' metrics use, such as SessionMetrics or SessionValidator.
+        Returns (is_clean, error) as clean_data.
+        """
+        first = len(self.rules)
+        values = {}
+        for k in self.order:
+            # Only a rule listed earlier can change the error
+            if k >= first: continue
+            rule = self.rules[k]
+            if rule.metric not in values:
+                values[rule.metric] = self._metrics[k].of_entry(data)
+            if not rule.passes(values[rule.metric], rule.threshold):
+                first = k
+        if first == len(self.rules): return (True, ValidData)
+        return (False, self.rules[first].error)
+
+    def check_batch(self, times, currents, offsets):
+        """
+        Checks sessions packed as described in Sec 3. Returns (is_valid,
+        error) as clean_batch.
+        """
+        packed = _Packed(times, currents, offsets)
+        n = packed.offsets.size - 1
+        if np.any(np.diff(packed.offsets) < 1):
+            raise ValueError("Every session needs at least one datapoint")
+        # Position of the first rule each session is known to fail
+        first = np.full(n, len(self.rules))
+        # Value of each metric, for the sessions in 'known'
+        values = {}
+        known = {}
+        for k in self.order:
+            todo = first > k
+            if not todo.any(): continue
+            rule = self.rules[k]
+            metric = self._metrics[k]
+            if rule.metric not in values:
+                values[rule.metric] = None
+                known[rule.metric] = np.zeros(n, dtype=bool)
+            needed = todo & ~known[rule.metric]
+            if needed.any():
+                # Gathering the sessions needed costs about as much as a
+                # pass, so it is only worth it for under half the datapoints
+                sizes = np.diff(packed.offsets)
+                if sizes[needed].sum() * 2 > packed.ns.size:
+                    needed = ~known[rule.metric]
+                found = self._batch_values(metric, packed, needed)
+                if values[rule.metric] is None:
+                    values[rule.metric] = np.empty(n, dtype=found.dtype)
+                values[rule.metric][needed] = found
+                known[rule.metric] |= needed
+            failed = ~np.asarray(rule.passes(values[rule.metric][todo], \
+                                             rule.threshold), dtype=bool)
+            first[np.flatnonzero(todo)[failed]] = k
+
+        errors = np.array([rule.error for rule in self.rules] + [ValidData], \
+                          dtype=object)
+        return (first == len(self.rules), errors[first])
+
+    def _batch_values(self, metric, packed, which):
+        """ Array of metric for the sessions where bool array which is True. """
+        if not which.all(): packed = packed.take(which)
+        if metric.of_batch is not None: return metric.of_batch(packed)
+        ns = packed.ns.view('datetime64[ns]')
+        return np.array([metric.of_entry(arrays_to_entry(\
+                             ns[packed.offsets[i] : packed.offsets[i + 1]], \
+                             packed.currents[packed.offsets[i] : \
+                                             packed.offsets[i + 1]])) \
+                         for i in range(packed.offsets.size - 1)])
+
+
+# Sec 8. Cleaning configurations
+# clean_data's criteria, checked once for any number of sessions, with the
+# checks they turn on and the metrics those need worked out up front.
+
+# clean_data's criteria, in its argument order
+Criteria = ('min_charge_time', 'min_average_time_gap', 'max_gap_allowed', \
+            'min_energy', 'min_maxpower', 'max_time')
+
+# Criteria that are times. The others are numbers.
+TimeCriteria = ('min_charge_time', 'min_average_time_gap', \
+                'max_gap_allowed', 'max_time')
+
+# Sub-function of Sec 2.1 checking each criterion
+CriterionChecks = {
+    # Check charge period is long enough
+    'min_charge_time' : _long_enough,
+    # Check that all gaps are small enough
+    'max_gap_allowed' : _no_gap,
+    # Check if charge session is too long
+    'max_time' : _short_enough,
+    # Check the profile has enough data points (loss of datapoints)
+    'min_average_time_gap' : _enough_points,
+    # Check the profile consumed enough energy
+    'min_energy' : _enough_energy_used,
+    # Check the profile had high enough maximum power
+    'min_maxpower' : _enough_power}
+
+# Metrics found from the currents of a profile, and not only its times
+CurrentMetrics = frozenset(['energy', 'max_power'])
+
+def _checked_criterion(criterion, value):
+    """
+    Returns value if it is a valid value of clean_data's argument 'criterion',
+    else raises ValueError. None is always valid.
+    """
+    if value is None: return value
+    if criterion in TimeCriteria:
+        valid = isinstance(value, (np.timedelta64, datetime.timedelta)) and \
+                not np.isnat(np.timedelta64(value)) and \
+                value >= np.timedelta64(0, 's')
+        kind = "a time (numpy.timedelta64)"
     else:
-        # Get the index of the first instance of the maximum value of gaps
-        # between points
-        ind = np.argmax(difference)
-        max_diff = difference[ind]
-        if more_info : return (max_diff, \
-                               ind/float(times.shape[0]), \
-                               times[ind])
-        else: return max_diff # A numpy timedelta64
+        # numpy.timedelta64 is a numbers.Real too
+        valid = isinstance(value, numbers.Real) and \
+                not isinstance(value, (bool, np.bool_, np.timedelta64)) and \
+                not np.isnan(value) and value >= 0
+        kind = "a number"
+    if not valid:
+        raise ValueError("%s must be %s of at least 0, or None, not %r" % \
+                         (criterion, kind, value))
+    return value
+
+class CleaningConfig:
+    """
+    Criteria of clean_data, checked once, with the checks they turn on and
+    the metrics those need. One config can be shared by is_clean, clean_data,
+    clean_batch and the directory_cleaner check functions.
+
+    Criteria are as clean_data, and default to its defaults. Building a
+    config raises ValueError if a time criterion (see TimeCriteria) is not a
+    numpy.timedelta64 or datetime.timedelta, if another is not a number, or
+    if either is negative. None turns any check off, as does 0 for
+    min_energy and min_maxpower (see batch_ignores). Checks turned off are
+    never run, so sessions are never looked at for them.
+
+        config = CleaningConfig(min_energy = 5)
+        clean_data(entry, config = config)
+        # Screens on length alone, finding no other metric
+        config.only('min_charge_time').check_batch(times, currents, offsets)
+
+    Attributes:
+    min_charge_time, min_average_time_gap, max_gap_allowed, min_energy,
+    min_maxpower, max_time : The criteria.
+    checks : Tuple of the (criterion, error) of each check turned on, in
+    clean_data's order (see BatchOrder).
+    metrics : frozenset of the names of the metrics those checks use (see
+    RuleMetrics), the only ones found for a session.
+    needs_currents : True if any of those metrics needs the currents of the
+    profile, and not only its times.
+    """
+    __slots__ = Criteria + ('checks', 'metrics', 'needs_currents', \
+                            '_checks', '_rules')
+
+    def __init__(self, \
+                 min_charge_time = np.timedelta64(20, 'm'), \
+                 min_average_time_gap = np.timedelta64(11, 's'), \
+                 max_gap_allowed = np.timedelta64(5, 'm'), \
+                 min_energy = 1, \
+                 min_maxpower = 2000, \
+                 max_time = np.timedelta64(20, 'h')):
+        values = (min_charge_time, min_average_time_gap, max_gap_allowed, \
+                  min_energy, min_maxpower, max_time)
+        for criterion, value in zip(Criteria, values):
+            setattr(self, criterion, _checked_criterion(criterion, value))
+        self.checks = tuple((criterion, error) \
+                            for criterion, error in BatchOrder \
+                            if not batch_ignores(criterion, \
+                                                 getattr(self, criterion)))
+        self.metrics = frozenset(CriterionTests[criterion][0] \
+                                 for criterion, _ in self.checks)
+        self.needs_currents = not self.metrics.isdisjoint(CurrentMetrics)
+        # (sub-function, criterion value, error) of each check, for clean_data
+        self._checks = tuple((CriterionChecks[criterion], \
+                              getattr(self, criterion), error) \
+                             for criterion, error in self.checks)
+        self._rules = None
+
+    @property
+    def criteria(self):
+        """ Tuple of the criteria, in clean_data's argument order. """
+        return tuple(getattr(self, criterion) for criterion in Criteria)
+
+    @property
+    def rules(self):
+        """ RuleSet of the checks turned on, made when first used. """
+        if self._rules is None:
+            self._rules = RuleSet(default_rules(*self.criteria))
+        return self._rules
+
+    def only(self, *criteria):
+        """
+        Returns a CleaningConfig with the same values of 'criteria' (names of
+        clean_data arguments) and every other check turned off.
+        """
+        unknown = set(criteria) - set(Criteria)
+        if unknown: raise ValueError("Unknown criteria %s" % sorted(unknown))
+        return CleaningConfig(*[getattr(self, criterion) \
+                                if criterion in criteria else None \
+                                for criterion in Criteria])
+
+    def check(self, data, other_tests = False):
+        """ clean_data of data (Entry or SessionMetrics) with this config. """
+        return clean_data(data, other_tests = other_tests, config = self)
+
+    def check_batch(self, times, currents, offsets):
+        """ clean_batch of packed sessions with this config. """
+        return self.rules.check_batch(times, currents, offsets)
+
+    def verdict(self, metrics):
+        """ batch_verdict of a dict of batch metrics with this config. """
+        return batch_verdict(metrics, *self.criteria)
+
+    def __reduce__(self):
+        # The RuleSet holds functions that can not be pickled, so configs go
+        # to other processes as their criteria
+        return (CleaningConfig, self.criteria)
+
+    def __repr__(self):
+        return "CleaningConfig(%s)" % ", ".join(\
+            "%s=%r" % (criterion, getattr(self, criterion)) \
+            for criterion in Criteria)
+
+# Configs of the criteria clean_data and clean_batch were called with, so
+# each is only checked once. Emptied once it holds MaxConfigs.
+_configs = {}
+MaxConfigs = 64
+
+def _config_of(criteria):
+    """
+    Returns the CleaningConfig of criteria, a tuple in clean_data's argument
+    order.
+    """
+    # Values that compare equal may still be checked differently (True and 1,
+    # numpy.timedelta64 and pandas.Timedelta), so their types are kept too
+    key = tuple((type(value), value) for value in criteria)
+    try:
+        config = _configs.get(key)
+    except TypeError:
+        # Criteria that can not be hashed are not kept
+        return CleaningConfig(*criteria)
+    if config is None:
+        config = CleaningConfig(*criteria)
+        if len(_configs) >= MaxConfigs: _configs.clear()
+        _configs[key] = config
+    return config
+
+def parse_criterion(text):
+    """
+    Parses a criterion given as text, such as on the command line: "none", a
+    number, or a number with unit s, m or h as a numpy.timedelta64.
+    """
+    if text.lower() == "none": return None
+    if text[-1:] in ("s", "m", "h"):
+        return np.timedelta64(int(text[:-1]), text[-1])
+    number = float(text)
+    if number.is_integer(): return int(number)
+    return number
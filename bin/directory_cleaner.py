@@ -3,10 +3,23 @@ import sys
 # For unpacking data using pickle and looking through directories with glob,
 # copying files with shutil
 import pickle, glob, shutil
+import os
+import datetime
 import numpy as np
 import pandas as pd
 
 import data_cleaner as dc
+import session_store as ss
+import result_cache as rc
+import clean_stats as cs
+import station_registry as sr
+import file_index as fi
+import session_loaders as sl
+import result_sinks as rs
+import fleet_rollup as fr
+import command_args as ca
+import worker_pool as wp
+import metrics_sidecar as ms
 
 
 # 
@@ -16,15 +29,35 @@ import data_cleaner as dc
 # 
 # For now, the selected ones are those that are clean.
 #
-# Example: python directory_cleaner.py "../Data/All-Caltech/" "output"
-Usage = " \n Usage: python %s source_directory output_filename" % sys.argv[0]
+# The output file is written to ../Output/ in the format of its extension,
+# .csv, .parquet, .feather, .pkl or .xlsx (see result_sinks). Excel if it has
+# no known extension.
+#
+# Example: python directory_cleaner.py "../Data/All-Caltech/" "output.csv"
+#
+# Criteria of data_cleaner.clean_data are given as --min_charge_time 30m or
+# --min_energy 5 (times take a unit, s, m or h, and "none" turns a check off).
+# --only keeps the checks of the criteria listed and turns the others off, so
+# a light screen such as
+#     python directory_cleaner.py "../Data/All-Caltech/" "long.csv" \
+#         --check clean_df --only min_charge_time
+# finds no metric but the length of each session, and loads no currents.
+Usage = " \n Usage: python %s source_directory output_filename" % sys.argv[0] \
+        + " [--workers N|auto] [--cache cache_directory]" \
+        + " [--stats] [--stats-json stats_filename]" \
+        + " [--rollup rollup_filename] [--sidecar]" \
+        + " [--check check_function] [--criterion value]..." \
+        + " [--only criterion,criterion,...]" \
+        + " \n Check functions: clean_df, long_df, gap_vals," \
+        + " datapoint_length_vals (default)" \
+        + " \n Criteria: " + ", ".join(dc.Criteria)
 
 ex_dir = "../Data/All-Caltech/"
 # ex_file = "0003020330_2017-12-21-12-56-50.pkl" 
 
-# Exceptions
-class InvalidArgs(Exception) : pass
-class InvalidDirectory(InvalidArgs): pass
+# Exceptions, see command_args
+InvalidArgs = ca.InvalidArgs
+InvalidDirectory = ca.InvalidDirectory
 
 
 ## Input and Output functions
@@ -37,18 +70,17 @@ def load_obj(file_source):
         data = pickle.load(file)
     return data
 
-# Loads a charging session as a tab-delimited text file
-def load_txt(file_source):
-    data = pd.read_csv(file_source, sep='\t')
-    import datetime
-    to_time = lambda x: datetime.datetime.strptime(x, "%Y-%m-%d-%H-%M-%S")
-    timeForm = data['time'].apply(to_time)
-    data['time'] = pd.to_datetime(timeForm)
-    data.set_index('time', inplace=True)
-    return data
+# Text session loaders, kept here for callers of this module
+txt_time_format = sl.txt_time_format
+parse_txt_times = sl.parse_txt_times
+load_txt = sl.load_txt
+load_txt_fast = sl.load_txt_fast
+load_txt_batch = sl.load_txt_batch
 
 # Returns tuple of a list of filenames and dataframes in a given directory
 # matching charging profiles
+# directory may also be a session store (see session_store), in which case
+# the sessions packed from matching files are read from the store.
 def get_files(directory=ex_dir):
     # Filename regex
     location_id = "00030"
@@ -59,35 +91,52 @@ def get_files(directory=ex_dir):
     filename = location_id + station_id + "_" + month + day + time + ".*"
     path_regx = directory + filename
 
+    if ss.is_store(directory):
+        import fnmatch
+        store = ss.SessionStore(directory)
+        matches = [i for i, name in enumerate(store.names) \
+                   if fnmatch.fnmatchcase(name, filename)]
+        if matches == []: raise InvalidDirectory
+        return ([directory + store.names[i] for i in matches], \
+                [store.profile(i) for i in matches])
+
     # All files matching regex path
     files = glob.glob(path_regx)
     if files == []: raise InvalidDirectory
 
-    # Figure out type of data. Pickled if file extension is "pkl".
-    # Example filename where last element is file extension.
-    ex_file_list = files[0].split('.')
-    if ex_file_list[-1] == "pkl":
-        pickled = True
-    else:
-        pickled = False
-
     dfs = []
 
     # Check each file and add to invalids list
     for pathname in files:
-        if pickled: df = load_obj(pathname)
-        else: df = load_txt(pathname)
-        dfs.append(df)
+        dfs.append(load_session(pathname))
     
     return (files, dfs)
         
 
+# Writes rows (lists of values for 'columns') to the file filename in
+# directory, in the format of its extension: .csv, .parquet, .feather, .pkl or
+# .xlsx (see result_sinks). Rows are written chunk_size at a time as they are
+# read, so rows from iter_rows never all need to be in memory (except for
+# .xlsx). Returns the number of rows.
+# stats: clean_stats.CleanStats to add the time spent writing to.
+# dtypes: dict of the type of columns, for formats with typed columns, see
+#         result_sinks.Sink and result_dtypes.
+def rows_to_file(rows, columns, filename, directory = "../Output", \
+                 chunk_size = 10000, stats = cs.NoStats, dtypes = None):
+    return rs.write_rows(rows, columns, os.path.join(directory, filename), \
+                         chunk_size, stats, dtypes)
+
+# As rows_to_file, for a csv file whatever the extension of filename.
+def rows_to_csv(rows, columns, filename, directory = "../Output", \
+                chunk_size = 10000, stats = cs.NoStats):
+    sink = rs.CsvSink(os.path.join(directory, filename), columns)
+    return rs.write_chunks(rows, columns, sink, chunk_size, stats)
+
 # Creates an excel document with fileneame in directory with sheet 'Data' of the
 # given dataframe df.
 def df_to_excel(df, filename, directory = "../Output"):
-    writer = pd.ExcelWriter(directory+"/"+filename+'.xlsx')
-    df.to_excel(writer, 'Data')
-    writer.save()
+    with pd.ExcelWriter(directory+"/"+filename+'.xlsx') as writer:
+        df.to_excel(writer, sheet_name = 'Data')
 
 # Doesn't work yet. The goal would be to make this automatic.
 # Given a path name and a new pathname, uses 'path' as a template and
@@ -106,201 +155,675 @@ def df_to_excel(df, filename, directory = "../Output"):
  #   return 1
 
 
+# Returns df as a data_cleaner.Entry. df may already be an Entry, as
+# clean_directory gives check functions for sessions read from a store, or a
+# data_cleaner.SessionMetrics for sessions checked from their sidecar.
+def as_entry(df):
+    if isinstance(df, (dc.Entry, dc.SessionMetrics)): return df
+    return dc.df_to_entry(df)
+
 # Returns tuple of (bool, error) where bool is True if data is clean and False
 # otherwise. error indicates the reason for bool.
-def is_clean_df(df):
-    data = dc.df_to_entry(df)
-    is_clean = dc.is_clean(data)
+# config: data_cleaner.CleaningConfig of the criteria, None for the defaults.
+def is_clean_df(df, config = None):
+    data = as_entry(df)
+    is_clean = dc.clean_data(data, config = config)
     return is_clean
     
-# Outputs dataframe of station info. 'id' is index. Also has 'type', 'max_mA',
-# 'fallback_mA', 'site'
-def stations_info_df(filenames = ["_acs_lut.txt"], data_directory = "../Data/"):
-    if filenames == []: raise ValueError( "No files specified" )
-    infos = [] 
-    for filename in filenames:
-        data_curr = pd.read_csv(data_directory+filename, sep='\t')
-        infos.append(data_curr)
-    if len(infos) == 1 :
-        infos[0].set_index('id', inplace=True)
-        return infos[0]
-    else:
-        all_data = pd.concat(infos)
-        all_data = all_data.drop_duplicates(subset = 'id')
-        all_data.set_index('id', inplace=True)
-        return all_data
+# Groups a clean_directory DataFrame by the columns group and subgroup (from
+# 'station_id', 'site', 'day', 'month' and 'error'). Returns a DataFrame
+# indexed by (group, subgroup) with the number of sessions ('count'), the
+# fraction valid, energy totals and gap and length histograms of each. See
+# fleet_rollup.Rollup.query.
+def group_invalids(data, group, subgroup):
+    return fr.rollup_frame(data).query([group, subgroup])
+
+# Outputs dataframe of station info, see station_registry.stations_info_df
+stations_info_df = sr.stations_info_df
 
 ## Functions to pass to clean_directory.
-# Takes a dataframe, returns a list with values or None if no data 
-# should be appended. 
+# Takes a dataframe (or data_cleaner.Entry), returns a list with values or
+# None if no data should be appended. 
 # Has attribute 'cols' which is list of strings corresponding to the non-None
 # return value.
+# Has attribute 'takes_entry' if it may be given a data_cleaner.Entry instead
+# of a dataframe, so clean_directory can make the Entry itself. Only functions
+# using the session's metrics, and not its profile, may be used with
+# sidecar = True, where they are given a data_cleaner.SessionMetrics.
+# Has attribute 'takes_config' if it takes a data_cleaner.CleaningConfig as
+# second argument, 'config', giving the criteria to clean with.
+# Has attribute 'dtypes', a dict of the type of each of 'cols' (as numpy dtype
+# names, or 'str'), so typed formats such as .parquet do not have to guess
+# them from the rows. See result_dtypes.
+# Has attribute 'config_columns' if it only looks at the metrics its config's
+# checks need, so the currents of a profile are only loaded if those do (see
+# CleaningConfig.needs_currents).
 
 # Returns a list with values corresponding to:
 # [error : string, is_valid : bool]
 # according to data_cleaner.clean_data.
 # error is one of:
 # ShortTime, LostDatapoints, LittleEnergyUsed, PowerTooLow
-def clean_df(df):
-    validity = is_clean_df(df)
+def clean_df(df, config = None):
+    validity = is_clean_df(df, config)
     return [validity[1], validity[0]]
 # Corresponding to clean_df. Name of data returned
 clean_df.cols = ['error', 'is_valid']
+clean_df.dtypes = {'error' : 'str', 'is_valid' : 'bool'}
+clean_df.takes_entry = True
+clean_df.takes_config = True
+clean_df.config_columns = True
 
 # Checks if a dataframe has a long duration, if so, return length. Else None.
 def long_df(df):
-    data = dc.df_to_entry(df)
+    data = as_entry(df)
     if data.endTime - data.startTime > np.timedelta64(10, 'h'):
         return [data.endTime - data.startTime]
     else: return None
 long_df.cols = ['length']
+long_df.dtypes = {'length' : 'timedelta64[ns]'}
+long_df.takes_entry = True
 
 # Checks most information available
-def datapoint_length_vals(df):
-    data = dc.df_to_entry(df)
+def datapoint_length_vals(df, config = None):
+    data = as_entry(df)
     tests = (lambda data: dc.session_length(data) / np.timedelta64(1, 'h'),
              lambda data: dc.average_gap(data) / np.timedelta64(1, 's'),
              lambda data: dc.max_gap(data) / np.timedelta64(1, 'm'),
              lambda data: data.energyDemand)
-    results = list(dc.clean_data(data, other_tests = tests))
+    results = list(dc.clean_data(data, other_tests = tests, config = config))
     return results
 # Corresponding to datapoint_length_vals. Name of data returned.
 datapoint_length_vals.cols = ['is_valid', 'error', \
                               'length (hr)', 'average_gap (s)', \
                               'max_gap (min)', 'energy (AV)']
+datapoint_length_vals.dtypes = {'is_valid' : 'bool', 'error' : 'str', \
+                                'length (hr)' : 'float64', \
+                                'average_gap (s)' : 'float64', \
+                                'max_gap (min)' : 'float64', \
+                                'energy (AV)' : 'float64'}
+datapoint_length_vals.takes_entry = True
+datapoint_length_vals.takes_config = True
 
 # Checks information relevant to large and problematic gaps
-def gap_vals(df):
-    data = dc.df_to_entry(df)
+# 'outages' and 'outage_time (min)' are the number and total length of gaps of
+# at least data_cleaner.OutageGap (5 minutes).
+def gap_vals(df, config = None):
+    data = as_entry(df)
     tests = (lambda data: dc.session_length(data) / np.timedelta64(1, 'h'),
              lambda data: dc.max_gap(data, more_info = True),
-             lambda data: data.energyDemand)
-    results = list(dc.clean_data(data, other_tests = tests))
+             lambda data: data.energyDemand,
+             lambda data: dc.outages(data))
+    results = list(dc.clean_data(data, other_tests = tests, config = config))
+    outages = results.pop()
     
     # Deal with gap tuple
     gap_info = results[3]
      # Convert gap length to minute
     results[3] = gap_info[0] / np.timedelta64(1, 'm')
     results.append(gap_info[2])
+    results += [outages[0], outages[1] / np.timedelta64(1, 'm')]
         
     return results
 # Corresponding to datapoint_length_vals. Name of data returned.
 gap_vals.cols = ['is_valid', 'error', 'session_length (hr)',
-                              'max_gap (min)', 'energy (AV)', 'time_max_gap']
+                              'max_gap (min)', 'energy (AV)', 'time_max_gap',
+                              'outages', 'outage_time (min)']
+gap_vals.dtypes = {'is_valid' : 'bool', 'error' : 'str', \
+                   'session_length (hr)' : 'float64', \
+                   'max_gap (min)' : 'float64', 'energy (AV)' : 'float64', \
+                   'time_max_gap' : 'datetime64[ns]', 'outages' : 'int64', \
+                   'outage_time (min)' : 'float64'}
+gap_vals.takes_entry = True
+gap_vals.takes_config = True
+
+# Check functions by name, for the command line
+CheckFunctions = {'clean_df' : clean_df, \
+                  'long_df' : long_df, \
+                  'datapoint_length_vals' : datapoint_length_vals, \
+                  'gap_vals' : gap_vals}
 
 # Helper for clean_directory
-# Given 0003020330_2017-12-21-12-56-50.pkl returns 
-# ['0003020330', '2017', '12', '21', '12', '56', '50']
-def filename_to_list(pathname, directory_len, extension_len, extra_len = 0):
-    filename = pathname[directory_len + extra_len : -extension_len]
-    import re
-    return re.split('_|-|\.', filename)[:-1]
+# Returns the file_index.FileIndex of the charging profile files in directory,
+# sorted by path so output order does not depend on the file system. The
+# index is kept in a cache directory and only rebuilt when files are added
+# or removed. If index is given, it is used instead, as a selection of files.
+def session_index(directory, index = None):
+    if index is None: index = fi.load_index(directory)
+    if len(index) == 0: raise InvalidDirectory
+    return index
 
-# Usage: clean_directory
-# directory: source directory
-# check_fun: function that takes a dataframe and filename
-#            Returns a list of values to be added. Has attribute cols.
-#
-# .pkl files will be processed as pickled dataframes. 
-# Other file types will be processed as tab-delimited csv or text files.
-def clean_directory(directory=ex_dir, \
-                    check_fun = clean_df):
-    
-    # Station info
-    station_df = stations_info_df(filenames = ["_acs_lut.txt",
-                                              "_acs_lut2.txt",
-                                              "_acs_lut3.txt"])
-    station_cols = ['station_type', 'site']
-
-    # Filename regex
-    location_id = "000*0"
-    station_id = "*"
-    month = "201*-*-"
-    day = "*-"
-    time = "*"
-    filename = location_id + station_id + "_" + month + day + time + ".*"
-    path_regx = directory + filename
+# Helper for clean_directory
+# Returns the sorted list of charging profile files in directory.
+def session_files(directory):
+    return session_index(directory).paths
+
+# Row value used in the 'error' column for a file that could not be loaded or
+# checked. 'is_valid' is False and the other check_fun columns are None.
+FileError = "FileError"
+
+# Helper for error_vals and is_error_row
+# Returns the values of columns 'cols' for a file that could not be checked.
+def failed_vals(cols):
+    vals = []
+    for col in cols:
+        if col == 'error': vals.append(FileError)
+        elif col == 'is_valid': vals.append(False)
+        else: vals.append(None)
+    return vals
 
-    # All files matching regex path
-    files = glob.glob(path_regx)
-    if files == []: raise InvalidDirectory
+# Helper for clean_directory
+# Returns the check_fun values for a file that raised 'err'.
+def error_vals(check_fun, err):
+    vals = failed_vals(check_fun.cols)
+    sys.stderr.write("%s failed: %s: %s\n" % (check_fun.__name__, \
+                                              type(err).__name__, err))
+    return vals
+
+# Helper for iter_rows
+# Returns True if row is the row of a file that could not be loaded or checked
+# (see error_vals). Such rows are not cached, as the file may only have failed
+# for a while, such as while it is copied.
+def is_error_row(check_fun, row):
+    if row is None: return False
+    cols = check_fun.cols
+    return row[:len(cols)] == failed_vals(cols)
 
-    # Figure out type of data. Pickled if file extension is "pkl".
-    # Example filename where last element is file extension.
-    ex_file_list = files[0].split('.')
-    if ex_file_list[-1] == "pkl":
-        pickled = True
-    else:
-        pickled = False
+# Helper for clean_directory
+# Returns check_fun(df), or check_fun(df, config) if config is not None.
+def call_check(check_fun, df, config):
+    if config is None: return check_fun(df)
+    return check_fun(df, config)
 
-    # For future reference
-    dir_len = len(directory)
-    ext_len = len(ex_file_list[-1])
-    extra_len = 0
+# Helper for clean_directory
+# Loads and checks one file. item is (pathname, name_list) where name_list is
+# as FileIndex.name_lists gives. Returns the row to add to the output, or
+# None if check_fun returned None. Any error in loading or checking the file
+# gives an error row (see error_vals) instead of stopping the directory.
+# config: data_cleaner.CleaningConfig given to check_fun, or None to call
+#         check_fun without one.
+# stats: clean_stats.CleanStats to add the time of each stage to.
+def check_file(item, stations, check_fun, config = None, stats = cs.NoStats):
+    pathname, name_list = item
+    # Station info from the station registry
+    # Assumes first element is station id.
+    with stats.timer('station'):
+        station_vals = stations.resolve(name_list[0])
+
+    # Only the times are loaded if the checks need nothing else
+    columns = None
+    if config is not None and getattr(check_fun, 'config_columns', False) \
+       and not config.needs_currents:
+        columns = ()
+    try:
+        with stats.timer('load'):
+            df = load_session(pathname, columns)
+            stats.add_bytes(os.path.getsize(pathname))
+        if getattr(check_fun, 'takes_entry', False):
+            with stats.timer('entry'):
+                df = dc.df_to_entry(df)
+        # New data to append
+        with stats.timer('check'):
+            append_val = call_check(check_fun, df, config)
+    except Exception as err:
+        append_val = error_vals(check_fun, err)
 
-    # Return array of invalid data 
-    invalids = []
+    if append_val is None: return None
+    return append_val + station_vals + name_list + [pathname]
 
-    # Check each file and add to invalids list
-    for pathname in files:
-        if pickled: df = load_obj(pathname)
-        else: df = load_txt(pathname)
-        
-        # Filename as list
-        name_list = filename_to_list(pathname, dir_len, ext_len, extra_len)
-        # To ints, instead of strings
-        name_list = list(map(int, name_list))
+# Helper for clean_directory
+# As check_file, for session i of a SessionStore.
+def check_stored(i, store, stations, check_fun, config = None, \
+                 stats = cs.NoStats):
+    name_list = store.name_list(i)
+    with stats.timer('station'):
+        station_vals = stations.resolve(name_list[0])
+    try:
+        with stats.timer('entry'):
+            data = store.entry(i)
+            # Times and currents of the session
+            stats.add_bytes(16 * len(data.times))
+        with stats.timer('check'):
+            append_val = call_check(check_fun, data, config)
+    except Exception as err:
+        append_val = error_vals(check_fun, err)
+
+    if append_val is None: return None
+    return append_val + station_vals + name_list + \
+           [os.path.join(store.path, store.names[i])]
 
-        # Station info
-        # Assumes first element is station id.
+# Helper for clean_directory
+# As check_file, from the sidecar record of a session. item is (row,
+# name_list) where row is the session's row of metrics, a
+# metrics_sidecar.MetricsTable.
+def check_record(item, metrics, stations, check_fun, config = None, \
+                 stats = cs.NoStats):
+    row, name_list = item
+    with stats.timer('station'):
+        station_vals = stations.resolve(name_list[0])
+    try:
+        with stats.timer('entry'):
+            data = metrics.record(row)
+        with stats.timer('check'):
+            append_val = call_check(check_fun, data, config)
+    except Exception as err:
+        append_val = error_vals(check_fun, err)
+
+    if append_val is None: return None
+    return append_val + station_vals + name_list + [metrics.path(row)]
+
+# Helper for iter_rows
+# Returns (check(item, *args), stats) where stats is a CleanStats of the check,
+# including the time of each clean_data check.
+def timed_check(item, check, *args):
+    stats = cs.CleanStats()
+    previous = dc.set_check_timer(stats.add_check_time)
+    try:
+        row = check(item, *args, stats = stats)
+    finally:
+        dc.set_check_timer(previous)
+    return (row, stats)
+
+# Process pool of clean_directory, see worker_pool.run_checks
+MaxChunksize = wp.MaxChunksize
+run_checks = wp.run_checks
+
+# Helper for iter_rows
+# Returns the result_cache key of a file, or None if it can not be read.
+def cache_key(pathname):
+    try: return rc.file_key(pathname)
+    except OSError: return None
+
+# Helper for iter_rows and iter_entries
+# Loads a session file of any format session_loaders knows, such as .pkl,
+# .txt or compressed .pkl.gz, picked for each file. columns as for
+# session_loaders.load.
+def load_session(pathname, columns = None):
+    return sl.load(pathname, columns)
+
+# Helper for iter_rows
+# Returns (check, items, args, names, key) for the sessions of directory, where
+# check(item, *args) gives the row of each item, names are their paths and
+# key(i) is the result_cache key of item i.
+# metrics: metrics_sidecar.MetricsTable of directory to check the sessions
+#          from, or None to load them.
+# config: data_cleaner.CleaningConfig to give check_fun, see check_file.
+def directory_items(directory, stations, check_fun, index = None, \
+                    metrics = None, config = None):
+    if ss.is_store(directory):
+        store = ss.SessionStore(directory)
+        if len(store) == 0: raise InvalidDirectory
+        names = list(store.names)
+        # A session changes only if the store is packed again
+        store_key = cache_key(os.path.join(directory, ss.IndexFile))
+        if metrics is not None:
+            items = [(i, store.name_list(i)) for i in range(len(store))]
+            return (check_record, items, \
+                    (metrics, stations, check_fun, config), names, \
+                    lambda i: store_key)
+        return (check_stored, range(len(store)), \
+                (store, stations, check_fun, config), names, \
+                lambda i: store_key)
+
+    index = session_index(directory, index)
+    files = index.paths
+    if metrics is not None:
+        dir_len = len(index.directory)
+        items = [(metrics.row(path[dir_len:]), name_list) for path, name_list \
+                 in zip(files, index.name_lists())]
+        return (check_record, items, (metrics, stations, check_fun, config), \
+                files, lambda i: cache_key(files[i]))
+    items = list(zip(files, index.name_lists()))
+    args = (stations, check_fun, config)
+    return (check_file, items, args, files, lambda i: cache_key(files[i]))
+
+# Names of the columns of rows given by iter_rows and clean_directory
+def result_columns(check_fun):
+    station_cols = ['station_type', 'site']
+    return check_fun.cols + \
+           station_cols + \
+           ['station_id', 'year', 'month', 'day', \
+            'hour', 'min', 'sec', 'path']
+
+# Types of the columns of result_columns(check_fun), for rows_to_file. Columns
+# of check_fun without a type in its 'dtypes' are left out.
+def result_dtypes(check_fun):
+    dtypes = dict(getattr(check_fun, 'dtypes', {}))
+    dtypes.update({'station_type' : 'str', 'site' : 'str', 'path' : 'str'})
+    dtypes.update((col, 'int64') for col in \
+                  ['station_id', 'year', 'month', 'day', 'hour', 'min', 'sec'])
+    return dtypes
+
+# Usage: iter_entries
+# directory: source directory, as for clean_directory
+#
+# Yields (path, data_cleaner.Entry) for each session of directory, one at a
+# time. Files that can not be loaded are skipped with a message.
+def iter_entries(directory=ex_dir):
+    if ss.is_store(directory):
+        store = ss.SessionStore(directory)
+        for i in range(len(store)):
+            yield (os.path.join(directory, store.names[i]), store.entry(i))
+        return
+
+    index = session_index(directory)
+    for pathname in index.paths:
         try:
-            station_info = list(station_df.loc[name_list[0], ['type', 'site']])
-        # Only used if not found in station info file
-        except KeyError:
-            n = int(name_list[0] / 10 ** 6)
-            if n == 2: site = "JPL"
-            elif n == 3: site = "Caltech"
-            elif n == 6: site = "MVLA"
-            else: site = "NaN"
-            station_info = ["NaN", site]
+            df = load_session(pathname)
+        except Exception as err:
+            sys.stderr.write("Skipping %s: %s: %s\n" % (pathname, \
+                             type(err).__name__, err))
+            continue
+        yield (pathname, dc.df_to_entry(df))
+
+# Usage: iter_rows
+# Same arguments as clean_directory. Yields the rows of clean_directory one at
+# a time, in the same order, so only a window of sessions is in memory at
+# once. Columns are given by result_columns(check_fun).
+# With a cache, the cache is saved once every row has been read.
+# stats: clean_stats.CleanStats to record timings and counts in, or None to
+#        record nothing.
+def iter_rows(directory=ex_dir, \
+              check_fun = clean_df, \
+              workers = 1, \
+              chunksize = None, \
+              cache = None, \
+              stats = None, \
+              index = None, \
+              sidecar = False, \
+              config = None):
+    if config is not None and not getattr(check_fun, 'takes_config', False):
+        raise ValueError("%s does not take a config" % check_fun.__name__)
+    # Timing is only done if stats is given
+    timed = stats is not None
+    if timed: stats.start()
+    else: stats = cs.NoStats
+    
+    # Station info
+    with stats.timer('station_table'):
+        stations = sr.load_registry(["_acs_lut.txt",
+                                     "_acs_lut2.txt",
+                                     "_acs_lut3.txt"])
+
+    metrics = None
+    if sidecar:
+        if not getattr(check_fun, 'takes_entry', False):
+            raise ValueError("%s can not be checked from the sidecar, as it " \
+                             "needs a dataframe" % check_fun.__name__)
+        # Only sessions changed since the sidecar was written are loaded
+        with stats.timer('sidecar'):
+            metrics = ms.extract(directory, workers)
+
+    with stats.timer('find_files'):
+        check, items, args, names, key = directory_items(directory, \
+                                                         stations, check_fun, \
+                                                         index, metrics, \
+                                                         config)
+    if timed:
+        # Each check returns its own CleanStats, as it may run in a worker
+        args = (check,) + args
+        check = timed_check
+        error_col = check_fun.cols.index('error') \
+                    if 'error' in check_fun.cols else None
+
+    if cache is None:
+        results = None
+        todo = None
+        checked = run_checks(check, items, args, workers, chunksize)
+    else:
+        # Rows kept from the last run, and which items still need checking
+        with stats.timer('cache'):
+            # Rows of another config are not kept
+            extra = () if config is None else (config,)
+            results = rc.ResultCache(cache, \
+                                     rc.fingerprint(check_fun, \
+                                                    stations.fingerprint(), \
+                                                    *extra), \
+                                     directory)
+            keys = [key(i) for i in range(len(items))]
+            todo = [i for i in range(len(items)) \
+                    if results.get(names[i], keys[i]) is rc.ResultCache.Missing]
+        checked = run_checks(check, [items[i] for i in todo], args, \
+                             workers, chunksize)
+        todo = set(todo)
+
+    for i in range(len(items)):
+        if todo is None or i in todo:
+            row = next(checked)
+            if timed:
+                row, item_stats = row
+                stats.merge(item_stats)
+            if results is not None and keys[i] is not None and \
+               not is_error_row(check_fun, row):
+                results.put(names[i], keys[i], row)
+        else:
+            row = results.get(names[i], keys[i])
+            if timed: stats.cached += 1
+        if timed:
+            stats.sessions += 1
+            if row is not None and error_col is not None:
+                stats.errors[row[error_col]] += 1
+        if row is not None: yield row
+
+    if results is not None:
+        with stats.timer('cache'):
+            results.save()
+    if timed: stats.stop()
 
-        # New data to append
-        append_val = check_fun(df)
+# Usage: clean_directory
+# directory: source directory
+# check_fun: function that takes a dataframe and filename
+#            Returns a list of values to be added. Has attribute cols.
+#            Must be defined at module level if workers is not 1.
+# workers: number of processes to check files with. 1 checks every file in
+#          this process. None uses one process per CPU.
+# chunksize: number of files sent to a worker at a time. None picks a size
+#            giving each worker about 4 chunks, up to MaxChunksize.
+# cache: directory to keep results in between runs (see result_cache). Files
+#        with the same size and modification time as in the last run with the
+#        same check_fun and thresholds are not checked again. Files that could
+#        not be loaded or checked are tried again on every run. None for no
+#        cache.
+# stats: clean_stats.CleanStats to fill with the time spent in each stage and
+#        each clean_data check, counts of each error, bytes read and
+#        sessions/sec. None (the default) times nothing.
+# index: file_index.FileIndex of the files of directory to check, such as
+#        file_index.load_index(directory).select(station = 3020330). None
+#        checks every session file. Not used for session stores.
+# sidecar: check each session from its record in the directory's metrics
+#          sidecar (see metrics_sidecar) instead of loading it. The sidecar is
+#          brought up to date first, loading only the sessions added or
+#          changed since it was written. check_fun must take an Entry and
+#          use only the session's metrics, as clean_df, datapoint_length_vals
+#          and gap_vals do.
+# config: data_cleaner.CleaningConfig of the criteria to clean with, given to
+#         check_fun, which must have attribute 'takes_config'. Checks it
+#         turns off are never run, and with clean_df only the metrics of the
+#         checks left are found, loading the currents only if they need them.
+#         None (the default) leaves the criteria to check_fun.
+#
+# .pkl files will be processed as pickled dataframes. 
+# .txt files will be processed as tab-delimited csv or text files.
+# The format is picked for each file, so a directory may mix them, and files
+# may be compressed (.pkl.gz, .txt.xz, ...). Files of other extensions are
+# recognised from their contents, see session_loaders.
+# If directory is a session store (see session_store), its sessions are
+# checked instead, without reading any session files.
+# Rows are in sorted path order whatever the number of workers.
+# To process the rows without holding them all, use iter_rows.
+def clean_directory(directory=ex_dir, \
+                    check_fun = clean_df, \
+                    workers = 1, \
+                    chunksize = None, \
+                    cache = None, \
+                    stats = None, \
+                    index = None, \
+                    sidecar = False, \
+                    config = None):
+    # Return array of invalid data 
+    invalids = list(iter_rows(directory, check_fun, workers, chunksize, \
+                              cache, stats, index, sidecar, config))
 
-        if append_val != None:
-            invalids.append(append_val + station_info + name_list + [pathname])
+    return pd.DataFrame(invalids, columns = result_columns(check_fun))
 
-    return pd.DataFrame(\
-            invalids, \
-            columns = check_fun.cols + \
-                      station_cols + \
-                      ['station_id', 'year', 'month', 'day', \
-                       'hour', 'min', 'sec', 'path'])
 
+# Helper for station_outages
+# item is (paths, station_ids) of session files. Returns (station ids,
+# data_cleaner.batch_gaps) of the files that could be loaded.
+def chunk_gaps(item, min_gap, edges):
+    paths, station_ids = item
+    loaded = []
+    profiles = []
+    for pathname, station_id in zip(paths, station_ids):
+        try:
+            profiles.append(load_session(pathname, ['mamps_last']))
+        except Exception as err:
+            sys.stderr.write("Skipping %s: %s: %s\n" % (pathname, \
+                             type(err).__name__, err))
+            continue
+        loaded.append(station_id)
+    times, _, offsets = dc.pack_profiles(profiles)
+    return (loaded, dc.batch_gaps(times, offsets, min_gap, edges))
+
+# Usage: station_outages
+# directory: source directory, or session store, as for clean_directory
+# min_gap: smallest gap counted as an outage, a numpy.timedelta64
+# edges: edges of the gap histogram bins, as data_cleaner.GapEdges
+# workers: as for clean_directory
+#
+# Returns a DataFrame indexed by station_id with, for each station, the number
+# of 'sessions', the number of 'outages' (gaps of at least min_gap), their
+# total 'outage_time (min)', the 'longest_outage (min)' and a 'gaps a-b s'
+# column per histogram bin counting every gap of its sessions. Gaps are found
+# with data_cleaner.batch_gaps, MaxChunksize files at a time. Files that can
+# not be loaded are skipped with a message.
+def station_outages(directory=ex_dir, \
+                    min_gap = dc.OutageGap, \
+                    edges = dc.GapEdges, \
+                    workers = 1):
+    if ss.is_store(directory):
+        store = ss.SessionStore(directory)
+        parts = [(store.station_ids, \
+                  dc.batch_gaps(store.times, store.offsets, min_gap, edges))]
+    else:
+        index = session_index(directory)
+        paths = index.paths
+        station_ids = [name_list[0] for name_list in index.name_lists()]
+        items = [(paths[i : i + MaxChunksize], \
+                  station_ids[i : i + MaxChunksize]) \
+                 for i in range(0, len(paths), MaxChunksize)]
+        parts = run_checks(chunk_gaps, items, (min_gap, edges), workers, 1)
+
+    seconds = np.asarray(edges, dtype='timedelta64[ns]') / \
+              np.timedelta64(1, 's')
+    bounds = np.append(seconds, np.inf)
+    labels = ["gaps %g-%g s" % (bounds[k], bounds[k + 1]) \
+              for k in range(seconds.size)]
+    frames = []
+    for ids, gaps in parts:
+        longest = np.zeros(len(ids), dtype=np.int64)
+        np.maximum.at(longest, gaps['session'], \
+                      gaps['duration'].view(np.int64))
+        frame = pd.DataFrame({'station_id' : np.asarray(ids, dtype=np.int64), \
+                              'sessions' : 1, \
+                              'outages' : gaps['outages'], \
+                              'outage_time (min)' : gaps['outage_time'] / \
+                                                    np.timedelta64(1, 'm'), \
+                              'longest_outage (min)' : longest / 60e9})
+        frames.append(pd.concat([frame, pd.DataFrame(gaps['histogram'], \
+                                                     columns = labels)], \
+                                axis = 1))
+    table = pd.concat(frames, ignore_index = True)
+    totals = {column : 'sum' for column in table.columns \
+              if column != 'station_id'}
+    totals['longest_outage (min)'] = 'max'
+    return table.groupby('station_id').agg(totals)
+
+# Packs directory into a session store, see session_store.pack_directory
+pack_directory = ss.pack_directory
+
+
+# Helpers for main, see command_args
+pop_flag = ca.pop_flag
+pop_option = ca.pop_option
+
+
+# Pops the clean_data criteria given in args, such as --min_energy 5, and
+# --only (see the top of this file). Returns the data_cleaner.CleaningConfig
+# of them, or None if none were given. Raises ValueError if one is not valid.
+def config_from_args(args):
+    criteria = {}
+    for criterion in dc.Criteria:
+        value = pop_option(args, "--" + criterion)
+        if value is not None: criteria[criterion] = dc.parse_criterion(value)
+    only = pop_option(args, "--only")
+    if criteria == {} and only is None: return None
+    config = dc.CleaningConfig(**criteria)
+    if only is not None: config = config.only(*only.split(","))
+    return config
 
 def main():
+    args = sys.argv[1:]
+    try:
+        workers = pop_option(args, "--workers", "1")
+        workers = None if workers == "auto" else int(workers)
+        check_name = pop_option(args, "--check", "datapoint_length_vals")
+        if check_name not in CheckFunctions:
+            raise ValueError( "Unknown check %s" % check_name )
+        check_fun = CheckFunctions[check_name]
+        config = config_from_args(args)
+        cache = pop_option(args, "--cache")
+        stats_json = pop_option(args, "--stats-json")
+        rollup_file = pop_option(args, "--rollup")
+    except (ValueError, InvalidArgs) as err:
+        raise InvalidArgs( "%s\n%s" % (err, Usage) )
+    if config is not None and not getattr(check_fun, 'takes_config', False):
+        raise InvalidArgs( "%s takes no criteria\n%s" % (check_name, Usage) )
+    missing = fr.missing_columns(result_columns(check_fun))
+    if rollup_file and missing:
+        raise InvalidArgs( "%s gives no %s for --rollup\n%s" % \
+                           (check_name, ", ".join(missing), Usage) )
+    sidecar = pop_flag(args, "--sidecar")
+    stats = cs.CleanStats() if pop_flag(args, "--stats") or stats_json \
+            else None
     # Verify the correct number of arguments were passed, deal with them
-    if len(sys.argv) == 3:
-        import datetime
+    if len(args) == 2:
         # Deal with passed arguments
         # Source directory, ensure ends with a "/"
-        source = sys.argv[1]
+        source = args[0]
         if source[-1] != "/": source += "/"
         # Output filename
-        new_filename = sys.argv[2] 
+        new_filename = args[1] 
         print("\nChecking all files in: %s\n" % source)
         start = datetime.datetime.now()
 
-        invalids = clean_directory(source, datapoint_length_vals)
+        if config is not None: print("Cleaning with %r\n" % config)
+        # Format from the extension, Excel if there is none
+        if rs.sink_for(new_filename) is None: new_filename += ".xlsx"
+        # Written as the rows are found
+        columns = result_columns(check_fun)
+        rows = iter_rows(source, check_fun, workers, cache = cache, \
+                         stats = stats, sidecar = sidecar, config = config)
+        # Totals kept as the rows go by, see fleet_rollup
+        if rollup_file:
+            rollup = fr.Rollup()
+            rows = rollup.track(rows, columns)
         try:
-            df_to_excel(invalids, new_filename)
-        except PermissionError:
-            input("Please verify the output file is not open, then press Enter")
-            df_to_excel(invalids, new_filename)
+            rows_to_file(rows, columns, new_filename, \
+                         stats = stats or cs.NoStats, \
+                         dtypes = result_dtypes(check_fun))
+        except PermissionError as err:
+            # Never wait for input, so unattended runs do not hang
+            sys.exit("Could not write %s, is it open? %s" % (new_filename, \
+                                                             err))
         time_taken = (datetime.datetime.now() - start).seconds
         minutes = int(time_taken / 60) # minutes
         seconds = time_taken - minutes * 60
-        print("Clean Complete in %.0f min, %.0f sec, in %s.xlsx.\n" % (minutes, seconds, new_filename))
+        print("Clean Complete in %.0f min, %.0f sec, in %s.\n" % (minutes, seconds, new_filename))
+        if rollup_file: rollup.save(rollup_file)
+        if stats is not None:
+            print(stats.summary())
+            if stats_json: stats.dump_json(stats_json)
     else: raise InvalidArgs( Usage )
 
     
@@ -0,0 +1,155 @@
+"""
+This module indexes the session files of a directory by the metadata in their
+names, so sessions can be picked by station and date without globbing and
+parsing the names again.
+
+Session files are named like 0003020330_2017-12-21-12-56-50.pkl: station id,
+then start time, then extension. FileIndex parses every name of a directory in
+one vectorized pass into typed columns:
+    path, station_id, start (numpy.datetime64[s]), year, month, day, hour,
+    min, sec, extension and size (bytes)
+sorted by path.
+
+load_index keeps the index of a directory in a cache directory (by default
+result_cache.DefaultCacheDir, outside the directory, which is only read), and
+only lists the directory again when its modification time changes (files
+added, removed or renamed).
+"""
+import os
+import pickle
+import numpy as np
+import pandas as pd
+
+import result_cache as rc
+
+# Name of the indexes in a cache directory, see result_cache.cache_file
+IndexKind = "file_index"
+
+# Names clean_directory reads. Same files as its "000*0*_201*-*-*-*.*" glob,
+# with each field captured.
+NamePattern = r"^(000\d*0\d*)_(201\d)-(\d+)-(\d+)-(\d+)-(\d+)-(\d+)\.(.+)$"
+
+NameColumns = ['station_id', 'year', 'month', 'day', 'hour', 'min', 'sec']
+
+
+class FileIndex:
+    """
+    Metadata of the session files of a directory.
+
+    Attributes:
+    directory : Directory indexed, ending in "/".
+    table : pandas.DataFrame with one row per file and the columns listed in
+    the module docstring.
+    """
+
+    def __init__(self, directory, table):
+        self.directory = directory
+        self.table = table
+
+    @classmethod
+    def build(cls, directory):
+        """ Lists and parses the session files of directory. """
+        if directory[-1:] != "/": directory += "/"
+        names = []
+        sizes = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    names.append(entry.name)
+                    sizes.append(entry.stat().st_size)
+        names = pd.Series(names, dtype=object)
+        sizes = np.array(sizes, dtype=np.int64)
+
+        parts = names.str.extract(NamePattern)
+        matched = parts[0].notna().values
+        parts = parts[matched]
+        table = pd.DataFrame({'path' : directory + names[matched].values})
+        for i, col in enumerate(NameColumns):
+            table[col] = parts[i].astype(np.int64).values
+        table['start'] = pd.to_datetime(\
+            table[NameColumns[1:]].rename(columns = {'min' : 'minute', \
+                                                     'sec' : 'second'}), \
+            errors = 'coerce').values.astype('datetime64[s]')
+        table['extension'] = parts[7].values
+        table['size'] = sizes[matched]
+        table = table.sort_values('path', kind = 'stable').reset_index(drop = True)
+        return cls(directory, table)
+
+    def __len__(self):
+        return self.table.shape[0]
+
+    @property
+    def paths(self):
+        return list(self.table['path'])
+
+    def name_lists(self):
+        """
+        Returns [station_id, year, month, day, hour, min, sec] of each file as
+        ints, as clean_directory rows hold them.
+        """
+        return self.table[NameColumns].values.tolist()
+
+    def select(self, station = None, start = None, end = None, \
+               extension = None):
+        """
+        Returns a FileIndex of the files matching all given criteria.
+
+        station - A station id, or a list of them.
+        start, end - Only sessions starting at or after start and before end.
+        Anything pandas.Timestamp accepts.
+        extension - An extension such as "pkl", or a list of them.
+        """
+        table = self.table
+        keep = np.ones(len(self), dtype=bool)
+        if station is not None:
+            keep &= np.isin(table['station_id'].values, np.atleast_1d(station))
+        if start is not None:
+            keep &= table['start'].values >= \
+                    np.datetime64(pd.Timestamp(start), 's')
+        if end is not None:
+            keep &= table['start'].values < \
+                    np.datetime64(pd.Timestamp(end), 's')
+        if extension is not None:
+            keep &= np.isin(table['extension'].values, np.atleast_1d(extension))
+        return FileIndex(self.directory, \
+                         table[keep].reset_index(drop = True))
+
+
+def load_index(directory, cache = True, cache_dir = None):
+    """
+    Returns the FileIndex of directory. If cache, reuses the index saved in
+    cache_dir (default result_cache.DefaultCacheDir) when the directory has
+    not changed since, and saves a new one otherwise. A file rewritten in
+    place keeps its old size in a cached index.
+
+    cache_dir should not be inside directory, as saving the index there would
+    change the directory.
+    """
+    if directory[-1:] != "/": directory += "/"
+    if not cache: return FileIndex.build(directory)
+
+    if cache_dir is None: cache_dir = rc.DefaultCacheDir
+    cache_path = rc.cache_file(cache_dir, IndexKind, directory, ".pkl")
+    # Taken before listing, so a change made while listing is seen next time
+    stat = os.stat(directory)
+    version = (stat.st_ino, stat.st_mtime_ns)
+    try:
+        with open(cache_path, 'rb') as file:
+            cached_version, table = pickle.load(file)
+        if cached_version == version: return FileIndex(directory, table)
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+        pass
+
+    index = FileIndex.build(directory)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok = True)
+        temp = cache_path + ".tmp"
+        with open(temp, 'wb') as file:
+            pickle.dump((version, index.table), file, \
+                        protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, cache_path)
+    # The cache is only a speed up, so a cache directory that can not be
+    # written is fine
+    except OSError:
+        pass
+    return index
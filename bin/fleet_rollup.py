@@ -0,0 +1,273 @@
+"""
+This module keeps fleet-wide totals of cleaned sessions, so reports and plots
+can group results without going back over every row.
+
+A Rollup keeps one group per (station_id, site, day, error) with:
+    count - number of sessions.
+    energy - sum of their energy, in AV.
+    gap histogram - number of sessions by max gap, see GapBins.
+    length histogram - number of sessions by length, see LengthBins.
+Rows are added as they are found, for example while clean_directory's rows
+are written out:
+
+    rollup = Rollup()
+    rows = rollup.track(dir_c.iter_rows(directory), columns)
+    dir_c.rows_to_file(rows, columns, "results.csv")
+    rollup.query(['site', 'error'])
+
+Queries only go over the groups, never the rows.
+"""
+import pickle
+import numpy as np
+import pandas as pd
+
+import data_cleaner as dc
+
+# Edges of the max gap histogram, in minutes, and of the length histogram,
+# in hours. A session falls in bin k if edges[k] <= value < edges[k + 1].
+GapBins = (0, 1, 2, 5, 10, 30, 60, np.inf)
+LengthBins = (0, 1 / 3.0, 1, 2, 4, 8, 12, 20, np.inf)
+
+KeyColumns = ['station_id', 'site', 'day', 'error']
+
+# Columns the rows added to a Rollup must have, see Rollup.add_frame
+RowColumns = ['station_id', 'site', 'year', 'month', 'day', 'error']
+
+# Names of the energy, max gap (min) and length (hr) columns in the rows of
+# the directory_cleaner check functions, in the order they are looked for.
+EnergyColumns = ['energy (AV)']
+GapColumns = ['max_gap (min)']
+LengthColumns = ['length (hr)', 'session_length (hr)']
+
+
+def _find_column(columns, names):
+    for name in names:
+        if name in columns: return name
+    return None
+
+
+def _day_key(day):
+    """ numpy.datetime64[D] of a day, None if not known (NaT != NaT). """
+    if pd.isna(day): return None
+    return np.datetime64(day, 'D')
+
+
+def _key_value(value):
+    """ value, or None if it is NaN or None, as NaN != NaN. """
+    if pd.isna(value): return None
+    return value
+
+
+def missing_columns(columns):
+    """ Returns the RowColumns that are not in columns, in order. """
+    return [column for column in RowColumns if column not in columns]
+
+
+def _histogram_labels(prefix, edges, unit):
+    return ["%s %g-%g %s" % (prefix, edges[k], edges[k + 1], unit) \
+            for k in range(len(edges) - 1)]
+
+
+class Rollup:
+    """
+    Totals of cleaned sessions by (station_id, site, day, error).
+
+    Attributes:
+    gap_bins, length_bins : Histogram edges, see GapBins and LengthBins.
+    keys : List of the (station_id, site, day, error) of each group, with day
+    a numpy.datetime64[D].
+    counts, energy : numpy arrays of each group's count and energy sum.
+    gap_hist, length_hist : numpy arrays with one histogram row per group.
+    """
+
+    def __init__(self, gap_bins = GapBins, length_bins = LengthBins):
+        self.gap_bins = np.asarray(gap_bins, dtype=float)
+        self.length_bins = np.asarray(length_bins, dtype=float)
+        self.keys = []
+        self._group = {}
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.energy = np.zeros(0)
+        self.gap_hist = np.zeros((0, self.gap_bins.size - 1), dtype=np.int64)
+        self.length_hist = np.zeros((0, self.length_bins.size - 1), \
+                                    dtype=np.int64)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _group_ids(self, keys):
+        """ Returns the group of each key, adding groups for new ones. """
+        ids = np.empty(len(keys), dtype=np.int64)
+        for i, key in enumerate(keys):
+            group = self._group.get(key)
+            if group is None:
+                group = len(self.keys)
+                self._group[key] = group
+                self.keys.append(key)
+            ids[i] = group
+        # Room for the new groups
+        grow = len(self.keys) - self.counts.size
+        if grow > 0:
+            self.counts = np.concatenate((self.counts, \
+                                          np.zeros(grow, dtype=np.int64)))
+            self.energy = np.concatenate((self.energy, np.zeros(grow)))
+            self.gap_hist = np.vstack((self.gap_hist, np.zeros(\
+                (grow, self.gap_hist.shape[1]), dtype=np.int64)))
+            self.length_hist = np.vstack((self.length_hist, np.zeros(\
+                (grow, self.length_hist.shape[1]), dtype=np.int64)))
+        return ids
+
+    def _add_histogram(self, hist, groups, values, edges):
+        values = np.asarray(values, dtype=float)
+        # NaN, as in error rows, is left out
+        known = ~np.isnan(values)
+        bins = np.searchsorted(edges, values[known], side = 'right') - 1
+        inside = (bins >= 0) & (bins < hist.shape[1])
+        np.add.at(hist, (groups[known][inside], bins[inside]), 1)
+
+    def add_frame(self, df):
+        """
+        Adds the rows of a DataFrame with clean_directory's columns. Needs
+        'station_id', 'site', 'year', 'month', 'day' and 'error' (RowColumns),
+        or raises ValueError. Energy, max gap and length are added if the
+        check function gave them. Rows of an impossible date have day None.
+        """
+        missing = missing_columns(df.columns)
+        if missing:
+            raise ValueError("Rows have no %s to roll up" % ", ".join(missing))
+        if df.shape[0] == 0: return
+        days = pd.to_datetime(pd.DataFrame({'year' : df['year'], \
+                                            'month' : df['month'], \
+                                            'day' : df['day']}), \
+                              errors = 'coerce').values.astype('datetime64[D]')
+        key_frame = pd.DataFrame({'station_id' : df['station_id'].values, \
+                                  'site' : df['site'].values, \
+                                  'day' : days, \
+                                  'error' : df['error'].values})
+        # Groups numbered in order of first row, as drop_duplicates keeps
+        codes = key_frame.groupby(KeyColumns, dropna = False, \
+                                  sort = False).ngroup().values
+        unique_keys = [(_key_value(station), _key_value(site), \
+                        _day_key(day), _key_value(error)) for \
+                       station, site, day, error in \
+                       key_frame.drop_duplicates().itertuples(index = False)]
+        groups = self._group_ids(unique_keys)[codes]
+
+        np.add.at(self.counts, groups, 1)
+        columns = df.columns
+        energy = _find_column(columns, EnergyColumns)
+        if energy is not None:
+            values = pd.to_numeric(df[energy], errors = 'coerce').values
+            np.add.at(self.energy, groups, np.nan_to_num(values))
+        gap = _find_column(columns, GapColumns)
+        if gap is not None:
+            self._add_histogram(self.gap_hist, groups, pd.to_numeric(\
+                df[gap], errors = 'coerce').values, self.gap_bins)
+        length = _find_column(columns, LengthColumns)
+        if length is not None:
+            self._add_histogram(self.length_hist, groups, pd.to_numeric(\
+                df[length], errors = 'coerce').values, self.length_bins)
+
+    def add_rows(self, rows, columns):
+        """ Adds rows (lists of values for 'columns'), as iter_rows gives. """
+        self.add_frame(pd.DataFrame(rows, columns = columns))
+
+    def track(self, rows, columns, chunk_size = 10000):
+        """
+        Yields rows unchanged, adding them chunk_size at a time as they pass.
+        The last rows are added once every row has been read. Raises
+        ValueError at once, before any row is read, if columns lack one of
+        RowColumns.
+        """
+        missing = missing_columns(columns)
+        if missing:
+            raise ValueError("Rows have no %s to roll up" % ", ".join(missing))
+        return self._track(rows, columns, chunk_size)
+
+    def _track(self, rows, columns, chunk_size):
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                self.add_rows(chunk, columns)
+                chunk = []
+            yield row
+        if chunk: self.add_rows(chunk, columns)
+
+    def merge(self, other):
+        """ Adds the groups of another Rollup with the same bins. """
+        if not (np.array_equal(self.gap_bins, other.gap_bins) and \
+                np.array_equal(self.length_bins, other.length_bins)):
+            raise ValueError("Rollups have different histogram bins")
+        groups = self._group_ids(other.keys)
+        np.add.at(self.counts, groups, other.counts)
+        np.add.at(self.energy, groups, other.energy)
+        np.add.at(self.gap_hist, groups, other.gap_hist)
+        np.add.at(self.length_hist, groups, other.length_hist)
+
+    def groups(self):
+        """
+        Returns a DataFrame with one row per group: the key columns, 'month'
+        (the day's month), 'count', 'energy (AV)' and a column per histogram
+        bin.
+        """
+        if self.keys == []:
+            keys = pd.DataFrame([], columns = KeyColumns)
+        else:
+            keys = pd.DataFrame(self.keys, columns = KeyColumns)
+        keys['day'] = np.asarray(keys['day'], dtype='datetime64[D]')
+        keys['month'] = keys['day'].values.astype('datetime64[M]')
+        table = keys.assign(**{'count' : self.counts, \
+                               'energy (AV)' : self.energy})
+        gap_labels = _histogram_labels("max_gap", self.gap_bins, "min")
+        length_labels = _histogram_labels("length", self.length_bins, "hr")
+        return pd.concat([table, \
+            pd.DataFrame(self.gap_hist, columns = gap_labels), \
+            pd.DataFrame(self.length_hist, columns = length_labels)], \
+            axis = 1)
+
+    def query(self, by, start = None, end = None, **equals):
+        """
+        Returns the totals grouped by the columns 'by' (from 'station_id',
+        'site', 'day', 'month' and 'error'), as a DataFrame indexed by them.
+        Adds 'valid_fraction' and 'mean energy (AV)' to the columns of groups.
+
+        start, end - Only days on or after start and before end.
+        equals - Only groups with these values, such as site = "Caltech" or
+        error = [dc.BigGap, dc.ShortTime].
+        """
+        table = self.groups()
+        keep = np.ones(table.shape[0], dtype=bool)
+        if start is not None:
+            keep &= table['day'].values >= np.datetime64(start, 'D')
+        if end is not None:
+            keep &= table['day'].values < np.datetime64(end, 'D')
+        for column, value in equals.items():
+            keep &= np.isin(table[column].values, np.atleast_1d(value))
+        table = table[keep]
+
+        if isinstance(by, str): by = [by]
+        table = table.assign(valid = np.where(table['error'] == dc.ValidData, \
+                                              table['count'], 0))
+        sums = table.drop(columns = [c for c in KeyColumns + ['month'] \
+                                     if c not in by]).groupby(\
+                                         by, dropna = False).sum()
+        sums.insert(1, 'valid_fraction', sums.pop('valid') / sums['count'])
+        sums.insert(3, 'mean energy (AV)', sums['energy (AV)'] / sums['count'])
+        return sums
+
+    def save(self, filename):
+        with open(filename, 'wb') as file:
+            pickle.dump(self, file, protocol = pickle.HIGHEST_PROTOCOL)
+
+
+def load_rollup(filename):
+    """ Returns the Rollup saved to filename with Rollup.save. """
+    with open(filename, 'rb') as file:
+        return pickle.load(file)
+
+
+def rollup_frame(df, gap_bins = GapBins, length_bins = LengthBins):
+    """ Returns a Rollup of a clean_directory DataFrame. """
+    rollup = Rollup(gap_bins, length_bins)
+    rollup.add_frame(df)
+    return rollup
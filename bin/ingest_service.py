@@ -0,0 +1,616 @@
+"""
+This module is a local service that takes charging sessions from many
+stations over a socket and cleans them as they complete.
+
+Stations connect to the service over TCP and send one JSON message per line.
+Times are int nanoseconds since the epoch and currents are in mA.
+    {"type": "upload", "station": 3020330, "session": "a", "times": [...],
+     "mamps": [...]}
+        A whole session.
+    {"type": "samples", "station": 3020330, "session": "a", "times": [...],
+     "mamps": [...]}
+        Datapoints of a live session, in time order. Only running values are
+        kept (see data_cleaner.SessionValidator), not the datapoints.
+    {"type": "end", "station": 3020330, "session": "a"}
+        The live session is over.
+    {"type": "metrics"}
+        Asks for the service's metrics.
+The service answers on the same connection with
+    {"type": "flag", "station": ..., "session": ..., "error": "BigGap"}
+        As soon as a live session is found BigGap or LongTime.
+    {"type": "verdict", "station": ..., "session": ..., "is_valid": false,
+     "error": "ShortTime", "flags": [...]}
+        Once a session completes and is cleaned, as clean_data gives.
+    {"type": "metrics", ...}
+        See Metrics.to_dict.
+    {"type": "error", "error": "..."}
+        For a message that is not one of the above, which is skipped.
+
+Completed sessions wait in a bounded queue and are cleaned a batch at a time
+in worker processes, so cleaning never blocks the event loop. When the
+workers fall behind, the queue fills and the service stops reading from the
+stations' connections until there is room, which slows the stations down.
+Answers wait for each station to read them, and a station more than
+MaxOutbox messages behind is disconnected.
+
+A load generator of fake stations sending synthetic sessions (see
+synthetic_sessions) is included, to measure sustained sessions/sec:
+
+    python ingest_service.py serve [--port N] [--workers N]
+    python ingest_service.py load n_stations n_sessions [--port N] [--stream]
+    python ingest_service.py bench n_stations n_sessions [--workers N]
+        [--stream]
+
+'bench' runs the service and the load generator in one process.
+"""
+# For arguments passed to library if name = main
+import sys
+import asyncio
+import collections
+import concurrent.futures
+import json
+import multiprocessing
+import time
+import numpy as np
+import pandas as pd
+
+import data_cleaner as dc
+import command_args as ca
+import synthetic_sessions as synth
+
+Usage = " \n Usage: python %s serve [--port N] [--workers N]" % sys.argv[0] \
+        + " \n        python %s load n_stations n_sessions" % sys.argv[0] \
+        + " [--port N] [--stream]" \
+        + " \n        python %s bench n_stations n_sessions" % sys.argv[0] \
+        + " [--workers N] [--stream]"
+
+Host = "127.0.0.1"
+DefaultPort = 8765
+
+# Longest message line, in bytes. An upload of a day of 1 s datapoints fits.
+MaxLine = 2 ** 24
+
+# Most messages waiting to be sent to a station, see Connection
+MaxOutbox = 10000
+
+
+def clean_sessions(sessions, criteria = ()):
+    """
+    Cleans a batch of sessions in a worker process. Each session is either
+    (times, currents) arrays or a SessionValidator. criteria are passed to
+    clean_data after the session. Returns [(is_clean, error)] in order.
+    """
+    results = []
+    for session in sessions:
+        try:
+            if isinstance(session, dc.SessionValidator):
+                data = session
+            else:
+                times, currents = session
+                data = dc.arrays_to_entry(times.view('datetime64[ns]'), \
+                                          currents)
+            results.append(tuple(dc.clean_data(data, *criteria)[:2]))
+        except Exception as err:
+            results.append((False, "%s: %s" % (type(err).__name__, err)))
+    return results
+
+
+# Fields of each type of message from a station, see the module docstring
+MessageFields = {'upload' : ('station', 'session', 'times', 'mamps'), \
+                 'samples' : ('station', 'session', 'times', 'mamps'), \
+                 'end' : ('station', 'session'), \
+                 'metrics' : ()}
+
+
+def check_message(message):
+    """
+    Returns the type of a message from a station (parsed JSON), or raises
+    ValueError if it is not one the service takes.
+    """
+    if not isinstance(message, dict):
+        raise ValueError("Messages must be JSON objects")
+    kind = message.get('type')
+    if kind not in MessageFields:
+        raise ValueError("Unknown message type %r" % (kind,))
+    for field in MessageFields[kind]:
+        if field not in message:
+            raise ValueError("%s message has no %s" % (kind, field))
+    for field in ('station', 'session'):
+        if field not in message: continue
+        value = message[field]
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            raise ValueError("%s must be a number or a string" % field)
+    if 'times' in message:
+        times, mamps = message['times'], message['mamps']
+        if not isinstance(times, list) or not isinstance(mamps, list) or \
+           len(times) != len(mamps):
+            raise ValueError("times and mamps must be lists of the same " \
+                             "length")
+    return kind
+
+
+def message_arrays(message):
+    """
+    Returns (times, mamps) of an upload or samples message that passed
+    check_message, as int64 and float64 arrays. Raises ValueError if times
+    are not ints in int64 range, or mamps are not finite numbers.
+    """
+    times = np.array(message['times'])
+    mamps = np.array(message['mamps'])
+    if times.size == 0:
+        return (np.array([], dtype=np.int64), np.array([], dtype=float))
+    # Lists of ints too large for int64 give object arrays, and lists with
+    # floats, bools or strings give arrays of those
+    if times.ndim != 1 or times.dtype.kind != 'i':
+        raise ValueError("times must be int nanoseconds in int64 range")
+    if mamps.ndim != 1 or mamps.dtype.kind not in 'iuf':
+        raise ValueError("mamps must be numbers")
+    mamps = mamps.astype(float)
+    if not np.all(np.isfinite(mamps)):
+        raise ValueError("mamps must be finite")
+    return (times.astype(np.int64), mamps)
+
+
+class Metrics:
+    """
+    Counts and latencies of a running service.
+
+    Attributes:
+    received : Sessions completed by stations.
+    cleaned : Sessions given a verdict.
+    errors : dict of verdict error to count.
+    queue_depth : Sessions waiting to be cleaned.
+    max_queue_depth : Largest queue_depth seen.
+    batches : Batches sent to the workers.
+    latencies : Seconds from each of the last LatencyWindow sessions
+    completing to its verdict.
+    """
+    LatencyWindow = 10000
+
+    def __init__(self):
+        self.received = 0
+        self.cleaned = 0
+        self.errors = collections.defaultdict(int)
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.batches = 0
+        self.latencies = collections.deque(maxlen = self.LatencyWindow)
+        self._started = time.perf_counter()
+
+    def to_dict(self):
+        seconds = time.perf_counter() - self._started
+        latencies = np.array(self.latencies)
+        # null (NaN is not JSON) until a session is cleaned
+        if latencies.size == 0:
+            mean = p50 = p95 = top = None
+        else:
+            mean = float(np.mean(latencies))
+            p50, p95 = map(float, np.percentile(latencies, [50, 95]))
+            top = float(np.max(latencies))
+        return {'type' : 'metrics', \
+                'seconds' : seconds, \
+                'received' : self.received, \
+                'cleaned' : self.cleaned, \
+                'sessions_per_sec' : self.cleaned / seconds, \
+                'queue_depth' : self.queue_depth, \
+                'max_queue_depth' : self.max_queue_depth, \
+                'batches' : self.batches, \
+                'latency_mean' : mean, \
+                'latency_p50' : p50, \
+                'latency_p95' : p95, \
+                'latency_max' : top, \
+                'errors' : dict(self.errors)}
+
+
+class Connection:
+    """
+    Sends messages to one station, in order, waiting for it to read them.
+    Messages wait in a queue of at most MaxOutbox, and a station that falls
+    that far behind is disconnected, so a stalled station can not make the
+    service buffer without limit.
+
+    Attributes:
+    writer : asyncio.StreamWriter of the connection.
+    pending : Sessions of the station waiting for their verdict.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.pending = 0
+        self._answered = asyncio.Event()
+        self._answered.set()
+        self._outbox = asyncio.Queue(MaxOutbox)
+        self._sender = asyncio.ensure_future(self._send_all())
+
+    def expect(self):
+        """ Counts a session of the station queued to be cleaned. """
+        self.pending += 1
+        self._answered.clear()
+
+    def answer(self, message):
+        """ Sends the verdict of a session counted with expect. """
+        self.send(message)
+        self.pending -= 1
+        if self.pending == 0: self._answered.set()
+
+    def send(self, message):
+        """ Queues message (a dict) to be sent as a line of JSON. """
+        if self.writer.is_closing(): return
+        try:
+            self._outbox.put_nowait(message)
+        except asyncio.QueueFull:
+            sys.stderr.write("Dropping connection: %d messages not read\n" \
+                             % MaxOutbox)
+            self.writer.transport.abort()
+
+    async def _send_all(self):
+        try:
+            while True:
+                message = await self._outbox.get()
+                try:
+                    self.writer.write(json.dumps(message).encode() + b"\n")
+                    await self.writer.drain()
+                finally:
+                    self._outbox.task_done()
+        except ConnectionError:
+            # The station is gone, the messages left are never sent
+            while not self._outbox.empty():
+                self._outbox.get_nowait()
+                self._outbox.task_done()
+
+    async def flush(self):
+        """
+        Waits for the verdicts of the sessions pending, then for the messages
+        queued to be sent.
+        """
+        await self._answered.wait()
+        if not self._sender.done(): await self._outbox.join()
+
+    def close(self):
+        self._sender.cancel()
+        self.writer.close()
+
+
+class IngestService:
+    """
+    Takes sessions from stations and cleans them, see the module docstring.
+
+    Attributes:
+    metrics : Metrics of the service.
+    """
+
+    def __init__(self, workers = 1, queue_size = 1000, batch_size = 64, \
+                 batch_delay = 0.05, criteria = ()):
+        """
+        workers - Number of cleaning processes.
+        queue_size - Most completed sessions waiting to be cleaned before
+        stations are slowed down.
+        batch_size - Most sessions sent to a worker at a time.
+        batch_delay - Longest time in seconds a batch waits to fill.
+        criteria - Criteria as clean_data takes them, in its argument order.
+        Its defaults if empty.
+        """
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.criteria = tuple(criteria)
+        self.metrics = Metrics()
+        self._queue_size = queue_size
+        # Live sessions by (station, session)
+        self._live = {}
+        # Tasks reading each open connection
+        self._connections = set()
+        # Batches being cleaned
+        self._batches = set()
+        self._server = None
+        self._batcher = None
+        self._executor = None
+
+    async def start(self, host = Host, port = DefaultPort):
+        """ Starts listening on host:port and cleaning. """
+        self._queue = asyncio.Queue(self._queue_size)
+        # At most two batches per worker are cleaned or waiting for one
+        self._slots = asyncio.Semaphore(2 * self.workers)
+        # Workers are started fresh rather than forked, as a forked worker
+        # would hold the sockets of the stations connected at the time open
+        self._executor = concurrent.futures.ProcessPoolExecutor(self.workers, \
+            multiprocessing.get_context("spawn"))
+        self._batcher = asyncio.ensure_future(self._run_batches())
+        self._server = await asyncio.start_server(self._handle, host, port, \
+                                                  limit = MaxLine)
+        return self._server
+
+    async def close(self):
+        """ Stops listening and waits for the sessions queued to be cleaned. """
+        self._server.close()
+        await self._queue.join()
+        for task in list(self._connections): task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions = True)
+        await self._server.wait_closed()
+        await asyncio.gather(*self._batches, return_exceptions = True)
+        self._batcher.cancel()
+        self._executor.shutdown()
+
+    async def _handle(self, reader, writer):
+        """ Reads the messages of one connection. """
+        task = asyncio.current_task()
+        self._connections.add(task)
+        connection = Connection(writer)
+        # Live sessions started on this connection, by (station, session)
+        owned = {}
+        try:
+            while True:
+                line = await reader.readline()
+                # Also stops once the station is dropped, see Connection
+                if not line or writer.is_closing(): break
+                try:
+                    await self._read_message(connection, line, owned)
+                except (ValueError, KeyError, TypeError, AttributeError, \
+                        ArithmeticError) as err:
+                    # The station is told, and the message skipped
+                    connection.send({'type' : 'error', 'error' : "%s: %s" \
+                                     % (type(err).__name__, err)})
+            # A station that only closed its side still gets the verdicts
+            # of the sessions it sent
+            await connection.flush()
+        except (ConnectionError, ValueError) as err:
+            sys.stderr.write("Dropping connection: %s: %s\n" % \
+                             (type(err).__name__, err))
+        # The service is closing
+        except asyncio.CancelledError:
+            pass
+        finally:
+            # Sessions left open by this connection are dropped, unless
+            # another connection has taken their key since
+            for key, validator in owned.items():
+                if self._live.get(key) is validator: del self._live[key]
+            self._connections.discard(task)
+            connection.close()
+
+    async def _read_message(self, connection, line, owned):
+        """
+        Acts on one message line of a connection. Raises ValueError, KeyError,
+        TypeError, AttributeError or ArithmeticError for a message that is not
+        valid.
+        """
+        message = json.loads(line)
+        kind = check_message(message)
+        if kind == 'metrics':
+            connection.send(self.metrics.to_dict())
+        elif kind == 'upload':
+            session = message_arrays(message)
+            await self._complete(connection, message, session, [])
+        elif kind == 'samples':
+            self._add_samples(connection, message, owned)
+        elif kind == 'end':
+            key = (message['station'], message['session'])
+            validator = self._live.pop(key, None)
+            owned.pop(key, None)
+            if validator is not None and validator.n_points > 0:
+                await self._complete(connection, message, validator, \
+                                     validator.flags)
+
+    def _add_samples(self, connection, message, owned):
+        """
+        Adds datapoints to a live session, starting it if new. owned is the
+        dict of live sessions of the connection, which a new one is added to.
+        A message that is not valid starts no session.
+        """
+        times, mamps = message_arrays(message)
+        key = (message['station'], message['session'])
+        validator = self._live.get(key)
+        if validator is None:
+            validator = dc.SessionValidator(*self.criteria)
+            self._live[key] = validator
+            owned[key] = validator
+        flags = validator.add_many(times.view('datetime64[ns]'), mamps)
+        for flag in flags:
+            connection.send({'type' : 'flag', \
+                                'station' : message['station'], \
+                                'session' : message['session'], \
+                                'error' : flag})
+
+    async def _complete(self, connection, message, session, flags):
+        """ Queues a completed session, waiting while the queue is full. """
+        self.metrics.received += 1
+        connection.expect()
+        item = (connection, message['station'], message['session'], flags, \
+                session, time.perf_counter())
+        # Waits here when the workers fall behind, so this connection is not
+        # read until there is room
+        await self._queue.put(item)
+        self.metrics.queue_depth = self._queue.qsize()
+        self.metrics.max_queue_depth = max(self.metrics.max_queue_depth, \
+                                           self.metrics.queue_depth)
+
+    async def _run_batches(self):
+        """ Takes batches from the queue and sends them to the workers. """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0: break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), \
+                                                        timeout))
+                except asyncio.TimeoutError:
+                    break
+            self.metrics.queue_depth = self._queue.qsize()
+            # Waits while the workers are busy, so the queue fills
+            await self._slots.acquire()
+            task = asyncio.ensure_future(self._clean_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _clean_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            self.metrics.batches += 1
+            try:
+                results = await loop.run_in_executor(\
+                    self._executor, clean_sessions, \
+                    [item[4] for item in batch], self.criteria)
+            except Exception as err:
+                # Every session still gets a verdict, so no station waits
+                # for one forever
+                sys.stderr.write("Batch failed: %s: %s\n" % \
+                                 (type(err).__name__, err))
+                results = [(False, "%s: %s" % (type(err).__name__, err))] \
+                          * len(batch)
+            now = time.perf_counter()
+            for item, (is_clean, error) in zip(batch, results):
+                connection, station, session, flags, _, completed = item
+                self.metrics.cleaned += 1
+                self.metrics.errors[error] += 1
+                self.metrics.latencies.append(now - completed)
+                connection.answer({'type' : 'verdict', \
+                                   'station' : station, \
+                                   'session' : session, \
+                                   'is_valid' : bool(is_clean), \
+                                   'error' : error, \
+                                   'flags' : list(flags)})
+        finally:
+            self._slots.release()
+            for _ in batch: self._queue.task_done()
+
+
+# Load generator
+
+# Id of the first fake station. Ids starting with 3 are Caltech stations.
+FirstFakeStation = 3900000
+
+async def fake_station(station_id, n_sessions, host = Host, \
+                       port = DefaultPort, stream = False, seed = 0, \
+                       burst = 60):
+    """
+    Connects as station station_id and sends n_sessions synthetic sessions,
+    as uploads, or if stream as live sessions of 'burst' datapoints per
+    message. Returns the verdict messages received, once every session has
+    one.
+    """
+    rng = np.random.default_rng(seed)
+    reader, writer = await asyncio.open_connection(host, port, limit = MaxLine)
+    verdicts = []
+
+    async def read_verdicts():
+        while len(verdicts) < n_sessions:
+            line = await reader.readline()
+            if not line: break
+            message = json.loads(line)
+            if message['type'] == 'verdict': verdicts.append(message)
+    reading = asyncio.ensure_future(read_verdicts())
+
+    start = pd.Timestamp("2018-01-01 06:00:00")
+    for i in range(n_sessions):
+        start += pd.Timedelta(hours = 13)
+        profile = synth.make_session(rng, start)
+        times = np.asarray(profile.index.values, \
+                           dtype='datetime64[ns]').view(np.int64).tolist()
+        mamps = profile['mamps_last'].values.tolist()
+        session = "%d-%d" % (station_id, i)
+        if stream:
+            for j in range(0, len(times), burst):
+                message = {'type' : 'samples', 'station' : station_id, \
+                           'session' : session, \
+                           'times' : times[j : j + burst], \
+                           'mamps' : mamps[j : j + burst]}
+                writer.write(json.dumps(message).encode() + b"\n")
+            message = {'type' : 'end', 'station' : station_id, \
+                       'session' : session}
+        else:
+            message = {'type' : 'upload', 'station' : station_id, \
+                       'session' : session, 'times' : times, 'mamps' : mamps}
+        writer.write(json.dumps(message).encode() + b"\n")
+        # Waits while the service is not reading, see IngestService
+        await writer.drain()
+
+    await reading
+    writer.close()
+    return verdicts
+
+
+async def fetch_metrics(host = Host, port = DefaultPort):
+    """ Returns the metrics message of a running service. """
+    reader, writer = await asyncio.open_connection(host, port, limit = MaxLine)
+    writer.write(b'{"type": "metrics"}\n')
+    message = json.loads(await reader.readline())
+    writer.close()
+    return message
+
+
+async def run_load(n_stations, n_sessions, host = Host, port = DefaultPort, \
+                   stream = False):
+    """
+    Runs n_stations fake stations at once, each sending n_sessions sessions.
+    Returns (sessions, seconds, metrics) where metrics are the service's.
+    """
+    start = time.perf_counter()
+    results = await asyncio.gather(*[fake_station(FirstFakeStation + i, \
+                                                  n_sessions, host, port, \
+                                                  stream, seed = i) \
+                                     for i in range(n_stations)])
+    seconds = time.perf_counter() - start
+    metrics = await fetch_metrics(host, port)
+    return (sum(len(verdicts) for verdicts in results), seconds, metrics)
+
+
+def print_load(sessions, seconds, metrics):
+    print("%d sessions in %.2f s, %.1f sessions/s" % \
+          (sessions, seconds, sessions / seconds))
+    if metrics['latency_mean'] is None: latency = "no sessions cleaned"
+    else:
+        latency = "latency mean %.3f s, p95 %.3f s, max %.3f s" % \
+                  (metrics['latency_mean'], metrics['latency_p95'], \
+                   metrics['latency_max'])
+    print("Service: %d batches, queue depth max %d, %s" % \
+          (metrics['batches'], metrics['max_queue_depth'], latency))
+    for error, count in sorted(metrics['errors'].items()):
+        print("    %-16s %10d" % (error, count))
+
+
+async def serve(port = DefaultPort, workers = 1, report = 10):
+    """ Runs a service until interrupted, printing its metrics every report s. """
+    service = IngestService(workers)
+    await service.start(Host, port)
+    print("Listening on %s:%d" % (Host, port))
+    while True:
+        await asyncio.sleep(report)
+        print(json.dumps(service.metrics.to_dict()))
+
+
+async def bench(n_stations, n_sessions, workers = 1, stream = False, \
+                port = DefaultPort):
+    """ Runs a service and the load generator against it. """
+    service = IngestService(workers)
+    await service.start(Host, port)
+    try:
+        print_load(*await run_load(n_stations, n_sessions, Host, port, stream))
+    finally:
+        await service.close()
+
+
+def main():
+    args = sys.argv[1:]
+    try:
+        port = int(ca.pop_option(args, "--port", DefaultPort))
+        workers = int(ca.pop_option(args, "--workers", "1"))
+    except (ValueError, ca.InvalidArgs) as err:
+        raise ca.InvalidArgs( "%s\n%s" % (err, Usage) )
+    stream = ca.pop_flag(args, "--stream")
+
+    if args == ["serve"]:
+        asyncio.run(serve(port, workers))
+    elif len(args) == 3 and args[0] in ("load", "bench"):
+        n_stations, n_sessions = int(args[1]), int(args[2])
+        if args[0] == "load":
+            print_load(*asyncio.run(run_load(n_stations, n_sessions, Host, \
+                                             port, stream)))
+        else:
+            asyncio.run(bench(n_stations, n_sessions, workers, stream, port))
+    else: raise ca.InvalidArgs( Usage )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+"""
+This module keeps the metrics clean_data looks at for every session of a
+directory in one small sidecar file, so sessions can be cleaned again, with
+new criteria or new other_tests on those metrics, without loading a single
+profile.
+
+The sidecar (kept in a cache directory, by default
+result_cache.DefaultCacheDir, so the directory is only read) has one record
+per session file:
+    start, end - times of the first and last datapoints.
+    n_points - number of datapoints.
+    max_gap, max_gap_position, max_gap_time - as data_cleaner.max_gap with
+    more_info.
+    average_gap, energy (AV), max_power (W) - as data_cleaner.Entry.
+    outages, outage_time - number and total time of gaps of at least
+    data_cleaner.OutageGap.
+along with the file's size and modification time. extract only reads the
+files added or changed (by size and modification time, as result_cache)
+since the sidecar was written, and those that could not be loaded (which
+may have been fixed in place). For a session store the sidecar is read again
+whenever the store is packed again, or when a session of it failed.
+
+    table = extract("../Data/All-Caltech/")
+    dc.clean_data(table.record(0), min_energy = 5)
+    dc.batch_verdict(table.batch_metrics(), min_energy = 5)
+    dir_c.clean_directory(directory, dir_c.gap_vals, sidecar = True)
+"""
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+import data_cleaner as dc
+import file_index as fi
+import result_cache as rc
+import session_loaders as sl
+import session_store as ss
+import command_args as ca
+import worker_pool as wp
+
+Usage = " \n Usage: python %s source_directory [--workers N|auto]" \
+        % sys.argv[0]
+
+# Name of the sidecars in a cache directory, see result_cache.cache_file
+SidecarKind = "session_metrics"
+
+# Bump if the records change, so older sidecars are extracted again
+SidecarVersion = 2
+
+# Files read per task when extracting with workers
+ChunkFiles = 256
+
+# Record columns other than 'name', 'size', 'mtime' and 'failure'
+TimeColumns = ['start', 'end', 'max_gap_time']
+DeltaColumns = ['max_gap', 'average_gap', 'outage_time']
+IntColumns = ['n_points', 'outages']
+ValueColumns = ['max_gap_position', 'energy', 'max_power']
+Columns = TimeColumns + DeltaColumns + IntColumns + ValueColumns
+
+
+def _record_values(data):
+    """ Values of the record of data (an Entry), in Columns order. """
+    gap, position, gap_time = data.max_gap_info
+    outages, outage_time = data.outages
+    return (data.startTime, data.endTime, gap_time, gap, data.average_gap, \
+            outage_time, data.n_points, outages, position, data.energyDemand, \
+            data.max_power)
+
+
+def _chunk_records(paths):
+    """
+    Returns a list with, for each path, the values of its session's record, or
+    the error loading it as a string.
+    """
+    records = []
+    for pathname in paths:
+        try:
+            records.append(_record_values(dc.df_to_entry(sl.load(pathname))))
+        except Exception as err:
+            records.append("%s: %s" % (type(err).__name__, err))
+    return records
+
+
+class MetricsTable:
+    """
+    Records of the sessions of one directory or session store.
+
+    Attributes:
+    directory : Directory or store the sessions are in.
+    names : numpy array of the session file names, relative to directory, or
+    the store's session names.
+    columns : dict of numpy arrays with one value per session: 'size' and
+    'mtime' (the file's key, see result_cache.file_key), 'failure' (why the
+    session could not be loaded, "" if it was) and each of Columns. Times are
+    numpy.datetime64[ns] and gaps numpy.timedelta64[ns].
+    """
+
+    def __init__(self, directory, names, columns):
+        self.directory = directory
+        self.names = np.asarray(names, dtype=str)
+        self.columns = columns
+        self._row = None
+
+    def __len__(self):
+        return self.names.size
+
+    def row(self, name):
+        """ Returns the row of session 'name', or None if it has none. """
+        if self._row is None:
+            self._row = {name : i for i, name in enumerate(self.names)}
+        return self._row.get(name)
+
+    def path(self, i):
+        return os.path.join(self.directory, self.names[i])
+
+    @property
+    def loaded(self):
+        """ numpy bool array, True for each session that could be loaded. """
+        return self.columns['failure'] == ""
+
+    def record(self, i):
+        """
+        Returns the data_cleaner.SessionMetrics of session i, with
+        pandas.Timestamp times as for an Entry read from a file. Raises
+        ValueError if the session could not be loaded.
+        """
+        c = self.columns
+        if c['failure'][i]:
+            raise ValueError("%s could not be loaded: %s" % \
+                             (self.names[i], c['failure'][i]))
+        return dc.SessionMetrics(pd.Timestamp(c['start'][i]), \
+                                 pd.Timestamp(c['end'][i]), \
+                                 int(c['n_points'][i]), \
+                                 (c['max_gap'][i], \
+                                  float(c['max_gap_position'][i]), \
+                                  pd.Timestamp(c['max_gap_time'][i])), \
+                                 c['average_gap'][i], \
+                                 float(c['energy'][i]), \
+                                 float(c['max_power'][i]), \
+                                 (int(c['outages'][i]), c['outage_time'][i]))
+
+    def records(self):
+        """ Yields (path, SessionMetrics) of each session that was loaded. """
+        for i in np.flatnonzero(self.loaded):
+            yield (self.path(i), self.record(i))
+
+    def batch_metrics(self):
+        """
+        Returns a dict of arrays as data_cleaner.batch_metrics gives, for the
+        sessions that were loaded (in the order of 'loaded').
+        """
+        c = self.columns
+        keep = self.loaded
+        return {'n_points' : c['n_points'][keep], \
+                'length' : c['end'][keep] - c['start'][keep], \
+                'max_gap' : c['max_gap'][keep], \
+                'average_gap' : c['average_gap'][keep], \
+                'energy' : c['energy'][keep], \
+                'max_power' : c['max_power'][keep]}
+
+    def save(self, cache_dir = None):
+        """
+        Writes the table to the sidecar in cache_dir (default
+        result_cache.DefaultCacheDir), replacing it once written.
+        """
+        path = sidecar_path(self.directory, cache_dir)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        temp = path + ".tmp"
+        with open(temp, 'wb') as file:
+            np.savez(file, version = SidecarVersion, name = self.names, \
+                     **self.columns)
+        os.replace(temp, path)
+
+
+def sidecar_path(directory, cache_dir = None):
+    """ Path of the sidecar of directory (or store) in cache_dir. """
+    if cache_dir is None: cache_dir = rc.DefaultCacheDir
+    return rc.cache_file(cache_dir, SidecarKind, directory, ".npz")
+
+
+def load_sidecar(directory, cache_dir = None):
+    """
+    Returns the MetricsTable of directory (or store) saved in cache_dir
+    (default result_cache.DefaultCacheDir), or None if there is none or it is
+    of another SidecarVersion.
+    """
+    path = sidecar_path(directory, cache_dir)
+    try:
+        with np.load(path) as saved:
+            if int(saved['version']) != SidecarVersion: return None
+            names = saved['name']
+            columns = {key : saved[key] for key in saved.files \
+                       if key not in ('version', 'name')}
+    except (OSError, ValueError, KeyError):
+        return None
+    return MetricsTable(directory, names, columns)
+
+
+def _table(directory, names, keys, values):
+    """
+    Makes a MetricsTable from each session's name, key ((size, mtime)) and
+    record values (from _record_values, or a failure string).
+    """
+    n = len(names)
+    failed = [isinstance(v, str) for v in values]
+    failures = np.array([v if f else "" for v, f in zip(values, failed)], \
+                        dtype=str).reshape(n)
+    rows = [(None,) * len(Columns) if f else v \
+            for v, f in zip(values, failed)]
+    by_column = list(zip(*rows)) if n > 0 else [()] * len(Columns)
+    columns = {'size' : np.array([k[0] for k in keys], dtype=np.int64), \
+               'mtime' : np.array([k[1] for k in keys], dtype=np.int64), \
+               'failure' : failures}
+    for name, column in zip(Columns, by_column):
+        if name in TimeColumns:
+            array = np.asarray(pd.to_datetime(list(column)), \
+                               dtype='datetime64[ns]')
+        elif name in DeltaColumns:
+            array = np.asarray(pd.to_timedelta(list(column)), \
+                               dtype='timedelta64[ns]')
+        elif name in IntColumns:
+            array = np.array([0 if v is None else v for v in column], \
+                             dtype=np.int64)
+        else:
+            array = np.array([np.nan if v is None else v for v in column], \
+                             dtype=float)
+        columns[name] = array.reshape(n)
+    return MetricsTable(directory, names, columns)
+
+
+def _store_records(directory):
+    """ Returns (names, keys, values) of every session of a session store. """
+    store = ss.SessionStore(directory)
+    # Sessions only change when the store is packed again
+    key = rc.file_key(os.path.join(directory, ss.IndexFile))
+    values = []
+    for i in range(len(store)):
+        try: values.append(_record_values(store.entry(i)))
+        except Exception as err:
+            values.append("%s: %s" % (type(err).__name__, err))
+    return (list(store.names), [key] * len(store), values)
+
+
+def extract(directory, workers = 1, save = True, cache_dir = None):
+    """
+    Returns the MetricsTable of every session of directory (or session
+    store), reading only the sessions added or changed since its sidecar was
+    last saved. Sessions that can not be loaded have a 'failure', and are
+    read again on every call.
+
+    workers: as directory_cleaner.clean_directory.
+    save: write the sidecar if it changed.
+    cache_dir: directory the sidecar is kept in, default
+    result_cache.DefaultCacheDir.
+    """
+    old = load_sidecar(directory, cache_dir)
+    if ss.is_store(directory):
+        key = rc.file_key(os.path.join(directory, ss.IndexFile))
+        if old is not None and len(old) > 0 and np.all(old.loaded) and \
+           np.all(old.columns['size'] == key[0]) and \
+           np.all(old.columns['mtime'] == key[1]):
+            return old
+        table = _table(directory, *_store_records(directory))
+        if save: table.save(cache_dir)
+        return table
+
+    index = fi.load_index(directory)
+    paths = index.paths
+    names = [path[len(index.directory):] for path in paths]
+    keys = []
+    for path in paths:
+        try: keys.append(rc.file_key(path))
+        except OSError: keys.append((-1, -1))
+
+    values = [None] * len(paths)
+    todo = []
+    for i, name in enumerate(names):
+        row = None if old is None else old.row(name)
+        if row is not None and keys[i] != (-1, -1) and \
+           not old.columns['failure'][row] and \
+           (old.columns['size'][row], old.columns['mtime'][row]) == keys[i]:
+            # Record kept from the old sidecar
+            values[i] = _old_values(old, row)
+        else:
+            todo.append(i)
+    if old is not None and todo == [] and len(old) == len(names):
+        return old
+
+    chunks = [todo[i : i + ChunkFiles] for i in range(0, len(todo), \
+                                                      ChunkFiles)]
+    read = wp.run_checks(_chunk_records, \
+                         [[paths[i] for i in chunk] for chunk in chunks], \
+                         (), workers, 1)
+    for chunk, records in zip(chunks, read):
+        for i, record in zip(chunk, records): values[i] = record
+
+    table = _table(index.directory, names, keys, values)
+    if save: table.save(cache_dir)
+    return table
+
+
+def _old_values(table, row):
+    """ Record values of a loaded row of a saved MetricsTable. """
+    c = table.columns
+    return tuple(c[name][row] for name in Columns)
+
+
+def main():
+    args = sys.argv[1:]
+    try:
+        workers = ca.pop_option(args, "--workers", "1")
+        workers = None if workers == "auto" else int(workers)
+    except (ValueError, ca.InvalidArgs) as err:
+        raise ca.InvalidArgs( "%s\n%s" % (err, Usage) )
+    if len(args) != 1: raise ca.InvalidArgs( Usage )
+
+    directory = args[0]
+    if not ss.is_store(directory) and directory[-1] != "/": directory += "/"
+    table = extract(directory, workers)
+    print("%d sessions, %d could not be loaded, in %s" % \
+          (len(table), np.count_nonzero(~table.loaded), \
+           sidecar_path(directory)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+This module makes dense charging profiles smaller, so sessions sampled much
+faster than every 10 s are cheaper to clean and to store.
+
+merge_runs drops datapoints inside runs of (nearly) constant current, where
+they add nothing to the trapezoid integral. With tolerance 0 and the default
+max_span, clean_data gives the same result for the merged profile as for the
+original one:
+    energy - the same, up to float rounding.
+    peak power, length - the same.
+    max gap, its position and time - the same.
+    average gap - the same, as the Entry keeps the original number of points.
+With a tolerance, currents within a band of 'tolerance' mA count as constant.
+The energy is then off by less than tolerance mA over the session's length
+(see energy_tolerance), and the rest is unchanged.
+
+to_grid resamples a profile to a fixed interval instead, keeping the ends of
+gaps longer than the interval and the peak. Gaps shorter than the interval
+become up to 'interval' long, and the energy is that of the profile
+interpolated to the grid. Use metric_errors to see how far any resampled
+profile is from the original.
+
+Both have versions for Entry (merge_entry and grid_entry) that keep the
+original number of datapoints and their positions, see Entry.point_index.
+"""
+import numpy as np
+
+import data_cleaner as dc
+
+
+def _peak_index(currents):
+    """ Index of the first largest current, or None if all are NaN. """
+    if np.all(np.isnan(currents)): return None
+    return int(np.nanargmax(currents))
+
+
+def merge_runs(times, currents, tolerance = 0, max_span = None):
+    """
+    Drops the datapoints inside runs of constant current.
+
+    times (numpy.datetime64 array) and currents (array, mA) - A profile.
+    tolerance (number) - Currents in the same band of this many mA are
+    constant. 0 for exactly equal currents.
+    max_span (numpy.timedelta64) - Datapoints left are less than max_span
+    apart, unless they were next to each other. None for the profile's max
+    gap, which keeps the max gap and where it is.
+
+    Returns (times, currents, index) of the datapoints left, where index is
+    the position of each in the original profile. The first and last
+    datapoints and the first peak are always left. Times keep their unit.
+    """
+    times = np.asarray(times)
+    ns = times.astype('datetime64[ns]').view(np.int64)
+    currents = np.asarray(currents, dtype=float)
+    n = ns.size
+    if n <= 2: return (times, currents, np.arange(n))
+
+    if tolerance == 0: level = currents
+    else: level = np.floor(currents / tolerance)
+    # An inner datapoint is dropped if its neighbours are at its level. NaN
+    # never equals anything, so those are kept.
+    keep = np.ones(n, dtype=bool)
+    keep[1:-1] = ~((level[1:-1] == level[:-2]) & (level[1:-1] == level[2:]))
+    peak = _peak_index(currents)
+    if peak is not None: keep[peak] = True
+
+    if max_span is None: limit = int(np.max(np.diff(ns)))
+    else: limit = int(max_span / np.timedelta64(1, 'ns'))
+    index = np.flatnonzero(keep)
+    # Runs merged into a span of at least 'limit' keep some of their points
+    long_runs = np.flatnonzero((np.diff(ns[index]) >= limit) & \
+                               (np.diff(index) > 1))
+    if long_runs.size > 0:
+        added = []
+        for run in long_runs:
+            start, end = index[run], index[run + 1]
+            point = start
+            while True:
+                # Furthest datapoint less than limit away, or the next one
+                point = max(point + 1, \
+                            int(np.searchsorted(ns, ns[point] + limit)) - 1)
+                if point >= end: break
+                added.append(point)
+        keep[added] = True
+        index = np.flatnonzero(keep)
+
+    return (times[index], currents[index], index)
+
+
+def to_grid(times, currents, interval):
+    """
+    Resamples a profile to datapoints 'interval' (numpy.timedelta64) apart,
+    from its first datapoint, by linear interpolation.
+
+    Gaps longer than interval are kept as they are, with their end
+    datapoints, as are the last datapoint and the first peak.
+
+    Returns (times, currents, index) where index is the position in the
+    original profile of the datapoint at or before each time. Times keep
+    their unit.
+    """
+    times = np.asarray(times)
+    ns = times.astype('datetime64[ns]').view(np.int64)
+    currents = np.asarray(currents, dtype=float)
+    step = int(interval / np.timedelta64(1, 'ns'))
+    if step <= 0: raise ValueError("interval must be positive")
+
+    grid = np.arange(ns[0], ns[-1], step, dtype=np.int64)
+    before = np.searchsorted(ns, grid, side = 'right') - 1
+    gaps = np.diff(ns)
+    big = np.flatnonzero(gaps > step)
+    # Grid times inside a big gap are left out
+    in_gap = np.zeros(ns.size, dtype=bool)
+    in_gap[big] = True
+    grid = grid[~(in_gap[before] & (grid > ns[before]))]
+
+    kept = [grid, ns[big], ns[big + 1], ns[-1:]]
+    peak = _peak_index(currents)
+    if peak is not None: kept.append(ns[peak : peak + 1])
+    new_ns = np.unique(np.concatenate(kept))
+
+    # Relative times, as float64 can not hold every int64 nanosecond
+    new_currents = np.interp((new_ns - ns[0]).astype(float), \
+                             (ns - ns[0]).astype(float), currents)
+    index = np.searchsorted(ns, new_ns, side = 'right') - 1
+    return (new_ns.view('datetime64[ns]').astype(times.dtype), new_currents, \
+            index)
+
+
+def _resampled_entry(entry, resampled):
+    times, currents, index = resampled
+    if entry.point_index is not None: index = entry.point_index[index]
+    return dc.arrays_to_entry(times, currents, entry.n_points, index)
+
+
+def merge_entry(entry, tolerance = 0, max_span = None):
+    """ merge_runs on an Entry. Returns an Entry, see the module docstring. """
+    return _resampled_entry(entry, merge_runs(entry.times, entry.currents, \
+                                              tolerance, max_span))
+
+
+def grid_entry(entry, interval):
+    """ to_grid on an Entry. Returns an Entry, see the module docstring. """
+    return _resampled_entry(entry, to_grid(entry.times, entry.currents, \
+                                           interval))
+
+
+def energy_tolerance(tolerance, length):
+    """
+    Returns the most the energy (in AV) of a profile merged by merge_runs
+    with 'tolerance' may be off by, for a session of 'length'
+    (numpy.timedelta64).
+    """
+    return tolerance * (length / np.timedelta64(1, 'h')) * dc.mA_to_A_V
+
+
+def metric_errors(original, resampled):
+    """
+    Takes two Entries of the same session. Returns a dict of how far the
+    metrics clean_data uses are apart (resampled - original):
+    'energy' (AV), 'max_power' (W), 'length', 'max_gap', 'average_gap'
+    (numpy.timedelta64) and 'max_gap_position' (fraction of the session).
+    """
+    gap = original.max_gap_info
+    new_gap = resampled.max_gap_info
+    return {'energy' : resampled.energyDemand - original.energyDemand, \
+            'max_power' : resampled.max_power - original.max_power, \
+            'length' : np.timedelta64(resampled.length - original.length), \
+            'max_gap' : np.timedelta64(new_gap[0] - gap[0], 'ns'), \
+            'average_gap' : np.timedelta64(resampled.average_gap - \
+                                           original.average_gap, 'ns'), \
+            'max_gap_position' : new_gap[1] - gap[1]}
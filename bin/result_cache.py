@@ -0,0 +1,150 @@
+"""
+This module keeps the rows clean_directory found for each file between runs,
+so files that did not change are not loaded and checked again.
+
+A cache is one pickled file per (settings fingerprint, source directory) in a
+cache directory. The fingerprint is a hash of the check function's code, the
+source of data_cleaner and of the check function's module, the data_cleaner
+thresholds and anything else that changes the rows, see
+'fingerprint'. Changing any of these uses a new cache file, and leaves the
+caches of other settings as they were. Within a cache, a file's row is reused
+only if its size and modification time are unchanged. clean_directory does
+not keep the rows of files it could not load, so those are tried again.
+"""
+import os
+import sys
+import hashlib
+import pickle
+import types
+
+import data_cleaner as dc
+
+# Bump if the rows clean_directory makes change without any code or threshold
+# that 'fingerprint' looks at changing.
+CacheVersion = 1
+
+# Directory other caches of source directories are kept in by default, such
+# as file indexes (see file_index). Kept out of the source directories, so
+# those are only ever read.
+DefaultCacheDir = "../Cache"
+
+
+def _code_bytes(code):
+    """
+    Returns bytes describing a code object and the code objects in it, such as
+    lambdas, so changing any of them changes the fingerprint.
+    """
+    parts = [code.co_code, repr(code.co_names).encode()]
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType): parts.append(_code_bytes(const))
+        else: parts.append(repr(const).encode())
+    return b"|".join(parts)
+
+
+# Hashes of module source files by path, read once per process
+_source_hashes = {}
+
+
+def _source_hash(module):
+    """
+    Returns the sha1 digest of the source file of module, or b"" if it has
+    none. The checks check_fun calls, such as data_cleaner's, are in there.
+    """
+    path = getattr(module, '__file__', None)
+    if path is None: return b""
+    if path not in _source_hashes:
+        try:
+            with open(path, 'rb') as file:
+                _source_hashes[path] = hashlib.sha1(file.read()).digest()
+        except OSError:
+            _source_hashes[path] = b""
+    return _source_hashes[path]
+
+
+def fingerprint(check_fun, *extra):
+    """
+    Returns a hex string identifying the rows 'check_fun' gives.
+
+    Made from the name and code of check_fun, its 'cols', the source of
+    data_cleaner and of check_fun's module, the default thresholds of
+    data_cleaner.clean_data and any 'extra' values (given by repr), such as
+    the station table.
+    """
+    h = hashlib.sha1()
+    h.update(repr((CacheVersion, check_fun.__module__, \
+                   check_fun.__qualname__, check_fun.cols)).encode())
+    code = getattr(check_fun, '__code__', None)
+    if code is not None: h.update(_code_bytes(code))
+    h.update(_source_hash(dc))
+    h.update(_source_hash(sys.modules.get(check_fun.__module__)))
+    h.update(repr(dc.clean_data.__defaults__).encode())
+    for value in extra:
+        h.update(repr(value).encode())
+    return h.hexdigest()
+
+
+def cache_file(cache_dir, kind, directory, extension):
+    """
+    Returns the path in cache_dir of the cache of type 'kind' (such as
+    "file_index") of a source directory, ending in extension.
+    """
+    name = hashlib.sha1(os.path.abspath(directory).encode()).hexdigest()
+    return os.path.join(cache_dir, kind, name + extension)
+
+
+def file_key(pathname):
+    """ Returns (size, modification time in ns) of a file. """
+    stat = os.stat(pathname)
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+class ResultCache:
+    """
+    Rows found for one source directory with one fingerprint.
+
+    Use as:
+        cache = ResultCache(cache_dir, fingerprint(check_fun), directory)
+        row = cache.get(pathname, key)     # ResultCache.Missing if not cached
+        cache.put(pathname, key, row)
+        cache.save()
+
+    Only the rows put since the cache was opened are saved, so files removed
+    from the directory drop out of the cache.
+    """
+    # Returned by get for a file with no usable row. Rows may be None.
+    Missing = object()
+
+    def __init__(self, cache_dir, fingerprint, directory):
+        """ Opens the cache for 'directory' in 'cache_dir'. """
+        name = hashlib.sha1((fingerprint + "|" + \
+                             os.path.abspath(directory)).encode()).hexdigest()
+        self.path = os.path.join(cache_dir, name + ".pkl")
+        self._old = {}
+        self._new = {}
+        try:
+            with open(self.path, 'rb') as file:
+                self._old = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self._old = {}
+
+    def get(self, pathname, key):
+        """ Returns the cached row for pathname if its key is unchanged. """
+        cached = self._old.get(pathname)
+        if cached is None or cached[0] != key: return ResultCache.Missing
+        self._new[pathname] = cached
+        return cached[1]
+
+    def put(self, pathname, key, row):
+        """ Keeps 'row' as the result for pathname with the given key. """
+        self._new[pathname] = (key, row)
+
+    def __len__(self):
+        return len(self._old)
+
+    def save(self):
+        """ Writes the cache. Replaces the old file only once fully written. """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok = True)
+        temp = self.path + ".tmp"
+        with open(temp, 'wb') as file:
+            pickle.dump(self._new, file, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, self.path)
@@ -0,0 +1,301 @@
+"""
+This module writes the rows of directory_cleaner.iter_rows to a file as they
+are found, a chunk at a time, so a result set never has to be held whole.
+
+The file format is picked from the output file's extension:
+    .csv - comma separated text.
+    .parquet - Apache Parquet, needs pyarrow.
+    .feather - Feather (Arrow IPC file), needs pyarrow.
+    .pkl - pickled pandas.DataFrame chunks, one after another. Compact and
+           needs nothing extra. Read back with read_results.
+    .xlsx - Excel. Excel can not be written a chunk at a time, so rows are
+            held until close, and at most ExcelMaxRows rows can be written.
+Every format can be read back as one DataFrame with read_results.
+
+Files are written next to the output file (see Sink.temp_path) and only
+moved to it once complete, so a run that fails leaves no partial result and
+an older result as it was.
+"""
+import os
+import pickle
+import numpy as np
+import pandas as pd
+
+import clean_stats as cs
+
+# Rows of an Excel sheet, less the header row
+ExcelMaxRows = 1048575
+
+
+class Sink:
+    """
+    Writes DataFrame chunks with the same columns to one file.
+
+    Use as:
+        with open_sink(path, columns) as sink:
+            sink.write(chunk)
+    The file is only at path once the sink is closed. If the with block
+    raises, what was written is discarded.
+
+    Attributes:
+    path : Output file.
+    columns : Names of the columns.
+    dtypes : dict of the type of columns, as numpy dtype names (such as
+    'float64' or 'datetime64[ns]') or 'str'. Used by formats with typed
+    columns. Columns not in it have the type of their values.
+    temp_path : File written until the sink is closed, next to path with the
+    same extension.
+    """
+
+    def __init__(self, path, columns, dtypes = None):
+        self.path = path
+        self.columns = list(columns)
+        self.dtypes = dict(dtypes or {})
+        root, extension = os.path.splitext(path)
+        self.temp_path = root + ".partial" + extension
+
+    def write(self, chunk):
+        """ Appends the rows of DataFrame chunk. """
+        raise NotImplementedError
+
+    def _finish(self):
+        """ Completes temp_path. """
+        pass
+
+    def _release(self):
+        """ Closes temp_path without completing it. """
+        pass
+
+    def close(self):
+        """ Completes the file and moves it to path. """
+        self._finish()
+        os.replace(self.temp_path, self.path)
+
+    def discard(self):
+        """ Drops what was written, leaving path as it was. """
+        try:
+            self._release()
+        finally:
+            if os.path.exists(self.temp_path): os.remove(self.temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None: self.close()
+        else: self.discard()
+
+
+class CsvSink(Sink):
+    def __init__(self, path, columns, dtypes = None):
+        Sink.__init__(self, path, columns, dtypes)
+        self._file = open(self.temp_path, 'w', newline='')
+        pd.DataFrame([], columns = self.columns).to_csv(self._file, \
+                                                       index = False)
+
+    def write(self, chunk):
+        chunk.to_csv(self._file, header = False, index = False)
+
+    def _finish(self):
+        self._file.close()
+
+    _release = _finish
+
+
+class PickleSink(Sink):
+    def __init__(self, path, columns, dtypes = None):
+        Sink.__init__(self, path, columns, dtypes)
+        self._file = open(self.temp_path, 'wb')
+
+    def write(self, chunk):
+        pickle.dump(chunk, self._file, protocol = pickle.HIGHEST_PROTOCOL)
+
+    def _finish(self):
+        self._file.close()
+
+    _release = _finish
+
+
+class _ArrowSink(Sink):
+    """
+    Base of the sinks written with pyarrow. The schema is fixed when the
+    first chunk is written: columns in dtypes have that type, others the type
+    of their values in the first chunk. A column not in dtypes with no value
+    in the first chunk is written as text.
+    """
+
+    def __init__(self, path, columns, dtypes = None):
+        Sink.__init__(self, path, columns, dtypes)
+        # Optional dependency, only needed for these formats
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError("writing %s needs pyarrow, use .csv or .pkl " \
+                              "instead" % os.path.basename(path))
+        self._pa = pyarrow
+        self._schema = None
+        # Columns written as text, see the class docstring
+        self._text = []
+        self._writer = None
+
+    def _new_writer(self, schema):
+        raise NotImplementedError
+
+    def _arrow_type(self, dtype):
+        if dtype == 'str': return self._pa.string()
+        return self._pa.from_numpy_dtype(np.dtype(dtype))
+
+    def _make_schema(self, chunk):
+        pa = self._pa
+        fields = []
+        for column in self.columns:
+            if column in self.dtypes:
+                kind = self._arrow_type(self.dtypes[column])
+            else:
+                kind = pa.Table.from_pandas(chunk[[column]], \
+                                            preserve_index = False).schema[0].type
+                if pa.types.is_null(kind):
+                    kind = pa.string()
+                    self._text.append(column)
+            fields.append(pa.field(column, kind))
+        return pa.schema(fields)
+
+    def write(self, chunk):
+        if self._writer is None:
+            self._schema = self._make_schema(chunk)
+            self._writer = self._new_writer(self._schema)
+        if self._text:
+            chunk = chunk.assign(**{column : [None if pd.isna(v) else str(v) \
+                                              for v in chunk[column]] \
+                                    for column in self._text})
+        table = self._pa.Table.from_pandas(chunk, schema = self._schema, \
+                                           preserve_index = False)
+        self._writer.write_table(table)
+
+    def _finish(self):
+        # An empty file still has the columns
+        if self._writer is None:
+            self.write(pd.DataFrame([], columns = self.columns))
+        self._writer.close()
+
+    def _release(self):
+        if self._writer is not None: self._writer.close()
+
+
+class ParquetSink(_ArrowSink):
+    def _new_writer(self, schema):
+        import pyarrow.parquet
+        return pyarrow.parquet.ParquetWriter(self.temp_path, schema)
+
+
+class FeatherSink(_ArrowSink):
+    def _new_writer(self, schema):
+        import pyarrow.ipc
+        return pyarrow.ipc.new_file(self.temp_path, schema)
+
+
+class ExcelSink(Sink):
+    def __init__(self, path, columns, dtypes = None):
+        Sink.__init__(self, path, columns, dtypes)
+        self._chunks = []
+        self._rows = 0
+
+    def write(self, chunk):
+        self._rows += chunk.shape[0]
+        if self._rows > ExcelMaxRows:
+            raise ValueError("more than %d rows do not fit in %s, use .csv, " \
+                             ".parquet, .feather or .pkl instead" % \
+                             (ExcelMaxRows, os.path.basename(self.path)))
+        self._chunks.append(chunk)
+
+    def _finish(self):
+        if self._chunks == []:
+            df = pd.DataFrame([], columns = self.columns)
+        else:
+            df = pd.concat(self._chunks, ignore_index = True)
+        with pd.ExcelWriter(self.temp_path) as writer:
+            df.to_excel(writer, sheet_name = 'Data')
+
+
+# Sink of each output extension
+Sinks = {".csv" : CsvSink, \
+         ".parquet" : ParquetSink, \
+         ".feather" : FeatherSink, \
+         ".pkl" : PickleSink, \
+         ".xlsx" : ExcelSink}
+
+
+def sink_for(path):
+    """ Returns the Sink class for path's extension, or None if unknown. """
+    return Sinks.get(os.path.splitext(path)[1].lower())
+
+
+def open_sink(path, columns, dtypes = None):
+    """
+    Returns a Sink writing 'columns' to path, picked by its extension.
+    dtypes as Sink.
+    """
+    sink = sink_for(path)
+    if sink is None:
+        raise ValueError("unknown output format of %s, use one of %s" % \
+                         (path, ", ".join(Sinks)))
+    return sink(path, columns, dtypes)
+
+
+def write_rows(rows, columns, path, chunk_size = 10000, stats = cs.NoStats, \
+               dtypes = None):
+    """
+    Writes rows (lists of values for 'columns') to path, chunk_size rows at a
+    time as they are read. Returns the number of rows.
+    stats: clean_stats.CleanStats to add the time spent writing to.
+    dtypes: type of columns, as Sink.
+    """
+    return write_chunks(rows, columns, open_sink(path, columns, dtypes), \
+                        chunk_size, stats)
+
+
+def write_chunks(rows, columns, sink, chunk_size = 10000, stats = cs.NoStats):
+    """
+    As write_rows, to an open Sink, which is closed when done. If reading or
+    writing the rows fails, the sink is discarded, so no partial file is left
+    at its path.
+    """
+    count = 0
+    try:
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                with stats.timer('write'):
+                    sink.write(pd.DataFrame(chunk, columns = columns))
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            with stats.timer('write'):
+                sink.write(pd.DataFrame(chunk, columns = columns))
+            count += len(chunk)
+        # Some formats are only written on close
+        with stats.timer('write'):
+            sink.close()
+    except BaseException:
+        sink.discard()
+        raise
+    return count
+
+
+def read_results(path):
+    """ Reads a file written by a Sink back as one DataFrame. """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv": return pd.read_csv(path)
+    if extension == ".parquet": return pd.read_parquet(path)
+    if extension == ".feather": return pd.read_feather(path)
+    if extension == ".xlsx": return pd.read_excel(path, index_col = 0)
+    if extension == ".pkl":
+        chunks = []
+        with open(path, 'rb') as file:
+            while True:
+                try: chunks.append(pickle.load(file))
+                except EOFError: break
+        if chunks == []: return pd.DataFrame()
+        return pd.concat(chunks, ignore_index = True)
+    raise ValueError("unknown output format of %s" % path)
@@ -0,0 +1,264 @@
+"""
+This module picks how to read each session file, so one directory may hold
+pickled, text and compressed sessions side by side.
+
+A session file is a format (how the profile is written) optionally wrapped in
+a compression:
+    formats - "pkl" (a pickled pandas.DataFrame) and "txt" (tab-delimited
+              text, see load_txt).
+    compressions - "gz" (gzip), "xz" and "bz2".
+The format and compression of a file are found from its extension, such as
+.pkl, .txt.gz or .pkl.xz, and from its first bytes when the extension is not
+known. Compressed files are decompressed as they are read, never to disk or
+whole into memory.
+
+More formats can be added with register_format, and more compressions with
+register_compression.
+"""
+import os
+import sys
+import bz2
+import gzip
+import lzma
+import pickle
+import numpy as np
+import pandas as pd
+
+# Number of bytes read from a file to recognise its format or compression
+SniffBytes = 16
+
+
+class UnknownFormat(Exception): pass
+
+
+class Format:
+    """
+    A way of reading sessions.
+
+    Attributes:
+    name : Name of the format, also its usual extension.
+    reader : reader(file, columns) returns the profile in the binary file
+    object 'file'. columns is None for every column, or the columns needed,
+    which the reader may use to skip others.
+    extensions : Extensions of files in this format.
+    sniff : sniff(head) returns True if the first bytes of a file, 'head',
+    are of this format. None if the format can not be recognised that way.
+    """
+
+    def __init__(self, name, reader, extensions, sniff = None):
+        self.name = name
+        self.reader = reader
+        self.extensions = extensions
+        self.sniff = sniff
+
+
+class Compression:
+    """
+    A compression of session files.
+
+    Attributes:
+    name : Name of the compression, also its usual extension.
+    opener : opener(pathname, mode) opens the file, decompressing or
+    compressing as it is read or written, like gzip.open.
+    extensions : Extensions of files compressed this way.
+    magic : Bytes every file compressed this way starts with.
+    """
+
+    def __init__(self, name, opener, extensions, magic):
+        self.name = name
+        self.opener = opener
+        self.extensions = extensions
+        self.magic = magic
+
+
+# Registered formats and compressions, by name, in order of registration
+Formats = {}
+Compressions = {}
+
+
+def register_format(name, reader, extensions = None, sniff = None):
+    """
+    Adds or replaces a format. extensions defaults to [name]. See Format for
+    the arguments.
+    """
+    if extensions is None: extensions = [name]
+    Formats[name] = Format(name, reader, list(extensions), sniff)
+
+
+def register_compression(name, opener, magic, extensions = None):
+    """
+    Adds or replaces a compression. extensions defaults to [name]. See
+    Compression for the arguments.
+    """
+    if extensions is None: extensions = [name]
+    Compressions[name] = Compression(name, opener, list(extensions), magic)
+
+
+def _by_extension(table, extension):
+    for item in table.values():
+        if extension in item.extensions: return item
+    return None
+
+
+def _sniff_format(head):
+    for fmt in Formats.values():
+        if fmt.sniff is not None and fmt.sniff(head): return fmt
+    raise UnknownFormat("format of file starting %r not known" % head)
+
+
+def _sniff_compression(head):
+    for compression in Compressions.values():
+        if head.startswith(compression.magic): return compression
+    return None
+
+
+def _read_head(pathname, compression):
+    if compression is None: opener = open
+    else: opener = compression.opener
+    with opener(pathname, 'rb') as file:
+        return file.read(SniffBytes)
+
+
+def file_kind(pathname):
+    """
+    Returns (format, compression) of a session file, as the Format and
+    Compression (None if not compressed) to read it with. Raises UnknownFormat
+    if neither the extension nor the contents say.
+    """
+    # Extensions are everything after the first '.' of the name
+    extensions = os.path.basename(pathname).split('.')[1:]
+    compression = None
+    if extensions:
+        compression = _by_extension(Compressions, extensions[-1].lower())
+        if compression is not None: extensions = extensions[:-1]
+    if extensions:
+        fmt = _by_extension(Formats, extensions[-1].lower())
+        if fmt is not None: return (fmt, compression)
+
+    # Unknown extension, look at the contents
+    if compression is None:
+        compression = _sniff_compression(_read_head(pathname, None))
+    return (_sniff_format(_read_head(pathname, compression)), compression)
+
+
+def open_file(pathname, mode = 'rb'):
+    """
+    Opens a session file, compressed as its extension says (see file_kind).
+    Used for writing compressed sessions too, as with mode 'wb'.
+    """
+    extensions = os.path.basename(pathname).split('.')[1:]
+    if extensions:
+        compression = _by_extension(Compressions, extensions[-1].lower())
+        if compression is not None: return compression.opener(pathname, mode)
+    return open(pathname, mode)
+
+
+def load(pathname, columns = None):
+    """
+    Loads the profile of a session file of any registered format and
+    compression. columns is passed to the format's reader, see Format.
+    """
+    fmt, compression = file_kind(pathname)
+    if compression is None: opener = open
+    else: opener = compression.opener
+    with opener(pathname, 'rb') as file:
+        return fmt.reader(file, columns)
+
+
+def _read_pickle(file, columns = None):
+    return pickle.load(file)
+
+
+# Format of the 'time' column of tab-delimited session files
+txt_time_format = "%Y-%m-%d-%H-%M-%S"
+
+
+def parse_txt_times(strings):
+    """
+    Parses an array of txt_time_format strings in one vectorized pass.
+    Returns a numpy.datetime64[ns] array.
+    """
+    times = pd.to_datetime(strings, format = txt_time_format, cache = False)
+    return np.asarray(times, dtype='datetime64[ns]')
+
+
+def load_txt(file_source):
+    """
+    Loads a charging session as a tab-delimited text file.
+    """
+    data = pd.read_csv(file_source, sep='\t')
+    data['time'] = parse_txt_times(data['time'])
+    data.set_index('time', inplace=True)
+    return data
+
+
+def load_txt_fast(file_source, columns = ('mamps_last',)):
+    """
+    Loads only the 'time' and 'columns' columns of a tab-delimited session
+    file, reading the times as strings. Faster than load_txt, and gives the
+    same DataFrame for those columns, dtypes included.
+    """
+    data = pd.read_csv(file_source, sep='\t', \
+                       usecols = ['time'] + list(columns), \
+                       dtype = {'time' : str}, engine = 'c')
+    index = pd.DatetimeIndex(parse_txt_times(data['time'].values), \
+                             name = 'time')
+    return pd.DataFrame({col : data[col].values for col in columns}, \
+                        index = index)
+
+
+def load_txt_batch(file_sources):
+    """
+    Loads many tab-delimited session files at once, packed for
+    data_cleaner.clean_batch. Timestamps of all files are parsed together,
+    and currents are float64. Files that can not be loaded are skipped with a
+    message.
+    Returns (paths, times, currents, offsets) where paths are the files
+    loaded.
+    """
+    paths = []
+    time_strings = []
+    currents = []
+    offsets = [0]
+    dtypes = {'time' : str, 'mamps_last' : np.float64}
+    for pathname in file_sources:
+        try:
+            data = pd.read_csv(pathname, sep='\t', usecols = list(dtypes), \
+                               dtype = dtypes, engine = 'c')
+        except Exception as err:
+            sys.stderr.write("Skipping %s: %s: %s\n" % (pathname, \
+                             type(err).__name__, err))
+            continue
+        paths.append(pathname)
+        time_strings.append(data['time'].values)
+        currents.append(data['mamps_last'].values)
+        offsets.append(offsets[-1] + data.shape[0])
+    if paths == []:
+        return ([], np.array([], dtype='datetime64[ns]'), np.array([]), \
+                np.array(offsets, dtype=np.int64))
+    times = parse_txt_times(np.concatenate(time_strings))
+    return (paths, times, np.concatenate(currents), \
+            np.array(offsets, dtype=np.int64))
+
+
+def _read_txt(file, columns = None):
+    if columns is None: return load_txt(file)
+    return load_txt_fast(file, columns)
+
+
+def _is_pickle(head):
+    # Protocol 2 and later start with PROTO
+    return head[:1] == pickle.PROTO
+
+
+def _is_txt(head):
+    # Session text files start with their 'time' header
+    return head.startswith(b"time\t")
+
+
+register_format("pkl", _read_pickle, ["pkl", "pickle"], _is_pickle)
+register_format("txt", _read_txt, ["txt", "tsv"], _is_txt)
+
+register_compression("gz", gzip.open, b"\x1f\x8b", ["gz", "gzip"])
+register_compression("xz", lzma.open, b"\xfd7zXZ\x00", ["xz"])
+register_compression("bz2", bz2.open, b"BZh", ["bz2"])
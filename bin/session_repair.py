@@ -0,0 +1,355 @@
+"""
+This module repairs sessions clean_data would throw away for their gaps, so
+more of the archive can be used for energy data.
+
+Repair is done on sessions packed as described in data_cleaner Sec 3, in
+three vectorized steps:
+    fill_gaps - gaps longer than the sampling interval, up to max_fill, get
+    datapoints every 'interval' by linear interpolation. The trapezoid
+    integral is unchanged, so a filled session has the same energy as
+    before, and the true energy over the filled time can only be off by
+    its length times the peak current (see filled_time and energy_bound).
+    split_at_gaps - sessions are cut at the gaps still at least
+    max_gap_allowed long, into segments with no big gap.
+    repair_batch - checks each segment of the filled and split sessions
+    again with data_cleaner.batch_verdict, as clean_data would check it as a
+    session of its own. The metrics of the filled segments are found from
+    the original datapoints, without making the filled ones, so repairing
+    costs about as much as clean_batch.
+
+    times, currents, offsets = store.packed()
+    repaired = repair_batch(times, currents, offsets)
+    repaired['energy'][repaired['is_valid']].sum()
+
+A segment keeps the time and datapoints of its session, so a session split
+in two gives two shorter sessions, which may be ShortTime. Datapoints added
+count for average_gap, so a filled segment is only LostDatapoints if it is
+still sparse outside of the filled gaps.
+
+repair_directory repairs every session of a directory or session store and
+gives a row per segment. From the command line:
+
+    python session_repair.py ../Data/All-Caltech/ segments.csv --workers 4
+"""
+import sys
+import os
+import numpy as np
+import pandas as pd
+
+import data_cleaner as dc
+import directory_cleaner as dir_c
+import session_store as ss
+
+Usage = " \n Usage: python %s source_directory output_filename" % sys.argv[0] \
+        + " [--workers N|auto]"
+
+# Datapoints are expected every SampleInterval (as datapoint_fraction
+# assumes), and gaps up to MaxFill are filled by default.
+SampleInterval = np.timedelta64(10, 's')
+MaxFill = np.timedelta64(15, 'm')
+
+
+def _ns(delta):
+    return int(delta / np.timedelta64(1, 'ns'))
+
+
+def _inner_gaps(ns, offsets):
+    """ Gaps after each datapoint, and whether each is inside a session. """
+    gaps = np.diff(ns)
+    inside = np.ones(gaps.size, dtype=bool)
+    inside[offsets[1:-1] - 1] = False
+    return (gaps, inside)
+
+
+def fill_gaps(times, currents, offsets, interval = SampleInterval, \
+              max_fill = MaxFill):
+    """
+    Adds datapoints by linear interpolation in every gap longer than
+    'interval' and at most max_fill (numpy.timedelta64), 'interval' apart
+    from the datapoint before the gap.
+
+    Takes sessions packed as described in data_cleaner Sec 3. Returns
+    (times, currents, offsets, added) of the filled sessions, packed the same
+    way, where added is True for each datapoint added. See filled_time.
+    """
+    ns = np.asarray(times, dtype='datetime64[ns]').view(np.int64)
+    currents = np.asarray(currents, dtype=float)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    step = _ns(interval)
+    if step <= 0: raise ValueError("interval must be positive")
+    gaps, inside = _inner_gaps(ns, offsets)
+    filled = np.flatnonzero(inside & (gaps > step) & (gaps <= _ns(max_fill)))
+
+    # Datapoints added in each filled gap
+    added = -(-gaps[filled] // step) - 1
+    if added.sum() == 0:
+        return (ns.view('datetime64[ns]'), currents, offsets, \
+                np.zeros(ns.size, dtype=bool))
+
+    # Number of each added datapoint within its gap, from 1
+    first = np.cumsum(added) - added
+    k = np.arange(added.sum()) - np.repeat(first, added) + 1
+    gap_of = np.repeat(filled, added)
+    new_ns = ns[gap_of] + k * step
+    fraction = (k * step) / gaps[gap_of].astype(float)
+    new_currents = currents[gap_of] + \
+                   (currents[gap_of + 1] - currents[gap_of]) * fraction
+
+    # Added datapoints go after the datapoint before their gap
+    inserted = np.zeros(ns.size, dtype=np.int64)
+    inserted[filled] = added
+    shift = np.concatenate(([0], np.cumsum(inserted)))
+    out_ns = np.empty(ns.size + new_ns.size, dtype=np.int64)
+    out_currents = np.empty(out_ns.size)
+    original = np.arange(ns.size) + shift[:-1]
+    out_ns[original] = ns
+    out_currents[original] = currents
+    new_places = np.repeat(original[filled], added) + k
+    out_ns[new_places] = new_ns
+    out_currents[new_places] = new_currents
+    is_added = np.zeros(out_ns.size, dtype=bool)
+    is_added[new_places] = True
+    return (out_ns.view('datetime64[ns]'), out_currents, offsets + \
+            shift[offsets], is_added)
+
+
+def filled_time(times, offsets, added):
+    """
+    Returns the numpy.timedelta64[ns] time of each packed session between
+    datapoints added by fill_gaps (see its 'added'), or between one and a
+    datapoint next to it: the length of the gaps that were filled.
+    """
+    ns = np.asarray(times, dtype='datetime64[ns]').view(np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    gaps, inside = _inner_gaps(ns, offsets)
+    counted = inside & (added[:-1] | added[1:])
+    sessions = np.repeat(np.arange(offsets.size - 1), np.diff(offsets))[:-1]
+    total = np.zeros(offsets.size - 1, dtype=np.int64)
+    np.add.at(total, sessions[counted], gaps[counted])
+    return total.view('timedelta64[ns]')
+
+
+def energy_bound(filled_time, max_power):
+    """
+    Returns the most the energy (in AV) of a filled session may be off by
+    over its filled_time (numpy.timedelta64), for currents between 0 and
+    the session's peak, max_power (in W as Entry.max_power).
+    """
+    return (filled_time / np.timedelta64(1, 'h')) * \
+           (max_power / dc.mA_to_W) * dc.mA_to_A_V
+
+
+def split_at_gaps(times, offsets, max_gap_allowed = np.timedelta64(5, 'm')):
+    """
+    Cuts sessions at every gap of at least max_gap_allowed, so no segment has
+    a gap clean_data finds BigGap.
+
+    Takes times and offsets of sessions packed as described in data_cleaner
+    Sec 3. The datapoints stay where they are, so segments are packed in the
+    same times and currents arrays. Returns (offsets, session), the offsets
+    of the segments and the session each segment is from.
+    """
+    ns = np.asarray(times, dtype='datetime64[ns]').view(np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    gaps, inside = _inner_gaps(ns, offsets)
+    cuts = np.flatnonzero(inside & (gaps >= _ns(max_gap_allowed))) + 1
+    new_offsets = np.union1d(offsets, cuts)
+    session = np.searchsorted(offsets, new_offsets[:-1], side = 'right') - 1
+    return (new_offsets, session)
+
+
+def repair_batch(times, currents, offsets, \
+                 interval = SampleInterval, \
+                 max_fill = MaxFill, \
+                 min_charge_time = np.timedelta64(20, 'm'), \
+                 min_average_time_gap = np.timedelta64(11, 's'), \
+                 max_gap_allowed = np.timedelta64(5, 'm'), \
+                 min_energy = 1, \
+                 min_maxpower = 2000, \
+                 max_time = np.timedelta64(20, 'h')):
+    """
+    Fills short gaps (see fill_gaps), splits at the big gaps left (see
+    split_at_gaps) and checks each segment with data_cleaner.batch_verdict.
+
+    The filled datapoints are never made: a filled gap only adds datapoints
+    and makes its largest gap 'interval', and leaves the energy, length and
+    peak as they were, so the metrics of each segment are found from the
+    original datapoints. Use fill_gaps and split_at_gaps (or repair_entry)
+    for the repaired profiles themselves.
+
+    Takes sessions packed as described in data_cleaner Sec 3. interval and
+    max_fill are as fill_gaps, max_fill None to fill nothing. Other
+    parameters are as clean_data, with max_gap_allowed also where sessions
+    are split (None to split nothing). Sessions need at least one datapoint.
+
+    Returns a dict of arrays with one value per segment:
+    'offsets' - packing of the segments in times and currents (one more
+    value than there are segments).
+    'session' - the session each segment is from.
+    'segment' - number of each segment within its session, from 0.
+    'filled_time' - numpy.timedelta64[ns] length of the gaps filled in each
+    segment, see energy_bound.
+    'is_valid', 'error' - as clean_batch gives for the repaired segment.
+    and the batch_metrics of each repaired segment ('n_points', 'length',
+    'max_gap', 'average_gap', 'energy' and 'max_power').
+    """
+    ns = np.asarray(times, dtype='datetime64[ns]').view(np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    step = _ns(interval)
+    if step <= 0: raise ValueError("interval must be positive")
+    gaps, inside = _inner_gaps(ns, offsets)
+    if max_fill is None: fill = np.zeros(gaps.size, dtype=bool)
+    else: fill = inside & (gaps > step) & (gaps <= _ns(max_fill))
+    # Gaps as they are once filled
+    repaired = np.where(fill, step, gaps)
+
+    if max_gap_allowed is None:
+        segments, session = offsets, np.arange(offsets.size - 1)
+    else:
+        cuts = np.flatnonzero(inside & \
+                              (repaired >= _ns(max_gap_allowed))) + 1
+        segments = np.union1d(offsets, cuts)
+        session = np.searchsorted(offsets, segments[:-1], side = 'right') - 1
+    first = np.flatnonzero(np.diff(np.concatenate(([-1], session))) != 0)
+    segment = np.arange(session.size) - \
+              np.repeat(first, np.diff(np.append(first, session.size)))
+
+    metrics = dc.batch_metrics(ns.view('datetime64[ns]'), currents, segments)
+    if session.size > 0:
+        # Gap after each datapoint inside its segment, as in batch_metrics
+        starts = segments[:-1]
+        ends = segments[1:] - 1
+        after = np.zeros(ns.size, dtype=np.int64)
+        after[:-1] = repaired
+        after[ends] = 0
+        added = np.zeros(ns.size, dtype=np.int64)
+        added[:-1] = np.where(fill, -(-gaps // step) - 1, 0)
+        added[ends] = 0
+        filled = np.zeros(ns.size, dtype=np.int64)
+        filled[:-1] = np.where(fill, gaps, 0)
+        filled[ends] = 0
+        metrics['n_points'] = metrics['n_points'] + \
+                              np.add.reduceat(added, starts)
+        metrics['max_gap'] = np.maximum.reduceat(after, starts).astype(\
+            'timedelta64[ns]')
+        metrics['average_gap'] = metrics['length'] // metrics['n_points']
+        filled_time = np.add.reduceat(filled, starts).astype('timedelta64[ns]')
+    else:
+        filled_time = np.array([], dtype='timedelta64[ns]')
+
+    is_valid, error = dc.batch_verdict(metrics, min_charge_time, \
+                                       min_average_time_gap, max_gap_allowed, \
+                                       min_energy, min_maxpower, max_time)
+    result = {'offsets' : segments, 'session' : session, \
+              'segment' : segment, 'filled_time' : filled_time, \
+              'is_valid' : is_valid, 'error' : error}
+    result.update(metrics)
+    return result
+
+
+def repair_entry(entry, interval = SampleInterval, max_fill = MaxFill, \
+                 max_gap_allowed = np.timedelta64(5, 'm')):
+    """
+    Repairs one session (an Entry) as repair_batch. Returns a list of an
+    Entry per segment, to be checked with clean_data.
+    """
+    times, currents, offsets = dc.pack_profiles([entry])
+    if max_fill is not None:
+        times, currents, offsets, _ = fill_gaps(times, currents, offsets, \
+                                                interval, max_fill)
+    if max_gap_allowed is not None:
+        offsets, _ = split_at_gaps(times, offsets, max_gap_allowed)
+    return [dc.arrays_to_entry(times[offsets[k] : offsets[k + 1]], \
+                               currents[offsets[k] : offsets[k + 1]]) \
+            for k in range(offsets.size - 1)]
+
+
+# Columns of the rows of repair_directory
+Columns = ['path', 'segment', 'start', 'end', 'is_valid', 'error', \
+           'length (hr)', 'energy (AV)', 'filled (min)', 'energy_bound (AV)']
+
+
+def _segment_rows(paths, times, repaired):
+    """
+    Rows (as Columns) of the segments repair_batch found in sessions of
+    times.
+    """
+    offsets = repaired['offsets']
+    times = np.asarray(times, dtype='datetime64[ns]')
+    return pd.DataFrame({'path' : np.asarray(paths, dtype=object)[\
+                             repaired['session']], \
+                         'segment' : repaired['segment'], \
+                         'start' : times[offsets[:-1]], \
+                         'end' : times[offsets[1:] - 1], \
+                         'is_valid' : repaired['is_valid'], \
+                         'error' : repaired['error'], \
+                         'length (hr)' : repaired['length'] / \
+                                         np.timedelta64(1, 'h'), \
+                         'energy (AV)' : repaired['energy'], \
+                         'filled (min)' : repaired['filled_time'] / \
+                                          np.timedelta64(1, 'm'), \
+                         'energy_bound (AV)' : energy_bound(\
+                             repaired['filled_time'], repaired['max_power'])}, \
+                        columns = Columns)
+
+
+def _repair_files(paths):
+    """ Loads and repairs session files. Returns a DataFrame of Columns. """
+    loaded = []
+    profiles = []
+    for pathname in paths:
+        try:
+            profiles.append(dir_c.load_session(pathname, ['mamps_last']))
+        except Exception as err:
+            sys.stderr.write("Skipping %s: %s: %s\n" % (pathname, \
+                             type(err).__name__, err))
+            continue
+        loaded.append(pathname)
+    times, currents, offsets = dc.pack_profiles(profiles)
+    return _segment_rows(loaded, times, repair_batch(times, currents, offsets))
+
+
+def repair_directory(directory, workers = 1):
+    """
+    Repairs every session of a directory, or session store, with the default
+    settings of repair_batch. Returns a DataFrame with a row (see Columns)
+    per segment, in path order. Files are loaded dir_c.MaxChunksize at a
+    time, by 'workers' processes as for clean_directory. Files that can not
+    be loaded are skipped with a message.
+    """
+    if ss.is_store(directory):
+        store = ss.SessionStore(directory)
+        paths = [os.path.join(store.path, name) for name in store.names]
+        return _segment_rows(paths, store.times, \
+                             repair_batch(*store.packed()))
+
+    paths = dir_c.session_files(directory)
+    chunks = [paths[i : i + dir_c.MaxChunksize] \
+              for i in range(0, len(paths), dir_c.MaxChunksize)]
+    return pd.concat(list(dir_c.run_checks(_repair_files, chunks, (), \
+                                           workers, 1)), ignore_index = True)
+
+
+def main():
+    args = sys.argv[1:]
+    try:
+        workers = dir_c.pop_option(args, "--workers", "1")
+        workers = None if workers == "auto" else int(workers)
+    except (ValueError, dir_c.InvalidArgs) as err:
+        raise dir_c.InvalidArgs( "%s\n%s" % (err, Usage) )
+    if len(args) != 2: raise dir_c.InvalidArgs( Usage )
+
+    source = args[0]
+    if not ss.is_store(source) and source[-1] != "/": source += "/"
+    segments = repair_directory(source, workers)
+    valid = segments['is_valid'].values
+    print("%d sessions, %d segments, %d valid with %.1f AV (+- %.1f AV)" % \
+          (segments['path'].nunique(), segments.shape[0], valid.sum(), \
+           segments['energy (AV)'].values[valid].sum(), \
+           segments['energy_bound (AV)'].values[valid].sum()))
+    # Format from the extension, see result_sinks
+    dir_c.rows_to_file(segments.values.tolist(), Columns, args[1])
+
+
+if __name__ == "__main__":
+    main()
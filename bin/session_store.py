@@ -0,0 +1,234 @@
+"""
+This module stores many charging sessions in one columnar store, so they can be
+read without opening and unpickling one file per session.
+
+A store is a directory with:
+    time.bin - every session's datapoint times, as int64 nanoseconds since the
+               epoch, one session after another.
+    mamps_last.bin - the matching currents in mA, as float64.
+    index.npz - the session index table. One row per session with 'name'
+                (the file the session was packed from), 'station_id', 'start'
+                (start time from the filename) and 'offsets', where session k
+                is rows offsets[k]:offsets[k+1] of the two column files.
+
+Create a store with StoreWriter or pack_directory, or from the command line
+with
+    python session_store.py source_directory store_directory
+and read it with SessionStore.
+"""
+# For arguments passed to library if name = main
+import sys
+import os
+import datetime
+import numpy as np
+import pandas as pd
+
+import data_cleaner as dc
+import file_index as fi
+import session_loaders as sl
+import command_args as ca
+
+Usage = " \n Usage: python %s source_directory store_directory" % sys.argv[0]
+
+TimeFile = "time.bin"
+CurrentFile = "mamps_last.bin"
+IndexFile = "index.npz"
+
+TimeDtype = np.dtype('<i8')
+CurrentDtype = np.dtype('<f8')
+
+
+def is_store(path):
+    """ Returns True if 'path' is a session store directory. """
+    return os.path.isfile(os.path.join(path, IndexFile))
+
+
+class StoreWriter:
+    """
+    Writes sessions to a new store, one session at a time. The column files
+    are appended to as sessions are added, so the archive is never held in
+    memory. The index is written by close(), so the directory is only a store
+    (see is_store) once every session was written. If the with block raises,
+    the column files are removed instead.
+
+    Use as:
+        with StoreWriter(path) as writer:
+            writer.append(name, station_id, start, profile)
+    """
+
+    def __init__(self, path):
+        """ Creates the store directory 'path' if needed and opens it. """
+        os.makedirs(path, exist_ok = True)
+        self.path = path
+        # An older store at path is not one while it is written over
+        index = os.path.join(path, IndexFile)
+        if os.path.exists(index): os.remove(index)
+        self._times = open(os.path.join(path, TimeFile), 'wb')
+        self._currents = open(os.path.join(path, CurrentFile), 'wb')
+        self._names = []
+        self._station_ids = []
+        self._starts = []
+        self._offsets = [0]
+
+    def append(self, name, station_id, start, profile):
+        """
+        Adds one session.
+
+        name (string) - Name of the session, usually its filename.
+        station_id (int) - Id of the station.
+        start (datetime-like) - Start time of the session from its filename.
+        profile (pandas.DataFrame) - Charging profile as given to
+        data_cleaner.df_to_entry, with column "mamps_last".
+        """
+        times = np.asarray(profile.index.values, dtype='datetime64[ns]')
+        currents = np.asarray(profile['mamps_last'], dtype=CurrentDtype)
+        self._times.write(times.view(TimeDtype).tobytes())
+        self._currents.write(currents.tobytes())
+        self._names.append(name)
+        self._station_ids.append(station_id)
+        self._starts.append(np.datetime64(start, 's'))
+        self._offsets.append(self._offsets[-1] + times.size)
+
+    def close(self):
+        """ Writes the session index table and closes the column files. """
+        self._times.close()
+        self._currents.close()
+        np.savez(os.path.join(self.path, IndexFile), \
+                 name = np.array(self._names, dtype=str), \
+                 station_id = np.array(self._station_ids, dtype=np.int64), \
+                 start = np.array(self._starts, dtype='datetime64[s]'), \
+                 offsets = np.array(self._offsets, dtype=np.int64))
+
+    def abort(self):
+        """ Closes and removes the column files, writing no index. """
+        self._times.close()
+        self._currents.close()
+        for filename in (TimeFile, CurrentFile):
+            os.remove(os.path.join(self.path, filename))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is None: self.close()
+        else: self.abort()
+
+
+class SessionStore:
+    """
+    Reads a store made by StoreWriter. The column files are memory-mapped, so
+    opening a store only reads the index table.
+
+    Attributes:
+    path : Store directory.
+    names, station_ids, starts, offsets : Session index table columns, as
+    numpy arrays. See module docstring.
+    times : numpy.datetime64[ns] array of all datapoint times.
+    currents : numpy float64 array of all currents in mA.
+    """
+
+    def __init__(self, path):
+        """ Opens the store at 'path'. """
+        self.path = path
+        with np.load(os.path.join(path, IndexFile)) as index:
+            self.names = index['name']
+            self.station_ids = index['station_id']
+            self.starts = index['start']
+            self.offsets = index['offsets']
+        self.times = self._map(TimeFile, TimeDtype).view('datetime64[ns]')
+        self.currents = self._map(CurrentFile, CurrentDtype)
+
+    def _map(self, filename, dtype):
+        # np.memmap can not map an empty file
+        filename = os.path.join(self.path, filename)
+        if os.path.getsize(filename) == 0: return np.array([], dtype=dtype)
+        # Plain ndarray view of the read-only map, so slices are cheap views
+        return np.asarray(np.memmap(filename, dtype=dtype, mode='r'))
+
+    # Opened again from the path when sent to another process
+    def __getstate__(self):
+        return self.path
+
+    def __setstate__(self, path):
+        self.__init__(path)
+
+    def __len__(self):
+        return self.names.size
+
+    def arrays(self, i):
+        """ Returns (times, currents) of session i as read-only views. """
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return (self.times[start:end], self.currents[start:end])
+
+    def entry(self, i):
+        """
+        Returns session i as a data_cleaner.Entry over read-only views of the
+        store, without copying or loading its profile.
+        """
+        return dc.arrays_to_entry(*self.arrays(i))
+
+    def profile(self, i):
+        """
+        Returns session i as a pandas.DataFrame like those loaded from a
+        session file, with a time index and column "mamps_last".
+        """
+        times, currents = self.arrays(i)
+        return pd.DataFrame({'mamps_last' : currents}, \
+                            index = pd.DatetimeIndex(times, name = 'time'))
+
+    def name_list(self, i):
+        """
+        Returns [station_id, year, month, day, hour, min, sec] of session i, as
+        file_index.FileIndex.name_lists gives for its filename.
+        """
+        start = self.starts[i].astype(object)
+        return [int(self.station_ids[i]), start.year, start.month, start.day, \
+                start.hour, start.minute, start.second]
+
+    def packed(self):
+        """
+        Returns (times, currents, offsets) of every session, as used by
+        data_cleaner.clean_batch.
+        """
+        return (self.times, self.currents, self.offsets)
+
+
+def pack_directory(directory, store_path):
+    """
+    Packs every charging profile file of directory (a source directory, as for
+    directory_cleaner.clean_directory) into a new store at store_path, which
+    clean_directory and get_files can read instead of the files. Files that
+    can not be loaded are skipped with a message. Raises
+    command_args.InvalidDirectory if directory has no session files.
+    Returns the number of sessions packed.
+    """
+    index = fi.load_index(directory)
+    if len(index) == 0: raise ca.InvalidDirectory
+    dir_len = len(index.directory)
+
+    count = 0
+    with StoreWriter(store_path) as writer:
+        for pathname, name_list in zip(index.paths, index.name_lists()):
+            try:
+                # The store only keeps mamps_last
+                df = sl.load(pathname, ['mamps_last'])
+                writer.append(pathname[dir_len:], name_list[0], \
+                              datetime.datetime(*name_list[1:]), df)
+            except Exception as err:
+                sys.stderr.write("Skipping %s: %s: %s\n" % (pathname, \
+                                 type(err).__name__, err))
+                continue
+            count += 1
+    return count
+
+
+def main():
+    if len(sys.argv) != 3: raise ca.InvalidArgs( Usage )
+    source = sys.argv[1]
+    if source[-1] != "/": source += "/"
+    count = pack_directory(source, sys.argv[2])
+    print("Packed %d sessions from %s into %s." % (count, source, sys.argv[2]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+This module looks up the type and site of charging stations by id.
+
+StationRegistry is built once from the station tables (_acs_lut*.txt, see
+stations_info_df) and answers lookups from a dict, or for a
+whole array of ids at once with a sorted id array. Stations missing from the
+tables get their site from the first digit of their id, as clean_directory
+always did.
+
+load_registry keeps registries in memory and on disk, in a cache directory
+outside the data directory, so the tables are only read again when one of
+them changes.
+"""
+import os
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+
+import result_cache as rc
+
+# Site of stations missing from the station tables, by id // 10 ** 6
+FallbackSites = {2 : "JPL", 3 : "Caltech", 6 : "MVLA"}
+
+DefaultTables = ["_acs_lut.txt", "_acs_lut2.txt", "_acs_lut3.txt"]
+CacheFile = "_acs_lut.registry.pkl"
+
+
+def stations_info_df(filenames = ["_acs_lut.txt"], data_directory = "../Data/"):
+    """
+    Outputs dataframe of station info. 'id' is index. Also has 'type',
+    'max_mA', 'fallback_mA', 'site'. Later tables do not replace stations of
+    earlier ones.
+    """
+    if filenames == []: raise ValueError( "No files specified" )
+    infos = []
+    for filename in filenames:
+        data_curr = pd.read_csv(data_directory+filename, sep='\t')
+        infos.append(data_curr)
+    if len(infos) == 1 :
+        infos[0].set_index('id', inplace=True)
+        return infos[0]
+    else:
+        all_data = pd.concat(infos)
+        all_data = all_data.drop_duplicates(subset = 'id')
+        all_data.set_index('id', inplace=True)
+        return all_data
+
+
+def fallback_site(station_id):
+    """ Returns the site guessed from a station id, or "NaN". """
+    return FallbackSites.get(int(station_id / 10 ** 6), "NaN")
+
+
+class StationRegistry:
+    """
+    Type and site of each station.
+
+    Attributes:
+    ids : Sorted numpy int64 array of the station ids in the tables.
+    types, sites : numpy object arrays of the matching types and sites.
+    """
+
+    def __init__(self, station_df):
+        """
+        Builds a registry from a DataFrame with index 'id' and columns 'type'
+        and 'site', as stations_info_df returns. The first row of an id wins.
+        """
+        table = station_df[~station_df.index.duplicated()].sort_index()
+        self.ids = np.asarray(table.index, dtype=np.int64)
+        self.types = np.asarray(table['type'], dtype=object)
+        self.sites = np.asarray(table['site'], dtype=object)
+        self._lookup = {int(i) : (t, s) for i, t, s in \
+                        zip(self.ids, self.types, self.sites)}
+
+    def resolve(self, station_id):
+        """
+        Returns a new list [type, site] of a station, as clean_directory rows
+        hold.
+        """
+        info = self._lookup.get(station_id)
+        if info is None:
+            return ["NaN", fallback_site(station_id)]
+        return list(info)
+
+    def resolve_many(self, station_ids):
+        """
+        Takes an array of station ids. Returns (types, sites) as numpy object
+        arrays, with the same values resolve gives for each id.
+        """
+        station_ids = np.asarray(station_ids, dtype=np.int64)
+        types = np.full(station_ids.shape, "NaN", dtype=object)
+        sites = np.full(station_ids.shape, "NaN", dtype=object)
+        for digit, site in FallbackSites.items():
+            sites[station_ids // 10 ** 6 == digit] = site
+        if self.ids.size == 0: return (types, sites)
+
+        where = np.searchsorted(self.ids, station_ids)
+        where[where == self.ids.size] = 0
+        found = self.ids[where] == station_ids
+        types[found] = self.types[where[found]]
+        sites[found] = self.sites[where[found]]
+        return (types, sites)
+
+    def fingerprint(self):
+        """ Returns a string that changes if any station's info changes. """
+        h = hashlib.sha1()
+        h.update(self.ids.tobytes())
+        h.update(repr((list(self.types), list(self.sites))).encode())
+        return h.hexdigest()
+
+
+# Registries already loaded by this process, by (tables, data_directory)
+_loaded = {}
+
+
+def _tables_key(filenames, data_directory):
+    """ (name, size, modification time) of each table. """
+    key = []
+    for filename in filenames:
+        stat = os.stat(os.path.join(data_directory, filename))
+        key.append((filename, stat.st_size, stat.st_mtime_ns))
+    return tuple(key)
+
+
+def load_registry(filenames = DefaultTables, data_directory = "../Data/", \
+                  cache_dir = None):
+    """
+    Returns the StationRegistry of the given station tables.
+
+    The registry is kept in memory and pickled to CacheFile in cache_dir
+    (default result_cache.DefaultCacheDir). It is built from the tables again
+    only if one of them changed since.
+    """
+    key = _tables_key(filenames, data_directory)
+    memo_key = (tuple(filenames), os.path.abspath(data_directory))
+    loaded = _loaded.get(memo_key)
+    if loaded is not None and loaded[0] == key: return loaded[1]
+
+    if cache_dir is None: cache_dir = rc.DefaultCacheDir
+    cache_path = os.path.join(cache_dir, CacheFile)
+    registry = None
+    try:
+        with open(cache_path, 'rb') as file:
+            cached = pickle.load(file)
+        if cached.get(memo_key) is not None and cached[memo_key][0] == key:
+            registry = cached[memo_key][1]
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
+        cached = {}
+
+    if registry is None:
+        registry = StationRegistry(stations_info_df(filenames, data_directory))
+        cached[memo_key] = (key, registry)
+        try:
+            os.makedirs(cache_dir, exist_ok = True)
+            temp = cache_path + ".tmp"
+            with open(temp, 'wb') as file:
+                pickle.dump(cached, file, protocol = pickle.HIGHEST_PROTOCOL)
+            os.replace(temp, cache_path)
+        # The cache is only a speed up, so a read-only cache directory is fine
+        except OSError:
+            pass
+
+    _loaded[memo_key] = (key, registry)
+    return registry
@@ -0,0 +1,182 @@
+"""
+This module makes synthetic charging sessions for testing and benchmarking the
+cleaners without real station data.
+
+Sessions look like real ones: the current ramps up, holds near the car's
+maximum, tapers off and may sit at 0 at the end. Settings control the session
+length, sample interval, connectivity gaps and lost datapoints, so every
+criterion of data_cleaner.clean_data can be hit.
+
+Sessions are written as files named 000<station>_YYYY-MM-DD-HH-MM-SS.<ext>,
+as directory_cleaner.clean_directory expects, either pickled (.pkl) or
+tab-delimited (.txt). Example:
+
+    python synthetic_sessions.py ../Data/Synthetic/ 1000 pkl
+"""
+# For arguments passed to library if name = main
+import sys
+import os
+import pickle
+import numpy as np
+import pandas as pd
+
+import session_loaders as sl
+
+Usage = " \n Usage: python %s directory n_sessions [pkl|txt|pkl.gz|...]" \
+        % sys.argv[0]
+
+# Station ids by site. The first digit is the site, as directory_cleaner
+# guesses from ids missing from the station tables.
+Stations = [2010101, 2010102, 3010101, 3010102, 3020330, 6010101]
+
+
+class Settings:
+    """
+    Settings for make_session and write_directory. Times are in seconds.
+
+    Attributes:
+    min_length, max_length : Range of session lengths.
+    intervals : Sample intervals to pick from, one per session.
+    jitter : Fraction of the interval each sample time may move by.
+    gap_rate : Chance a session has a connectivity gap.
+    gap_length : (min, max) length of a gap.
+    dropout_rate : Chance each datapoint is lost.
+    max_mA : (min, max) of the maximum current of a car, in mA.
+    idle_fraction : Largest fraction of a session spent at 0 mA at the end.
+    """
+
+    def __init__(self, min_length = 10 * 60, max_length = 12 * 3600, \
+                 intervals = (10,), jitter = 0.1, gap_rate = 0.1, \
+                 gap_length = (2 * 60, 30 * 60), dropout_rate = 0.02, \
+                 max_mA = (6000, 32000), idle_fraction = 0.3):
+        """ Returns Settings with values as given. """
+        self.min_length = min_length
+        self.max_length = max_length
+        self.intervals = intervals
+        self.jitter = jitter
+        self.gap_rate = gap_rate
+        self.gap_length = gap_length
+        self.dropout_rate = dropout_rate
+        self.max_mA = max_mA
+        self.idle_fraction = idle_fraction
+
+
+def make_session(rng, start, settings = None):
+    """
+    Returns one session's profile as a pandas.DataFrame with a 'time' index and
+    column "mamps_last", as the session files hold.
+
+    rng (numpy.random.Generator) - Source of randomness.
+    start (pandas.Timestamp) - Time of the first datapoint.
+    settings (Settings) - Defaults to Settings().
+    """
+    if settings is None: settings = Settings()
+    length = rng.uniform(settings.min_length, settings.max_length)
+    interval = rng.choice(settings.intervals)
+
+    # Sample times with jitter, first point at 0
+    n = max(int(length / interval), 1)
+    offsets = np.arange(n + 1) * float(interval)
+    offsets[1:] += rng.uniform(-settings.jitter, settings.jitter, n) * interval
+    offsets = np.maximum.accumulate(offsets)
+
+    # Ramp up, hold near the maximum, taper, then idle
+    max_mA = rng.uniform(*settings.max_mA)
+    fraction = offsets / offsets[-1] if offsets[-1] > 0 else offsets
+    idle = rng.uniform(0, settings.idle_fraction)
+    taper = np.clip((1 - idle - fraction) / 0.2, 0, 1)
+    ramp = np.clip(offsets / 60.0, 0, 1)
+    currents = max_mA * ramp * taper
+    currents *= 1 + rng.normal(0, 0.02, currents.size)
+    currents = np.clip(np.round(currents), 0, None)
+
+    keep = rng.random(offsets.size) >= settings.dropout_rate
+    keep[0] = keep[-1] = True
+    if offsets.size > 2 and rng.random() < settings.gap_rate:
+        gap = rng.uniform(*settings.gap_length)
+        gap_start = rng.uniform(0, offsets[-1])
+        keep[1:-1] &= (offsets[1:-1] < gap_start) | \
+                      (offsets[1:-1] > gap_start + gap)
+
+    times = start + pd.to_timedelta(np.round(offsets[keep]), unit = 's')
+    return pd.DataFrame({'mamps_last' : currents[keep]}, \
+                        index = pd.DatetimeIndex(times, name = 'time'))
+
+
+def session_filename(station_id, start, extension):
+    """ Returns the file name of a session, as clean_directory expects. """
+    return "%010d_%s.%s" % (station_id, start.strftime("%Y-%m-%d-%H-%M-%S"), \
+                            extension)
+
+
+def write_session(df, pathname):
+    """
+    Writes a profile pickled if pathname ends in .pkl, else as text.
+    Compressed if a compression extension follows, as in .pkl.gz or .txt.xz
+    (see session_loaders).
+    """
+    fmt, compression = sl.file_kind(pathname)
+    with sl.open_file(pathname, 'wb') as file:
+        if fmt.name == "pkl":
+            pickle.dump(df, file)
+        else:
+            text = df.reset_index()
+            text['time'] = text['time'].dt.strftime("%Y-%m-%d-%H-%M-%S")
+            file.write(text.to_csv(sep='\t', index = False).encode())
+
+
+def write_directory(directory, n_sessions, extension = "pkl", \
+                    settings = None, seed = 0, stations = Stations):
+    """
+    Writes n_sessions synthetic sessions to directory, spread over 'stations'
+    from 2018-01-01. Returns the list of paths written.
+
+    extension - "pkl" for pickled files, "txt" for tab-delimited text,
+    optionally compressed as "pkl.gz", "txt.xz", ...
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok = True)
+    paths = []
+    start = pd.Timestamp("2018-01-01 06:00:00")
+    for i in range(n_sessions):
+        station_id = stations[i % len(stations)]
+        # A few sessions a day per station
+        start += pd.Timedelta(seconds = int(rng.integers(60, 8 * 3600)) \
+                                        // len(stations))
+        pathname = os.path.join(directory, \
+                                session_filename(station_id, start, extension))
+        write_session(make_session(rng, start, settings), pathname)
+        paths.append(pathname)
+    return paths
+
+
+def write_station_tables(data_directory, stations = Stations):
+    """
+    Writes the station tables clean_directory reads (_acs_lut.txt,
+    _acs_lut2.txt and _acs_lut3.txt) to data_directory. The last station is
+    left out so the site fallback is used too.
+    """
+    sites = {2 : "JPL", 3 : "Caltech", 6 : "MVLA"}
+    listed = stations[:-1]
+    table = pd.DataFrame({'id' : listed, \
+                          'type' : ["AV"] * len(listed), \
+                          'max_mA' : [32000] * len(listed), \
+                          'fallback_mA' : [8000] * len(listed), \
+                          'site' : [sites.get(s // 10 ** 6, "NaN") \
+                                    for s in listed]})
+    os.makedirs(data_directory, exist_ok = True)
+    for i, filename in enumerate(["_acs_lut.txt", "_acs_lut2.txt", \
+                                  "_acs_lut3.txt"]):
+        table.iloc[i::3].to_csv(os.path.join(data_directory, filename), \
+                                sep='\t', index = False)
+
+
+def main():
+    if len(sys.argv) not in (3, 4): raise ValueError( Usage )
+    extension = sys.argv[3] if len(sys.argv) == 4 else "pkl"
+    paths = write_directory(sys.argv[1], int(sys.argv[2]), extension)
+    print("Wrote %d sessions to %s." % (len(paths), sys.argv[1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+This module tries many clean_data thresholds on a directory at once, for
+tuning them.
+
+directory_metrics gives only the metrics clean_data looks at (see
+data_cleaner.batch_metrics), from the directory's metrics sidecar (see
+metrics_sidecar), so a directory is read once however many sweeps are run on
+it. sweep then judges every
+combination of a grid of thresholds against those metrics, and gives the
+number of valid sessions and of each error for each combination, as
+clean_data would find them.
+
+Checks are evaluated once per threshold value, as bit masks over the
+sessions. Combinations are gone through in clean_data's check order, so the
+sessions left undecided by the first checks are shared by every combination
+that starts the same way.
+
+From the command line, thresholds are lists of values separated by commas.
+Times take a unit (s, m or h), and "none" turns a check off. Example:
+
+    python threshold_sweep.py ../Data/All-Caltech/ sweep.csv \\
+        --min_charge_time 10m,20m,30m --max_gap_allowed 5m,10m,none \\
+        --min_energy 0,1,5
+"""
+# For arguments passed to library if name = main
+import sys
+import os
+import inspect
+import numpy as np
+import pandas as pd
+
+import data_cleaner as dc
+import directory_cleaner as dir_c
+import session_store as ss
+import metrics_sidecar as ms
+
+Usage = " \n Usage: python %s source_directory output_filename" % sys.argv[0] \
+        + " [--workers N] [--criterion value,value,...]..." \
+        + " \n Criteria: " + ", ".join(c for c, _ in dc.BatchOrder)
+
+# Number of bits set in each byte
+_bit_counts = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+
+
+def directory_metrics(directory, workers = 1):
+    """
+    Returns (paths, metrics) of every session of a directory, or session
+    store, that could be read. metrics is a dict of arrays as batch_metrics
+    gives, with one value per path.
+    workers: as clean_directory, for the sessions the sidecar does not have
+    yet.
+    """
+    if ss.is_store(directory):
+        store = ss.SessionStore(directory)
+        paths = [os.path.join(store.path, name) for name in store.names]
+        return (paths, dc.batch_metrics(*store.packed()))
+
+    table = ms.extract(directory, workers)
+    for i in np.flatnonzero(~table.loaded):
+        sys.stderr.write("Skipping %s: %s\n" % (table.path(i), \
+                                                table.columns['failure'][i]))
+    paths = [table.path(i) for i in np.flatnonzero(table.loaded)]
+    return (paths, table.batch_metrics())
+
+
+def _defaults():
+    """ clean_data's default value of each criterion. """
+    parameters = inspect.signature(dc.clean_data).parameters
+    return {criterion : parameters[criterion].default \
+            for criterion, _ in dc.BatchOrder}
+
+
+def _count(mask):
+    return int(_bit_counts[mask].sum())
+
+
+def sweep(metrics, **grid):
+    """
+    Judges every combination of thresholds against metrics.
+
+    metrics - dict of arrays as batch_metrics or directory_metrics give.
+    grid - Each clean_data criterion to vary, with a list of its values. Other
+    criteria keep clean_data's default.
+
+    Returns a DataFrame with a row per combination: the value of each
+    criterion, 'valid' (number of valid sessions), 'valid_rate' and the number
+    of sessions with each error.
+    """
+    unknown = set(grid) - set(_defaults())
+    if unknown: raise ValueError("Unknown criteria %s" % sorted(unknown))
+    values = []
+    fails = []
+    n = metrics['n_points'].size
+    for criterion, _ in dc.BatchOrder:
+        options = list(grid.get(criterion, [_defaults()[criterion]]))
+        # Raises ValueError for values clean_data would not take
+        for value in options: dc.CleaningConfig(**{criterion : value})
+        values.append(options)
+        # Sessions failing each value, as bits
+        fails.append([np.packbits(np.zeros(n, dtype=bool)) \
+                      if dc.batch_ignores(criterion, value) else \
+                      np.packbits(dc.batch_fails(metrics, criterion, value)) \
+                      for value in options])
+
+    rows = []
+    def visit(k, undecided, chosen, counts):
+        if k == len(values):
+            valid = _count(undecided)
+            rows.append(chosen + [valid, valid / float(n) if n else np.nan] \
+                        + counts)
+            return
+        for value, fail in zip(values[k], fails[k]):
+            failed = undecided & fail
+            visit(k + 1, undecided & ~failed, chosen + [value], \
+                  counts + [_count(failed)])
+    visit(0, np.packbits(np.ones(n, dtype=bool)), [], [])
+
+    criteria = [criterion for criterion, _ in dc.BatchOrder]
+    errors = [error for _, error in dc.BatchOrder]
+    table = pd.DataFrame(rows, columns = criteria + ['valid', 'valid_rate'] \
+                                         + errors)
+    # Criteria as given, errors in clean_data's order
+    return table[[c for c in criteria if c in grid] + \
+                 [c for c in criteria if c not in grid] + \
+                 ['valid', 'valid_rate'] + errors]
+
+
+def parse_value(text):
+    """
+    Parses a threshold from the command line: "none", a number, or a number
+    with unit s, m or h as a numpy.timedelta64. See
+    data_cleaner.parse_criterion.
+    """
+    return dc.parse_criterion(text)
+
+
+def main():
+    args = sys.argv[1:]
+    try:
+        workers = dir_c.pop_option(args, "--workers", "1")
+        workers = None if workers == "auto" else int(workers)
+        grid = {}
+        for criterion, _ in dc.BatchOrder:
+            option = dir_c.pop_option(args, "--" + criterion)
+            if option is not None:
+                grid[criterion] = [parse_value(v) for v in option.split(",")]
+    except (ValueError, dir_c.InvalidArgs) as err:
+        raise dir_c.InvalidArgs( "%s\n%s" % (err, Usage) )
+    if len(args) != 2: raise dir_c.InvalidArgs( Usage )
+
+    source = args[0]
+    if source[-1] != "/": source += "/"
+    paths, metrics = directory_metrics(source, workers)
+    table = sweep(metrics, **grid)
+    print("%d sessions, %d combinations" % (len(paths), table.shape[0]))
+    # Format from the extension, see result_sinks
+    dir_c.rows_to_file(table.values.tolist(), list(table.columns), args[1])
+
+
+if __name__ == "__main__":
+    main()
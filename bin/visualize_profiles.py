@@ -1,7 +1,16 @@
+import os
+import sys
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
+# Figures drawn for files are made without pyplot, on the Agg canvas
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
 import data_cleaner as dc
 import directory_cleaner as dir_c
-import matplotlib.pyplot as plt
-import glob
+import file_index as fi
+import metrics_sidecar as ms
 # For more interactive plotting
 # Need to install this and IPython. Apparently I got this working at some point.
 # from pivottablejs import pivot_ui
@@ -17,21 +26,17 @@ def plot_profile(profile, scatter = False):
 
 # Plot all profiles for a station, may not be complete
 def plot_station(directory, station_id):
-    # File path
+    # Session files of the station
     id_caltech = "0003"
-    month = "*"
-    day = "*-"
-    time = "*"
-    filename = id_caltech + station_id + "_" + month + day + time + ".pkl"
-    path_regx = directory + filename
+    files = fi.load_index(directory).select(station = \
+                                            int(id_caltech + station_id))
 
-    # Plot each file matching path_regx
+    # Plot each file of the station
     handles = []
     names = []
-    for pathname in glob.glob(path_regx):
-        df = dir_c.load_obj(pathname)
-        data = dc.df_to_entry(df)
-        reason = dc.clean_data(data, more_info = True)[1]
+    for pathname in files.paths:
+        df = dir_c.load_session(pathname)
+        reason = dc.clean_data(dc.df_to_entry(df))[1]
         if reason == dc.ShortTime: 
             plt.figure(1)
             handle = plot_profile(df)
@@ -43,42 +48,259 @@ def plot_station(directory, station_id):
     plt.legend(handles, names)
     plt.show()
 
-# Plot all pickled (.pkl) profiles in a given list of pathnames with locations
-# there
-# If save is True, then saves a picture instead of showing each profile in a new
-# window.
+# Plot all profiles in a given list of pathnames with locations there
+# If save is True, then saves a picture of each to ../Output/Profiles/ instead
+# of showing each profile in a new window, see render_sessions.
 def plot_sessions(profile_pathnames, save = False, scatter = True):
+    if save:
+        return render_sessions(profile_pathnames, "../Output/Profiles/")
     for pathname in profile_pathnames:
-        df = dir_c.load_obj(pathname)
-        data = dc.df_to_entry(df)
-        plot_profile(df, scatter)
-        destination = "../Output/Profiles/"
-        if save:
-            plt.savefig(destination + "plotted_" + pathname[21:-4] + ".png", \
-                        bbox_inches='tight')
-            plt.clf()
-        else: plt.show()
-
-# Incomplete.
+        plot_profile(dir_c.load_session(pathname), scatter)
+        plt.show()
+
 # Gives dataframe and plots grouped bar chart where main groups are group and
 # colored bars represent subgroup. group and subgroup are column names for the
-# dataframe.
+# dataframe, from 'station_id', 'site', 'day', 'month' and 'error'.
+# Example: plot_subgroups(dir_c.clean_directory(directory), 'site', 'error')
 def plot_subgroups(data, group, subgroup):
     grouped = dir_c.group_invalids(data, group, subgroup)
-    # Plotting the bars
-    fig_width = 10.
-    # fig, ax = plt.subplots(figsize=(fig_width,5))
+    # Number of sessions with a row per group and a column per subgroup
+    counts = grouped['count'].unstack(subgroup, fill_value = 0)
+    counts.plot.bar(figsize = (10, 5))
+    plt.ylabel("sessions")
+    plt.show()
 
-    
-    group_options = grouped[group].unique()
+def plot_dataframe(df):
+    pivot_ui(df)
 
-    # nbars = grouped.shape[0]
-    # group_width = 0.9 * fig_width / len(group_options)
-    for option in group_options:
-        subgroup = grouped.loc[grouped[group] == option]
-        # subgroup_width = group_width / len(subgroup)
-        plt.bar()
-    grouped.plot.bar()
+## Rendering many profiles to files
 
-def plot_dataframe(df):
-    pivot_ui(df)
\ No newline at end of file
+# Largest number of datapoints drawn for a profile, and for a tile of a contact
+# sheet. Denser profiles are decimated, see decimate.
+MaxPlotPoints = 2000
+MaxTilePoints = 400
+
+# Returns (times, currents) of a profile with at most about max_points
+# datapoints, for display. The profile is cut into max_points / 2 runs of
+# consecutive datapoints and the lowest and highest current of each run are
+# kept, in time order, so spikes and dropouts still show. The first and last
+# datapoints are always kept. Profiles of max_points or fewer datapoints are
+# returned as they are.
+def decimate(times, currents, max_points = MaxPlotPoints):
+    times = np.asarray(times)
+    currents = np.asarray(currents, dtype=float)
+    n = currents.size
+    if n <= max_points: return (times, currents)
+    size = -(-n // max(max_points // 2, 1))
+    runs = -(-n // size)
+    blocks = np.full(runs * size, np.nan)
+    blocks[:n] = currents
+    blocks = blocks.reshape(runs, size)
+    # NaN is neither the lowest nor the highest, unless the whole run is NaN
+    missing = np.isnan(blocks)
+    low = np.where(missing, np.inf, blocks).argmin(axis = 1)
+    high = np.where(missing, -np.inf, blocks).argmax(axis = 1)
+    starts = np.arange(runs) * size
+    index = np.unique(np.concatenate((starts + low, starts + high, [0, n - 1])))
+    index = index[index < n]
+    return (times[index], currents[index])
+
+# Draws profiles one after another on one figure, without pyplot, so there is
+# no window or global figure state. The figure, axes and line are made once
+# and only their data changes for each profile.
+class ProfileRenderer:
+    def __init__(self, size = (8, 4), dpi = 100, max_points = MaxPlotPoints):
+        self.max_points = max_points
+        self.figure = Figure(figsize = size, dpi = dpi)
+        FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot(1, 1, 1)
+        self.line, = self.axes.plot([], [], '.-', markersize = 2, \
+                                    linewidth = 0.5)
+        self.axes.xaxis_date()
+        self.axes.set_ylabel("mamps_last (mA)")
+
+    # Draws the profile (times and currents arrays) titled 'title' and saves
+    # it as a PNG to pathname.
+    def render(self, times, currents, title, pathname):
+        times, currents = decimate(times, currents, self.max_points)
+        self.line.set_data(mdates.date2num(times), currents)
+        self.axes.relim()
+        self.axes.autoscale_view()
+        self.axes.set_title(title)
+        self.figure.savefig(pathname)
+
+# Draws profiles as tiles of a contact sheet, rows x columns to a sheet, on one
+# figure reused for every sheet. Tiles have no axis labels, only the file name
+# of their session.
+class SheetRenderer:
+    def __init__(self, rows = 5, columns = 6, tile_size = (3, 2), dpi = 80, \
+                 max_points = MaxTilePoints):
+        self.max_points = max_points
+        self.figure = Figure(figsize = (columns * tile_size[0], \
+                                        rows * tile_size[1]), dpi = dpi)
+        FigureCanvasAgg(self.figure)
+        self.tiles = []
+        for k in range(rows * columns):
+            axes = self.figure.add_subplot(rows, columns, k + 1)
+            line, = axes.plot([], [], linewidth = 0.5)
+            axes.set_xticks([])
+            axes.tick_params(labelsize = 6)
+            self.tiles.append((axes, line))
+        self.figure.subplots_adjust(left = 0.03, right = 0.99, bottom = 0.02, \
+                                    top = 0.94, wspace = 0.25, hspace = 0.35)
+
+    # Draws profiles, a list of (times, currents, label) of at most rows x
+    # columns sessions, titled 'title', and saves the sheet as a PNG to
+    # pathname. Tiles left over are blank.
+    def render(self, profiles, title, pathname):
+        for k, (axes, line) in enumerate(self.tiles):
+            axes.set_visible(k < len(profiles))
+            if k >= len(profiles): continue
+            times, currents, label = profiles[k]
+            times, currents = decimate(times, currents, self.max_points)
+            line.set_data(mdates.date2num(times), currents)
+            axes.relim()
+            axes.autoscale_view()
+            axes.set_title(label, fontsize = 6)
+        self.figure.suptitle(title)
+        self.figure.savefig(pathname)
+
+# Renderers of this process, by the arguments they were made with, so a
+# worker makes its figures once for all the sessions it draws.
+_renderers = {}
+
+def _renderer(kind, *settings):
+    key = (kind,) + settings
+    if key not in _renderers: _renderers[key] = kind(*settings)
+    return _renderers[key]
+
+# Helper for render_sessions and contact_sheets
+# Returns (times, currents, entry) of a session file, loading only
+# mamps_last.
+def _load_profile(pathname):
+    df = dir_c.load_session(pathname, ['mamps_last'])
+    return (df.index.values, df['mamps_last'].values, dc.df_to_entry(df))
+
+# Helper for render_sessions and contact_sheets
+# Returns the file name of a session without its extensions.
+def _session_name(pathname):
+    return os.path.basename(pathname).split(".")[0]
+
+# Helper for render_sessions
+# Draws one session. item is (pathname, error), where error is None to find it
+# with clean_data. Returns the PNG written, or None if the session could not
+# be loaded.
+def _render_session(item, destination, max_points):
+    pathname, error = item
+    try:
+        times, currents, data = _load_profile(pathname)
+        if error is None: error = dc.clean_data(data)[1]
+        output = os.path.join(destination, \
+                              "plotted_" + _session_name(pathname) + ".png")
+        _renderer(ProfileRenderer, (8, 4), 100, max_points).render(\
+            times, currents, "%s (%s)" % (_session_name(pathname), error), \
+            output)
+    except Exception as err:
+        sys.stderr.write("Skipping %s: %s: %s\n" % (pathname, \
+                         type(err).__name__, err))
+        return None
+    return output
+
+# Usage: render_sessions
+# pathnames: session files to draw, of any format directory_cleaner reads
+# destination: directory to save a PNG of each session in, named
+#              plotted_<file name>.png
+# workers: number of processes to draw with, as clean_directory
+# errors: clean_data error of each session, shown in its title. None finds
+#         them as each session is drawn.
+# max_points: profiles with more datapoints are decimated for display
+#
+# Draws each session to its own PNG, in a figure made once per process.
+# Sessions that can not be loaded are skipped with a message.
+# Returns the list of PNGs written (None for sessions skipped), in order.
+def render_sessions(pathnames, destination = "../Output/Profiles/", \
+                    workers = 1, errors = None, max_points = MaxPlotPoints):
+    os.makedirs(destination, exist_ok = True)
+    if errors is None: errors = [None] * len(pathnames)
+    items = list(zip(pathnames, errors))
+    return list(dir_c.run_checks(_render_session, items, \
+                                 (destination, max_points), workers))
+
+# Helper for contact_sheets
+# Draws one sheet. item is (title, pathnames, output). Returns output.
+def _render_sheet(item, rows, columns, max_points):
+    title, pathnames, output = item
+    profiles = []
+    for pathname in pathnames:
+        try:
+            times, currents, _ = _load_profile(pathname)
+        except Exception as err:
+            sys.stderr.write("Skipping %s: %s: %s\n" % (pathname, \
+                             type(err).__name__, err))
+            continue
+        profiles.append((times, currents, _session_name(pathname)))
+    _renderer(SheetRenderer, rows, columns, (3, 2), 80, max_points).render(\
+        profiles, title, output)
+    return output
+
+# Usage: contact_sheets
+# pathnames: session files to draw
+# errors: clean_data error of each session
+# destination: directory to save the sheets in
+# rows, columns: tiles on each sheet
+# workers: number of processes to draw with, as clean_directory
+#
+# Draws the sessions as tiles of contact sheets, with one set of sheets per
+# error, named <error>_<sheet number>.png. Sessions keep their order within
+# an error.
+# Returns the list of sheets written.
+def contact_sheets(pathnames, errors, destination = "../Output/Sheets/", \
+                   rows = 5, columns = 6, workers = 1, \
+                   max_points = MaxTilePoints):
+    os.makedirs(destination, exist_ok = True)
+    by_error = {}
+    for pathname, error in zip(pathnames, errors):
+        by_error.setdefault(error, []).append(pathname)
+
+    per_sheet = rows * columns
+    items = []
+    for error in sorted(by_error):
+        files = by_error[error]
+        sheets = -(-len(files) // per_sheet)
+        for k in range(sheets):
+            title = "%s: %d sessions, sheet %d of %d" % (error, len(files), \
+                                                         k + 1, sheets)
+            output = os.path.join(destination, "%s_%d.png" % (error, k + 1))
+            items.append((title, files[k * per_sheet : (k + 1) * per_sheet], \
+                          output))
+    # A sheet is a task of its own, so chunks of one sheet
+    return list(dir_c.run_checks(_render_sheet, items, \
+                                 (rows, columns, max_points), workers, 1))
+
+# Usage: render_directory
+# directory: directory of session files, as for clean_directory
+# destination: directory to save the PNGs in
+# sheets: draw contact sheets grouped by error (see contact_sheets) if True,
+#         or a PNG per session (see render_sessions) if False
+# include: clean_data errors of the sessions to draw. None draws every session
+#          that is not ValidData.
+# workers: number of processes to draw with, as clean_directory
+#
+# Finds the error of each session from the directory's metrics sidecar (see
+# metrics_sidecar), so only the sessions drawn are loaded.
+# Returns the list of PNGs written.
+def render_directory(directory, destination = "../Output/Profiles/", \
+                     sheets = True, include = None, workers = 1):
+    pathnames = []
+    errors = []
+    for pathname, record in ms.extract(directory, workers).records():
+        error = dc.clean_data(record)[1]
+        if include is None: drawn = error != dc.ValidData
+        else: drawn = error in include
+        if drawn:
+            pathnames.append(pathname)
+            errors.append(error)
+    if sheets:
+        return contact_sheets(pathnames, errors, destination, \
+                              workers = workers)
+    return render_sessions(pathnames, destination, workers, errors)
@@ -0,0 +1,52 @@
+"""
+This module runs a check over many items with a pool of worker processes,
+keeping the order of the items. directory_cleaner.clean_directory and the
+other scripts in bin check their files with it.
+
+The check and its extra arguments are sent to each worker once, when the pool
+starts, so only the items travel with every task.
+"""
+import os
+import multiprocessing
+
+# Largest number of items sent to a worker at a time when chunksize is None.
+MaxChunksize = 64
+
+# State of a worker process. Set once per process by _init_worker so the
+# arguments (such as the station table) are not sent again with every item.
+_worker_check = None
+_worker_args = ()
+
+
+def _init_worker(check, *args):
+    global _worker_check, _worker_args
+    _worker_check = check
+    _worker_args = args
+
+
+def _check_worker(item):
+    return _worker_check(item, *_worker_args)
+
+
+def run_checks(check, items, args, workers = 1, chunksize = None):
+    """
+    Yields check(item, *args) for each item in items, in order, using
+    'workers' processes (None for one per CPU, 1 to check in this process).
+    Items go to the pool a window at a time, so finished results never pile
+    up ahead of the reader. check must be picklable, such as a module level
+    function.
+    """
+    if workers is None: workers = os.cpu_count() or 1
+    workers = min(workers, len(items))
+
+    if workers <= 1:
+        for item in items: yield check(item, *args)
+        return
+    if chunksize is None:
+        chunksize = max(1, min(len(items) // (workers * 4), MaxChunksize))
+    window = workers * chunksize * 4
+    with multiprocessing.Pool(workers, _init_worker, (check,) + args) as pool:
+        for start in range(0, len(items), window):
+            # imap keeps the order of items
+            yield from pool.imap(_check_worker, items[start : start + window], \
+                                 chunksize)
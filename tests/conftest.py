@@ -0,0 +1,86 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The modules in bin are scripts, imported by name as they import each other
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname( \
+    os.path.abspath(__file__))), "bin"))
+
+import data_cleaner as dc
+import synthetic_sessions as synth
+
+# Criteria as keyword arguments of clean_data. Besides the defaults, each
+# check is turned off in turn, and tight criteria make every error common.
+CriteriaSets = [
+    {},
+    {'min_charge_time' : None},
+    {'min_average_time_gap' : None},
+    {'max_gap_allowed' : None},
+    {'min_energy' : None},
+    {'min_maxpower' : None},
+    {'max_time' : None},
+    {'min_energy' : 0, 'min_maxpower' : 0},
+    dict((criterion, None) for criterion in dc.Criteria),
+    {'min_charge_time' : np.timedelta64(2, 'h'), \
+     'min_average_time_gap' : np.timedelta64(10500, 'ms'), \
+     'max_gap_allowed' : np.timedelta64(60, 's'), \
+     'min_energy' : 20000, \
+     'min_maxpower' : 5000, \
+     'max_time' : np.timedelta64(6, 'h')},
+    {'min_charge_time' : None, 'max_gap_allowed' : None, \
+     'min_average_time_gap' : np.timedelta64(0, 's'), 'min_energy' : 1e9},
+]
+
+# Sessions of every kind: short and long, with gaps and lost datapoints
+Settings = synth.Settings(min_length = 60, max_length = 24 * 3600, \
+                          intervals = (5, 10, 12), gap_rate = 0.4, \
+                          dropout_rate = 0.1)
+
+
+@pytest.fixture(scope = "session")
+def profiles():
+    """
+    200 synthetic session profiles, then one of a single datapoint and one of
+    two datapoints at the same time.
+    """
+    rng = np.random.default_rng(0)
+    start = pd.Timestamp("2018-01-01")
+    profiles = [synth.make_session(rng, start + pd.Timedelta(hours = i), \
+                                   Settings) for i in range(200)]
+    profiles.append(profiles[0].iloc[:1])
+    profiles.append(pd.DataFrame({'mamps_last' : [9000.0, 9000.0]}, \
+                    index = pd.DatetimeIndex([start, start], name = 'time')))
+    return profiles
+
+
+@pytest.fixture(scope = "session")
+def entries(profiles):
+    return [dc.df_to_entry(profile) for profile in profiles]
+
+
+@pytest.fixture(params = CriteriaSets)
+def criteria(request):
+    """ Each of CriteriaSets in turn. """
+    return request.param
+
+
+@pytest.fixture
+def verdicts(entries, criteria):
+    """ (is_clean, error) clean_data gives each of entries with criteria. """
+    return [tuple(dc.clean_data(entry, **criteria)[:2]) for entry in entries]
+
+
+@pytest.fixture
+def data_root(tmp_path, monkeypatch):
+    """
+    Returns a directory holding Data/, with the synthetic station tables, and
+    run/, made the current directory. clean_directory then finds the tables
+    in ../Data/ and keeps its caches in ../Cache, as when run from bin.
+    """
+    synth.write_station_tables(str(tmp_path / "Data"))
+    (tmp_path / "run").mkdir()
+    monkeypatch.chdir(tmp_path / "run")
+    return tmp_path
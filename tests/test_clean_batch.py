@@ -0,0 +1,49 @@
+"""
+Checks that clean_batch and batch_verdict, on sessions packed into flat
+arrays, give each session the verdict clean_data gives it.
+"""
+import numpy as np
+import pytest
+
+import data_cleaner as dc
+
+
+def pairs(is_valid, error):
+    return list(zip(is_valid.tolist(), error.tolist()))
+
+
+def test_clean_batch(profiles, criteria, verdicts):
+    packed = dc.pack_profiles(profiles)
+    assert pairs(*dc.clean_batch(*packed, **criteria)) == verdicts
+
+
+def test_batch_verdict(profiles, criteria, verdicts):
+    metrics = dc.batch_metrics(*dc.pack_profiles(profiles))
+    assert pairs(*dc.batch_verdict(metrics, **criteria)) == verdicts
+
+
+def test_batch_metrics(profiles, entries):
+    metrics = dc.batch_metrics(*dc.pack_profiles(profiles))
+    assert metrics['n_points'].tolist() == [e.n_points for e in entries]
+    assert np.array_equal(metrics['length'], np.array(\
+        [e.length for e in entries], dtype='timedelta64[ns]'))
+    assert np.array_equal(metrics['max_gap'], np.array(\
+        [e.max_gap_info[0] for e in entries], dtype='timedelta64[ns]'))
+    assert metrics['energy'] == pytest.approx([e.energyDemand \
+                                               for e in entries])
+
+
+def test_no_sessions():
+    packed = dc.pack_profiles([])
+    is_valid, error = dc.clean_batch(*packed)
+    assert is_valid.size == 0 and error.size == 0
+    is_valid, error = dc.batch_verdict(dc.batch_metrics(*packed))
+    assert is_valid.size == 0 and error.size == 0
+
+
+def test_empty_session(profiles):
+    packed = dc.pack_profiles([profiles[0], profiles[0].iloc[:0]])
+    with pytest.raises(ValueError):
+        dc.clean_batch(*packed)
+    with pytest.raises(ValueError):
+        dc.batch_metrics(*packed)
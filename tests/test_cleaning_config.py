@@ -0,0 +1,114 @@
+"""
+Checks CleaningConfig: it gives clean_data's verdicts, refuses criteria that
+are not valid, skips turned off checks without looking at the session, and
+is cached by value and type. Also checks the criteria options of
+directory_cleaner's command line.
+"""
+import datetime
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_cleaner as dc
+import directory_cleaner as dir_c
+
+
+def test_config_matches_clean_data(profiles, entries, criteria, verdicts):
+    config = dc.CleaningConfig(**criteria)
+    assert [tuple(config.check(entry)[:2]) for entry in entries] == verdicts
+    assert [tuple(dc.clean_data(entry, config = config)[:2]) \
+            for entry in entries] == verdicts
+    packed = dc.pack_profiles(profiles)
+    for is_valid, error in (config.check_batch(*packed), \
+                            config.verdict(dc.batch_metrics(*packed))):
+        assert list(zip(is_valid.tolist(), error.tolist())) == verdicts
+
+
+@pytest.mark.parametrize("criterion, value", [
+    ('min_energy', -1), \
+    ('min_energy', True), \
+    ('min_energy', np.nan), \
+    ('min_energy', "5"), \
+    ('min_maxpower', np.timedelta64(5, 's')), \
+    ('min_charge_time', 20), \
+    ('max_time', np.timedelta64(-1, 'h')), \
+    ('max_gap_allowed', np.timedelta64('NaT'))])
+def test_invalid_criteria(criterion, value):
+    with pytest.raises(ValueError):
+        dc.CleaningConfig(**{criterion : value})
+    with pytest.raises(ValueError):
+        dc.clean_data(dc.df_to_entry(pd.DataFrame({'mamps_last' : [1.0]}, \
+                      index = pd.DatetimeIndex(["2018-01-01"], \
+                                               name = 'time'))), \
+                      **{criterion : value})
+
+
+def test_equal_values_of_another_type_are_checked(entries):
+    assert dc.clean_data(entries[0], min_energy = 1)
+    # True == 1, but is not a valid criterion
+    with pytest.raises(ValueError):
+        dc.clean_data(entries[0], min_energy = True)
+    assert dc.clean_data(entries[0], max_gap_allowed = pd.Timedelta("1h")) \
+           == dc.clean_data(entries[0], max_gap_allowed = \
+                            datetime.timedelta(hours = 1))
+
+
+def test_disabled_checks_look_at_nothing():
+    config = dc.CleaningConfig(*[None] * len(dc.Criteria))
+    assert config.checks == () and config.metrics == frozenset()
+    assert not config.needs_currents
+    # Nothing of the session is read
+    assert dc.clean_data(object(), config = config) == (True, dc.ValidData)
+    assert dc.CleaningConfig(min_energy = 0, min_maxpower = 0).metrics \
+           .isdisjoint(dc.CurrentMetrics)
+
+
+def test_only():
+    config = dc.CleaningConfig(min_energy = 5).only('min_energy', 'max_time')
+    assert [c for c, _ in config.checks] == ['max_time', 'min_energy']
+    assert config.min_energy == 5
+    with pytest.raises(ValueError):
+        config.only('nope')
+
+
+def test_pickle():
+    config = dc.CleaningConfig(min_energy = 5, max_time = None)
+    copy = pickle.loads(pickle.dumps(config))
+    assert copy.criteria == config.criteria
+    assert copy.checks == config.checks
+
+
+def test_parse_criterion():
+    assert dc.parse_criterion("none") is None
+    assert dc.parse_criterion("20m") == np.timedelta64(20, 'm')
+    assert dc.parse_criterion("5") == 5
+    assert dc.parse_criterion("2.5") == 2.5
+    with pytest.raises(ValueError):
+        dc.parse_criterion("five")
+
+
+def test_config_from_args():
+    args = ["a", "--min_energy", "5", "--max_time", "none", "b", \
+            "--only", "min_energy,max_time"]
+    config = dir_c.config_from_args(args)
+    assert args == ["a", "b"]
+    assert config.criteria == (None, None, None, 5, None, None)
+    assert dir_c.config_from_args(["a", "b"]) is None
+
+
+@pytest.mark.parametrize("args, reason", [
+    (["--min_energy", "-1"], "min_energy must be"), \
+    (["--min_energy"], "--min_energy needs a value"), \
+    (["--check", "nope"], "Unknown check nope"), \
+    (["--check", "long_df", "--min_energy", "3"], \
+     "long_df takes no criteria"), \
+    (["--workers", "x"], "invalid literal")])
+def test_main_gives_the_reason(monkeypatch, args, reason):
+    monkeypatch.setattr("sys.argv", ["directory_cleaner.py", "source/", \
+                                     "out.csv"] + args)
+    with pytest.raises(dir_c.InvalidArgs) as info:
+        dir_c.main()
+    assert reason in str(info.value)
+    assert "Usage" in str(info.value)
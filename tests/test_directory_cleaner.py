@@ -0,0 +1,132 @@
+"""
+Checks that clean_directory gives the same rows with any number of workers,
+and an error row for each file that can not be loaded or checked.
+"""
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+import directory_cleaner as dir_c
+import result_sinks as rs
+import synthetic_sessions as synth
+
+
+def failing_check(df):
+    """ gap_vals, failing for sessions with an odd number of datapoints. """
+    data = dir_c.as_entry(df)
+    if data.n_points % 2: raise ValueError("odd session")
+    return dir_c.gap_vals(data)
+failing_check.cols = dir_c.gap_vals.cols
+failing_check.takes_entry = True
+
+
+@pytest.fixture
+def sessions(data_root):
+    """ Returns (directory, sorted session paths), one of them corrupt. """
+    directory = str(data_root / "Data" / "Sessions") + "/"
+    paths = sorted(synth.write_directory(directory, 40))
+    with open(paths[6], 'wb') as file: file.write(b"\x80\x04corrupt")
+    return (directory, paths)
+
+
+@pytest.mark.parametrize("check_fun", [dir_c.clean_df, dir_c.gap_vals, \
+                                       dir_c.long_df])
+def test_workers_give_the_same_rows(sessions, check_fun):
+    directory, paths = sessions
+    one = dir_c.clean_directory(directory, check_fun)
+    for workers, chunksize in [(2, None), (3, 1), (2, 7)]:
+        pd.testing.assert_frame_equal( \
+            dir_c.clean_directory(directory, check_fun, workers, chunksize), \
+            one)
+
+
+def test_corrupt_file_gives_error_row(sessions):
+    directory, paths = sessions
+    for workers in (1, 2):
+        rows = dir_c.clean_directory(directory, dir_c.gap_vals, workers)
+        assert list(rows['path']) == paths
+        failed = rows[rows['error'] == dir_c.FileError]
+        assert list(failed['path']) == [paths[6]]
+        assert failed['is_valid'].tolist() == [False]
+        assert failed['energy (AV)'].isna().all()
+        # The station columns are still filled in
+        assert failed['station_id'].tolist() == \
+               [int(os.path.basename(paths[6])[:10])]
+
+
+def test_failing_check_gives_error_rows(sessions):
+    directory, paths = sessions
+    one = dir_c.clean_directory(directory, failing_check)
+    entries = [dir_c.as_entry(dir_c.load_session(path)) if i != 6 else None \
+               for i, path in enumerate(paths)]
+    want = [i for i, data in enumerate(entries) \
+            if data is None or data.n_points % 2]
+    assert list(one.index[one['error'] == dir_c.FileError]) == want
+    pd.testing.assert_frame_equal( \
+        dir_c.clean_directory(directory, failing_check, 2), one)
+
+
+def test_main_workers(sessions, monkeypatch):
+    directory, paths = sessions
+    os.mkdir("../Output")
+    for workers in ("1", "2"):
+        monkeypatch.setattr(sys, "argv", ["directory_cleaner.py", directory, \
+                                          "rows%s.csv" % workers, \
+                                          "--workers", workers, \
+                                          "--check", "clean_df"])
+        dir_c.main()
+    assert pd.read_csv("../Output/rows1.csv").equals( \
+        pd.read_csv("../Output/rows2.csv"))
+    monkeypatch.setattr(sys, "argv", ["directory_cleaner.py", directory, \
+                                      "rows.csv", "--workers", "many"])
+    with pytest.raises(dir_c.InvalidArgs):
+        dir_c.main()
+
+
+def test_iter_rows_streams_clean_directory(sessions):
+    directory, paths = sessions
+    rows = dir_c.iter_rows(directory, dir_c.gap_vals, workers = 2, \
+                           chunksize = 1)
+    first = next(rows)
+    assert first[-1] == paths[0]
+    frame = pd.DataFrame([first] + list(rows), \
+                         columns = dir_c.result_columns(dir_c.gap_vals))
+    pd.testing.assert_frame_equal(frame, \
+        dir_c.clean_directory(directory, dir_c.gap_vals))
+
+
+def test_iter_entries_skips_corrupt_files(sessions):
+    directory, paths = sessions
+    entries = list(dir_c.iter_entries(directory))
+    assert [path for path, _ in entries] == paths[:6] + paths[7:]
+    for path, data in entries[:5]:
+        want = dir_c.as_entry(dir_c.load_session(path))
+        assert data.n_points == want.n_points
+        assert data.energyDemand == want.energyDemand
+
+
+def test_rows_to_file_writes_chunks(sessions, monkeypatch):
+    directory, paths = sessions
+    columns = dir_c.result_columns(dir_c.clean_df)
+    # Rows read from iter_rows when each chunk is written
+    read = []
+    written = []
+    def counted(rows):
+        for row in rows:
+            read.append(row)
+            yield row
+    write = rs.CsvSink.write
+    def recorded(sink, chunk):
+        written.append((len(chunk), len(read)))
+        write(sink, chunk)
+    monkeypatch.setattr(rs.CsvSink, "write", recorded)
+    os.mkdir("../Output")
+    count = dir_c.rows_to_file(counted(dir_c.iter_rows(directory)), \
+                               columns, "rows.csv", chunk_size = 7)
+    assert count == len(paths)
+    assert written == [(7, 7), (7, 14), (7, 21), (7, 28), (7, 35), (5, 40)]
+    rows = pd.read_csv("../Output/rows.csv")
+    assert list(rows.columns) == columns
+    assert list(rows['path']) == paths
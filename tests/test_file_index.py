@@ -0,0 +1,73 @@
+"""
+Checks the names FileIndex parses, its selections, and when load_index lists
+the directory again.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+import file_index as fi
+import synthetic_sessions as synth
+
+
+def test_names_are_parsed(tmp_path):
+    directory = str(tmp_path / "Sessions") + "/"
+    paths = synth.write_directory(directory, 20, "pkl")
+    synth.write_directory(directory, 5, "txt.gz", seed = 1)
+    # Not session files
+    for name in ["notes.txt", "0003020330_2017-12-21.pkl", "_acs_lut.txt"]:
+        with open(directory + name, 'w') as file: file.write("x")
+    os.mkdir(directory + "0003020330_2018-01-01-00-00-00.pkl")
+
+    index = fi.FileIndex.build(directory)
+    assert len(index) == 25
+    assert index.paths == sorted(index.paths)
+    for path, name_list, (_, row) in zip(index.paths, index.name_lists(), \
+                                         index.table.iterrows()):
+        name = os.path.basename(path)
+        station, start = name.split('_')
+        start, extension = start.split('.', 1)
+        assert name_list == [int(station)] + \
+                            [int(v) for v in start.split('-')]
+        assert row['start'] == np.datetime64(pd.Timestamp( \
+            *name_list[1:]), 's')
+        assert row['extension'] == extension
+        assert row['size'] == os.path.getsize(path)
+    assert set(paths) <= set(index.paths)
+
+
+def test_select(tmp_path):
+    directory = str(tmp_path / "Sessions") + "/"
+    synth.write_directory(directory, 40)
+    index = fi.load_index(directory, cache = False)
+    station = synth.Stations[1]
+    start, end = "2018-01-02", "2018-01-04"
+    selected = index.select(station = station, start = start, end = end)
+    table = index.table
+    want = table[(table['station_id'] == station) & \
+                 (table['start'] >= pd.Timestamp(start)) & \
+                 (table['start'] < pd.Timestamp(end))]
+    assert selected.paths == list(want['path'])
+    assert len(index.select(station = list(synth.Stations))) == len(index)
+    assert len(index.select(extension = "txt")) == 0
+
+
+def test_index_is_cached_outside_directory(tmp_path):
+    directory = str(tmp_path / "Sessions") + "/"
+    synth.write_directory(directory, 10)
+    cache_dir = str(tmp_path / "Cache")
+    listed = sorted(os.listdir(directory))
+    index = fi.load_index(directory, cache_dir = cache_dir)
+    assert sorted(os.listdir(directory)) == listed
+    assert os.listdir(os.path.join(cache_dir, fi.IndexKind)) != []
+
+    # The same directory gives the saved index
+    again = fi.load_index(directory, cache_dir = cache_dir)
+    pd.testing.assert_frame_equal(again.table, index.table)
+
+    # A file added lists the directory again
+    added = synth.write_directory(directory, 1, seed = 5)[0]
+    os.utime(directory, ns = (0, os.stat(directory).st_mtime_ns + 10 ** 9))
+    again = fi.load_index(directory, cache_dir = cache_dir)
+    assert len(again) == len(index) + 1 and added in again.paths
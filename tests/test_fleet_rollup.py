@@ -0,0 +1,86 @@
+"""
+Checks that Rollup totals match grouping the rows directly, however the rows
+are split into chunks, and that rows it can not group are refused up front.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_cleaner as dc
+import directory_cleaner as dir_c
+import fleet_rollup as fr
+import synthetic_sessions as synth
+
+Columns = dir_c.result_columns(dir_c.datapoint_length_vals)
+
+
+def make_rows(n_rows, seed = 0):
+    rng = np.random.default_rng(seed)
+    errors = [dc.ValidData, dc.ShortTime, dc.BigGap]
+    rows = []
+    for i in range(n_rows):
+        station = int(rng.choice([2010101, 3010101, 6010101]))
+        rows.append([bool(i % 3 == 0), errors[i % 3], \
+                     float(rng.uniform(0, 24)), 10.0, \
+                     float(rng.uniform(0, 90)), float(rng.uniform(0, 50)), \
+                     "AV", ["JPL", "Caltech", np.nan][i % 3], station, \
+                     2018, int(rng.integers(1, 3)), int(rng.integers(1, 4)), \
+                     0, 0, 0, "f%d.pkl" % i])
+    # An impossible date, as in a file named 0003010101_2018-13-01-...
+    rows[5][10] = 13
+    return rows
+
+
+def test_matches_groupby():
+    rows = make_rows(300)
+    frame = pd.DataFrame(rows, columns = Columns)
+    sums = fr.rollup_frame(frame).query(['site', 'error'])
+    want = frame.groupby(['site', 'error'], dropna = False).agg(\
+        count = ('path', 'size'), energy = ('energy (AV)', 'sum'))
+    assert sums['count'].tolist() == want['count'].tolist()
+    assert np.allclose(sums['energy (AV)'].values, want['energy'].values)
+    assert sums['count'].sum() == len(rows)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1000])
+def test_chunks_give_the_same_groups(chunk_size):
+    rows = make_rows(100)
+    whole = fr.rollup_frame(pd.DataFrame(rows, columns = Columns))
+    tracked = fr.Rollup()
+    assert list(tracked.track(iter(rows), Columns, chunk_size)) == rows
+    # Rows of unknown site or day make one group each, not one per chunk
+    assert len(tracked) == len(whole)
+    assert tracked.groups().equals(whole.groups())
+    assert None in [key[2] for key in tracked.keys]
+    assert None in [key[1] for key in tracked.keys]
+
+
+def test_merge():
+    rows = make_rows(60)
+    first = fr.rollup_frame(pd.DataFrame(rows[:30], columns = Columns))
+    first.merge(fr.rollup_frame(pd.DataFrame(rows[30:], columns = Columns)))
+    whole = fr.rollup_frame(pd.DataFrame(rows, columns = Columns))
+    assert first.groups().equals(whole.groups())
+    with pytest.raises(ValueError):
+        first.merge(fr.Rollup(gap_bins = (0, 1, np.inf)))
+
+
+def test_rows_without_error_are_refused():
+    columns = dir_c.result_columns(dir_c.long_df)
+    rollup = fr.Rollup()
+    # Refused before any row is read
+    with pytest.raises(ValueError):
+        rollup.track(iter([]), columns)
+    with pytest.raises(ValueError):
+        rollup.add_frame(pd.DataFrame([], columns = columns))
+
+
+def test_main_refuses_rollup_of_long_df(data_root, monkeypatch):
+    source = str(data_root / "Data" / "sessions") + "/"
+    synth.write_directory(source, 3)
+    output = str(data_root / "out.csv")
+    monkeypatch.setattr("sys.argv", ["directory_cleaner.py", "--check", \
+                        "long_df", "--rollup", "r.pkl", source, output])
+    with pytest.raises(dir_c.InvalidArgs):
+        dir_c.main()
+    assert not (data_root / "out.csv").exists()
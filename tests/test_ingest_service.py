@@ -0,0 +1,134 @@
+"""
+Checks the ingest service end to end over a local socket: verdicts of uploads
+and live sessions, answers to bad messages, and what a station gets when it
+closes its side of the connection.
+"""
+import asyncio
+import json
+
+import numpy as np
+import pandas as pd
+
+import data_cleaner as dc
+import ingest_service as ing
+import synthetic_sessions as synth
+
+Station = 3020330
+
+
+def session_lists(seed = 0):
+    """ Returns (times, mamps, expected error) of a synthetic session. """
+    rng = np.random.default_rng(seed)
+    profile = synth.make_session(rng, pd.Timestamp("2018-01-01 06:00:00"))
+    error = dc.clean_data(dc.df_to_entry(profile))[1]
+    times = profile.index.values.astype('datetime64[ns]').view(np.int64)
+    return (times.tolist(), profile['mamps_last'].values.tolist(), error)
+
+
+def strict_loads(line):
+    def no_constant(name): raise ValueError("%s is not JSON" % name)
+    return json.loads(line, parse_constant = no_constant)
+
+
+async def exchange(messages, service = None, **options):
+    """
+    Sends messages (dicts, or bytes sent as they are) to a new service on one
+    connection, then closes the sending side. Returns the parsed answers
+    read until the service closes the connection, and the service.
+    """
+    if service is None: service = ing.IngestService(**options)
+    server = await service.start(ing.Host, 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        reader, writer = await asyncio.open_connection(ing.Host, port)
+        for message in messages:
+            if isinstance(message, dict):
+                message = json.dumps(message).encode() + b"\n"
+            writer.write(message)
+        writer.write_eof()
+        answers = []
+        while True:
+            line = await asyncio.wait_for(reader.readline(), 30)
+            if not line: break
+            answers.append(strict_loads(line))
+        writer.close()
+    finally:
+        await service.close()
+    return (answers, service)
+
+
+def upload(session, times, mamps):
+    return {'type' : 'upload', 'station' : Station, 'session' : session, \
+            'times' : times, 'mamps' : mamps}
+
+
+def verdicts(answers):
+    return dict((answer['session'], answer['error']) for answer in answers \
+                if answer['type'] == 'verdict')
+
+
+def test_uploads_get_clean_data_verdicts():
+    sessions = [session_lists(seed) for seed in range(6)]
+    messages = [upload(str(i), times, mamps) \
+                for i, (times, mamps, _) in enumerate(sessions)]
+    answers, _ = asyncio.run(exchange(messages))
+    # Every verdict arrives even though the station closed its side first
+    assert verdicts(answers) == dict((str(i), error) for i, (_, _, error) \
+                                     in enumerate(sessions))
+
+
+def test_live_session_matches_upload():
+    times, mamps, error = session_lists(3)
+    messages = [{'type' : 'samples', 'station' : Station, 'session' : 'a', \
+                 'times' : times[i : i + 50], 'mamps' : mamps[i : i + 50]} \
+                for i in range(0, len(times), 50)]
+    messages.append({'type' : 'end', 'station' : Station, 'session' : 'a'})
+    answers, service = asyncio.run(exchange(messages))
+    assert verdicts(answers) == {'a' : error}
+    assert service._live == {}
+
+
+def test_bad_messages_keep_the_connection():
+    times, mamps, error = session_lists(1)
+    bad = [b"not json\n", b"[1, 2]\n", \
+           {'type' : 'nope'}, \
+           {'type' : 'upload', 'station' : Station, 'session' : 'x'}, \
+           upload('x', [1, 2], [1.0]), \
+           upload('x', [True, False], [1.0, 2.0]), \
+           upload('x', [1e30, 2e30], [1.0, 2.0]), \
+           upload('x', [10 ** 30, 10 ** 30 + 1], [1.0, 2.0]), \
+           upload('x', [1, 2], ["a", "b"]), \
+           upload('x', [1, 2], [float('inf'), 1.0])]
+    answers, _ = asyncio.run(exchange(bad + [upload('good', times, mamps)]))
+    assert [answer['type'] for answer in answers] == \
+           ['error'] * len(bad) + ['verdict']
+    assert verdicts(answers) == {'good' : error}
+
+
+def test_bad_samples_start_no_session():
+    samples = {'type' : 'samples', 'station' : Station, 'session' : 'a', \
+               'times' : [1e30], 'mamps' : [1.0]}
+    service = ing.IngestService()
+    answers, _ = asyncio.run(exchange([samples, {'type' : 'metrics'}], \
+                                      service))
+    assert answers[0]['type'] == 'error'
+    assert service.metrics.received == 0
+
+
+def test_metrics_are_strict_json():
+    times, mamps, _ = session_lists(2)
+    answers, _ = asyncio.run(exchange([{'type' : 'metrics'}, \
+                                       upload('a', times, mamps)]))
+    # No latency is known before the first verdict
+    assert answers[0]['type'] == 'metrics'
+    assert answers[0]['latency_mean'] is None
+    assert answers[0]['errors'] == {}
+
+
+def test_clean_sessions_reports_errors():
+    times = np.array([0, 10 ** 9], dtype=np.int64)
+    results = ing.clean_sessions([(times, np.array([1.0, 2.0])), \
+                                  (times, None)])
+    assert results[0] == tuple(dc.clean_data(dc.arrays_to_entry( \
+        times.view('datetime64[ns]'), np.array([1.0, 2.0])))[:2])
+    assert results[1][0] is False
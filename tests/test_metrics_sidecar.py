@@ -0,0 +1,103 @@
+"""
+Checks the metrics sidecar against the Entry of each session, that clean_data
+gives the same verdicts from it, and which sessions extract reads again.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+import data_cleaner as dc
+import directory_cleaner as dir_c
+import metrics_sidecar as ms
+import session_loaders as sl
+import session_store as ss
+import synthetic_sessions as synth
+
+
+def write_sessions(data_root, n_sessions = 40):
+    directory = str(data_root / "Data" / "Sessions") + "/"
+    return (directory, synth.write_directory(directory, n_sessions))
+
+
+def test_session_metrics(entries, criteria):
+    metrics = [dc.entry_metrics(entry) for entry in entries]
+    assert [tuple(dc.clean_data(m, **criteria)[:2]) for m in metrics] == \
+           [tuple(dc.clean_data(e, **criteria)[:2]) for e in entries]
+
+
+def test_records_match_entries(data_root):
+    directory, paths = write_sessions(data_root)
+    table = ms.extract(directory)
+    assert len(table) == len(paths) and table.loaded.all()
+    for path, record in table.records():
+        entry = dc.df_to_entry(sl.load(path))
+        assert record.startTime == entry.startTime
+        assert record.endTime == entry.endTime
+        assert record.n_points == entry.n_points
+        assert record.average_gap == entry.average_gap
+        assert np.isclose(record.energyDemand, entry.energyDemand)
+        assert np.isclose(record.max_power, entry.max_power)
+        assert dc.clean_data(record)[:2] == dc.clean_data(entry)[:2]
+
+
+def test_sidecar_is_kept(data_root, monkeypatch):
+    directory, paths = write_sessions(data_root)
+    first = ms.extract(directory)
+    assert os.path.exists(ms.sidecar_path(directory))
+    # Nothing changed, so no session is loaded again
+    def no_load(pathname, columns = None):
+        raise AssertionError("%s loaded again" % pathname)
+    monkeypatch.setattr(sl, "load", no_load)
+    again = ms.extract(directory)
+    assert list(again.names) == list(first.names)
+    assert np.array_equal(again.columns['energy'], first.columns['energy'])
+
+
+def test_failed_session_is_read_again(data_root):
+    directory, paths = write_sessions(data_root)
+    broken = paths[3]
+    with open(broken, 'rb') as file: good = file.read()
+    with open(broken, 'wb') as file: file.write(b"\0" * len(good))
+    stat = os.stat(broken)
+    table = ms.extract(directory)
+    row = table.row(os.path.basename(broken))
+    assert not table.loaded[row]
+
+    # Fixed in place, keeping the size and modification time it failed with
+    with open(broken, 'wb') as file: file.write(good)
+    os.utime(broken, ns = (stat.st_atime_ns, stat.st_mtime_ns))
+    table = ms.extract(directory)
+    assert table.loaded.all()
+    assert table.record(row).n_points == \
+           dc.df_to_entry(sl.load(broken)).n_points
+
+
+def test_store_failure_is_read_again(data_root, monkeypatch):
+    directory, paths = write_sessions(data_root, 10)
+    store = str(data_root / "Data" / "Sessions.store")
+    ss.pack_directory(directory, store)
+    values = ms._record_values
+    def failing(data): raise ValueError("unreadable")
+    monkeypatch.setattr(ms, "_record_values", failing)
+    assert not ms.extract(store).loaded.any()
+    monkeypatch.setattr(ms, "_record_values", values)
+    assert ms.extract(store).loaded.all()
+
+
+def nanosecond_times(df):
+    """ df with its datetime columns as datetime64[ns]. """
+    times = df.select_dtypes('datetime').columns
+    return df.astype(dict((column, 'datetime64[ns]') for column in times))
+
+
+def test_clean_directory_from_sidecar(data_root):
+    directory, paths = write_sessions(data_root)
+    with open(paths[5], 'wb') as file: file.write(b"broken")
+    for check_fun in (dir_c.clean_df, dir_c.gap_vals):
+        loaded = dir_c.clean_directory(directory, check_fun)
+        for _ in range(2):
+            from_sidecar = dir_c.clean_directory(directory, check_fun, \
+                                                 sidecar = True)
+            pd.testing.assert_frame_equal(nanosecond_times(from_sidecar), \
+                                          nanosecond_times(loaded))
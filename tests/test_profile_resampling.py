@@ -0,0 +1,87 @@
+"""
+Checks that merged and gridded profiles keep the metrics clean_data looks at
+within the bounds the module docstring states.
+"""
+import numpy as np
+import pytest
+
+import data_cleaner as dc
+import profile_resampling as pr
+
+
+def test_merge_keeps_clean_data(entries, criteria):
+    for entry in entries:
+        merged = pr.merge_entry(entry)
+        assert dc.clean_data(merged, **criteria)[:2] == \
+               dc.clean_data(entry, **criteria)[:2]
+
+
+def test_merge_keeps_metrics(entries):
+    dropped = 0
+    for entry in entries:
+        merged = pr.merge_entry(entry)
+        dropped += entry.n_points - len(merged.times)
+        errors = pr.metric_errors(entry, merged)
+        assert np.isclose(merged.energyDemand, entry.energyDemand, \
+                          rtol = 1e-9, atol = 1e-9)
+        assert errors['max_power'] == 0
+        assert errors['length'] == np.timedelta64(0)
+        assert errors['max_gap'] == np.timedelta64(0)
+        assert errors['average_gap'] == np.timedelta64(0)
+        assert errors['max_gap_position'] == 0
+    # The idle end of sessions is merged away
+    assert dropped > 0
+
+
+@pytest.mark.parametrize("tolerance", [50, 500])
+def test_merge_with_tolerance(entries, tolerance):
+    for entry in entries:
+        merged = pr.merge_entry(entry, tolerance)
+        errors = pr.metric_errors(entry, merged)
+        assert abs(errors['energy']) <= \
+               pr.energy_tolerance(tolerance, entry.length) + 1e-9
+        assert errors['max_power'] == 0
+        assert errors['max_gap'] == np.timedelta64(0)
+        assert errors['average_gap'] == np.timedelta64(0)
+        assert merged.n_points == entry.n_points
+
+
+def test_merge_max_span(profiles):
+    span = np.timedelta64(60, 's')
+    profile = profiles[0]
+    times, currents, index = pr.merge_runs(profile.index.values, \
+                                           np.zeros(len(profile)), \
+                                           max_span = span)
+    gaps = np.diff(times)
+    # Gaps only reach span where the original datapoints were that far apart
+    original = np.diff(profile.index.values)
+    assert np.all((gaps < span) | (gaps == original[index[:-1]]))
+    assert index[0] == 0 and index[-1] == len(profile) - 1
+
+
+def test_grid_keeps_gaps_and_peak(entries):
+    interval = np.timedelta64(30, 's')
+    for entry in entries:
+        if entry.n_points < 2 or entry.length == np.timedelta64(0): continue
+        gridded = pr.grid_entry(entry, interval)
+        gaps = np.diff(entry.times)
+        new_gaps = np.diff(gridded.times)
+        assert np.all(new_gaps <= max(interval, gaps.max()))
+        assert gridded.times[0] == entry.times[0]
+        assert gridded.times[-1] == entry.times[-1]
+        errors = pr.metric_errors(entry, gridded)
+        assert errors['max_power'] == 0
+        if gaps.max() > interval:
+            assert errors['max_gap'] == np.timedelta64(0)
+
+
+def test_grid_needs_positive_interval(entries):
+    with pytest.raises(ValueError):
+        pr.grid_entry(entries[0], np.timedelta64(0, 's'))
+
+
+def test_short_profiles_are_kept(entries):
+    for entry in entries[-2:]:
+        merged = pr.merge_entry(entry)
+        assert np.array_equal(merged.times, entry.times)
+        assert dc.clean_data(merged)[:2] == dc.clean_data(entry)[:2]
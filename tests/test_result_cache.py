@@ -0,0 +1,69 @@
+"""
+Checks that clean_directory with a result cache gives the rows of a run
+without one, and which files it checks again.
+"""
+import os
+
+import pandas as pd
+
+import clean_stats as cs
+import data_cleaner as dc
+import directory_cleaner as dir_c
+import result_cache as rc
+import synthetic_sessions as synth
+
+
+def cached_run(directory, cache, config = None):
+    """ Returns (rows, number of rows from the cache) of a cached run. """
+    stats = cs.CleanStats()
+    rows = dir_c.clean_directory(directory, dir_c.clean_df, cache = cache, \
+                                 stats = stats, config = config)
+    return (rows, stats.cached)
+
+
+def test_cached_rows_match(data_root):
+    directory = str(data_root / "Data" / "Sessions") + "/"
+    paths = synth.write_directory(directory, 30)
+    cache = str(data_root / "Cache" / "results")
+    uncached = dir_c.clean_directory(directory, dir_c.clean_df)
+    assert cached_run(directory, cache)[1] == 0
+    rows, cached = cached_run(directory, cache)
+    assert cached == len(paths)
+    pd.testing.assert_frame_equal(rows, uncached)
+
+
+def test_changed_and_failed_files_are_checked_again(data_root):
+    directory = str(data_root / "Data" / "Sessions") + "/"
+    paths = synth.write_directory(directory, 30)
+    cache = str(data_root / "Cache" / "results")
+    with open(paths[4], 'wb') as file: file.write(b"broken")
+    cached_run(directory, cache)
+    assert cached_run(directory, cache)[1] == len(paths) - 1
+
+    # A new session in place of another changes its size
+    synth.write_directory(directory + "new/", 1, seed = 1)
+    new = os.path.join(directory + "new/", os.listdir(directory + "new/")[0])
+    os.replace(new, paths[7])
+    rows, cached = cached_run(directory, cache)
+    assert cached == len(paths) - 2
+    pd.testing.assert_frame_equal(rows, \
+        dir_c.clean_directory(directory, dir_c.clean_df))
+
+
+def test_settings_use_their_own_cache(data_root):
+    directory = str(data_root / "Data" / "Sessions") + "/"
+    paths = synth.write_directory(directory, 10)
+    cache = str(data_root / "Cache" / "results")
+    cached_run(directory, cache)
+    config = dc.CleaningConfig(min_energy = 0)
+    assert cached_run(directory, cache, config)[1] == 0
+    assert cached_run(directory, cache)[1] == len(paths)
+
+
+def test_fingerprint_follows_data_cleaner(monkeypatch):
+    before = rc.fingerprint(dir_c.clean_df)
+    assert rc.fingerprint(dir_c.clean_df) == before
+    assert rc.fingerprint(dir_c.gap_vals) != before
+    # data_cleaner changed, such as one of the checks clean_df runs
+    monkeypatch.setitem(rc._source_hashes, dc.__file__, b"changed")
+    assert rc.fingerprint(dir_c.clean_df) != before
@@ -0,0 +1,96 @@
+"""
+Checks that every sink reads back as the rows written, and that a failed
+write leaves the older result at the path as it was.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import directory_cleaner as dir_c
+import result_sinks as rs
+import synthetic_sessions as synth
+
+# Extension of each sink, and the module it needs
+Formats = [(".csv", None), (".pkl", None), (".parquet", "pyarrow"), \
+           (".feather", "pyarrow"), (".xlsx", "openpyxl")]
+
+
+@pytest.fixture
+def results(data_root):
+    """ Returns (rows, columns, dtypes) of gap_vals over 30 sessions. """
+    directory = str(data_root / "Data" / "Sessions") + "/"
+    paths = synth.write_directory(directory, 30)
+    with open(paths[2], 'wb') as file: file.write(b"corrupt")
+    rows = list(dir_c.iter_rows(directory, dir_c.gap_vals))
+    return (rows, dir_c.result_columns(dir_c.gap_vals), \
+            dir_c.result_dtypes(dir_c.gap_vals))
+
+
+def output(tmp_path, filename):
+    """ Returns the path of filename in an Output directory of tmp_path. """
+    os.makedirs(str(tmp_path / "Output"), exist_ok = True)
+    return str(tmp_path / "Output" / filename)
+
+
+def failing(rows, after):
+    for i, row in enumerate(rows):
+        if i == after: raise RuntimeError("interrupted")
+        yield row
+
+
+@pytest.mark.parametrize("extension, module", Formats)
+def test_rows_read_back(tmp_path, results, extension, module):
+    if module is not None: pytest.importorskip(module)
+    rows, columns, dtypes = results
+    path = output(tmp_path, "rows" + extension)
+    assert rs.write_rows(iter(rows), columns, path, 7, dtypes = dtypes) == \
+           len(rows)
+    assert os.listdir(str(tmp_path / "Output")) == ["rows" + extension]
+    back = rs.read_results(path)
+    want = pd.DataFrame(rows, columns = columns)
+    assert list(back.columns) == columns
+    assert back.shape == want.shape
+    assert list(back['path']) == list(want['path'])
+    assert list(back['error'].fillna("")) == list(want['error'].fillna(""))
+    assert np.allclose(back['energy (AV)'].astype(float), \
+                       want['energy (AV)'].astype(float), equal_nan = True)
+    if extension in (".parquet", ".feather"):
+        assert str(back['station_id'].dtype) == 'int64'
+
+
+@pytest.mark.parametrize("extension, module", Formats)
+def test_failure_keeps_older_result(tmp_path, results, extension, module):
+    if module is not None: pytest.importorskip(module)
+    rows, columns, dtypes = results
+    path = output(tmp_path, "rows" + extension)
+    rs.write_rows(rows[:3], columns, path, dtypes = dtypes)
+    older = rs.read_results(path)
+    with pytest.raises(RuntimeError):
+        rs.write_rows(failing(rows, 20), columns, path, 7, dtypes = dtypes)
+    pd.testing.assert_frame_equal(rs.read_results(path), older)
+    assert sorted(os.listdir(str(tmp_path / "Output"))) == ["rows" + extension]
+
+
+def test_no_rows(tmp_path, results):
+    rows, columns, dtypes = results
+    path = output(tmp_path, "rows.csv")
+    assert rs.write_rows([], columns, path) == 0
+    assert list(rs.read_results(path).columns) == columns
+
+
+def test_unknown_format(tmp_path, results):
+    rows, columns, dtypes = results
+    assert rs.sink_for("rows.txt") is None
+    with pytest.raises(ValueError):
+        rs.write_rows(rows, columns, output(tmp_path, "rows.txt"))
+
+
+def test_excel_row_limit(tmp_path, results, monkeypatch):
+    rows, columns, dtypes = results
+    monkeypatch.setattr(rs, "ExcelMaxRows", 10)
+    path = output(tmp_path, "rows.xlsx")
+    with pytest.raises(ValueError):
+        rs.write_rows(rows, columns, path, 7)
+    assert not os.path.exists(path)
@@ -0,0 +1,70 @@
+"""
+Checks that RuleSet reports the first failure clean_data would, for one
+session and packed batches, and that it finds expensive metrics only for
+sessions passing the rules listed before them.
+"""
+import operator
+
+import numpy as np
+import pytest
+
+import data_cleaner as dc
+
+
+def test_default_rules_match_clean_data(profiles, entries, criteria, \
+                                        verdicts):
+    rules = dc.RuleSet(dc.default_rules(**criteria))
+    assert [rules.check(entry) for entry in entries] == verdicts
+    is_valid, error = rules.check_batch(*dc.pack_profiles(profiles))
+    assert list(zip(is_valid.tolist(), error.tolist())) == verdicts
+
+
+def test_user_rule(profiles, entries):
+    few = dc.Rule("FewPoints", 'n_points', operator.ge, 100)
+    rules = dc.RuleSet(dc.default_rules() + [few])
+    want = []
+    for entry in entries:
+        verdict = tuple(dc.clean_data(entry)[:2])
+        if verdict[0] and entry.n_points < 100: verdict = (False, "FewPoints")
+        want.append(verdict)
+    assert [rules.check(entry) for entry in entries] == want
+    is_valid, error = rules.check_batch(*dc.pack_profiles(profiles))
+    assert list(zip(is_valid.tolist(), error.tolist())) == want
+
+
+def test_listed_order_wins():
+    # Energy is tried last, as it costs most, but listed first it still wins
+    rules = dc.RuleSet([dc.Rule("Energy", 'energy', operator.gt, 1e12), \
+                        dc.Rule("Short", 'length', operator.ge, \
+                                np.timedelta64(1, 'D'))])
+    assert rules.order[-1] == 0
+    times = np.array(["2018-01-01T00:00", "2018-01-01T00:10"], \
+                     dtype='datetime64[ns]')
+    entry = dc.arrays_to_entry(times, np.array([1000.0, 1000.0]))
+    assert rules.check(entry) == (False, "Energy")
+
+
+def test_expensive_metric_only_when_needed(profiles):
+    found = []
+    def energy(packed):
+        found.append(packed.offsets.size - 1)
+        return dc._packed_energy(packed)
+    dc.register_metric('counted_energy', lambda e: e.energyDemand, \
+                       energy, cost = 10)
+    try:
+        rules = dc.RuleSet([dc.Rule(dc.ShortTime, 'length', operator.ge, \
+                                    np.timedelta64(20, 'h')), \
+                            dc.Rule("Energy", 'counted_energy', \
+                                    operator.gt, 0)])
+        packed = dc.pack_profiles(profiles)
+        is_valid, error = rules.check_batch(*packed)
+        # Found once, for the sessions long enough
+        assert found == [np.count_nonzero(error != dc.ShortTime)]
+        assert found[0] < len(profiles)
+    finally:
+        del dc.RuleMetrics['counted_energy']
+
+
+def test_unknown_metric():
+    with pytest.raises(ValueError):
+        dc.RuleSet([dc.Rule("Nope", 'no_such_metric', operator.gt, 0)])
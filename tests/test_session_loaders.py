@@ -0,0 +1,127 @@
+"""
+Checks that every format and compression loads the profile written, picked
+by extension or by contents, and the text loaders against each other.
+"""
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_cleaner as dc
+import directory_cleaner as dir_c
+import session_loaders as sl
+import synthetic_sessions as synth
+
+Extensions = ["pkl", "txt", "pkl.gz", "txt.gz", "pkl.xz", "txt.xz", \
+              "pkl.bz2", "txt.bz2"]
+
+
+def written(tmp_path, extension, n_sessions = 3):
+    """ Returns (paths, profiles) of sessions written with extension. """
+    paths = synth.write_directory(str(tmp_path / extension), n_sessions, \
+                                  extension)
+    pickled = synth.write_directory(str(tmp_path / "expected"), n_sessions)
+    return (paths, [sl.load(path) for path in pickled])
+
+
+def assert_same_profile(df, expected):
+    assert df.index.name == 'time'
+    assert np.array_equal(df.index.values, expected.index.values)
+    assert np.array_equal(df['mamps_last'].values, \
+                          expected['mamps_last'].values)
+
+
+@pytest.mark.parametrize("extension", Extensions)
+def test_formats_load_the_profile(tmp_path, extension):
+    paths, profiles = written(tmp_path, extension)
+    fmt, compression = sl.file_kind(paths[0])
+    assert fmt.name == extension.split('.')[0]
+    assert (compression and compression.name) == \
+           (extension.split('.') + [None])[1]
+    for path, profile in zip(paths, profiles):
+        assert_same_profile(sl.load(path), profile)
+        assert_same_profile(sl.load(path, ['mamps_last']), profile)
+
+
+@pytest.mark.parametrize("extension", Extensions)
+def test_format_found_from_contents(tmp_path, extension):
+    paths, profiles = written(tmp_path, extension, 1)
+    unnamed = str(tmp_path / "session.data")
+    shutil.copy(paths[0], unnamed)
+    assert_same_profile(sl.load(unnamed), profiles[0])
+
+
+def test_unknown_format(tmp_path):
+    path = str(tmp_path / "session.data")
+    with open(path, 'wb') as file: file.write(b"neither pickle nor text")
+    with pytest.raises(sl.UnknownFormat):
+        sl.load(path)
+
+
+def test_registered_format(tmp_path, monkeypatch):
+    monkeypatch.setattr(sl, "Formats", dict(sl.Formats))
+    def read_npz(file, columns = None):
+        with np.load(file) as saved:
+            return pd.DataFrame({'mamps_last' : saved['mamps_last']}, \
+                                index = pd.DatetimeIndex(saved['time'], \
+                                                         name = 'time'))
+    sl.register_format("npz", read_npz)
+    profile = synth.make_session(np.random.default_rng(0), \
+                                 pd.Timestamp("2018-01-01"))
+    path = str(tmp_path / "session.npz")
+    np.savez(path, time = profile.index.values, \
+             mamps_last = profile['mamps_last'].values)
+    assert_same_profile(sl.load(path), profile)
+
+
+def test_load_txt_fast_matches_load_txt(tmp_path):
+    paths, _ = written(tmp_path, "txt")
+    # Whole currents are read as integers by both
+    whole = str(tmp_path / "whole.txt")
+    with open(whole, 'w') as file:
+        file.write("time\tmamps_last\textra\n2018-01-01-06-00-00\t100\ta\n" \
+                   "2018-01-01-06-00-10\t250\tb\n")
+    for path in paths + [whole]:
+        df = sl.load_txt(path)
+        fast = sl.load_txt_fast(path)
+        pd.testing.assert_frame_equal(fast, df[['mamps_last']])
+    assert sl.load_txt_fast(whole)['mamps_last'].dtype == np.int64
+
+
+def test_load_txt_batch(tmp_path):
+    paths, _ = written(tmp_path, "txt", 5)
+    broken = str(tmp_path / "broken.txt")
+    with open(broken, 'w') as file: file.write("no\tsuch\tcolumns\n1\t2\t3\n")
+    loaded, times, currents, offsets = sl.load_txt_batch( \
+        paths[:2] + [broken] + paths[2:])
+    assert loaded == paths
+    assert currents.dtype == np.float64
+    for i, path in enumerate(paths):
+        df = sl.load_txt(path)
+        assert np.array_equal(times[offsets[i] : offsets[i + 1]], \
+                              df.index.values)
+        assert np.array_equal(currents[offsets[i] : offsets[i + 1]], \
+                              df['mamps_last'].values)
+    is_valid, error = dc.clean_batch(times, currents, offsets)
+    assert list(error) == [dc.clean_data(dc.df_to_entry(sl.load_txt(p)))[1] \
+                           for p in paths]
+
+
+def test_mixed_directory(data_root):
+    mixed = str(data_root / "Data" / "Mixed") + "/"
+    pickled = str(data_root / "Data" / "Pickled") + "/"
+    for i, extension in enumerate(Extensions):
+        synth.write_directory(mixed, 2, extension, seed = i)
+        synth.write_directory(pickled, 2, seed = i)
+    rows = dir_c.clean_directory(mixed, dir_c.gap_vals)
+    assert (rows['error'] != dir_c.FileError).all()
+    want = dir_c.clean_directory(pickled, dir_c.gap_vals)
+    key = ['station_id', 'year', 'month', 'day', 'hour', 'min', 'sec']
+    rows = rows.sort_values(key).reset_index(drop = True)
+    want = want.sort_values(key).reset_index(drop = True)
+    # Text files give nanosecond times, pickles the unit they were saved in
+    for df in (rows, want):
+        df['time_max_gap'] = df['time_max_gap'].astype('datetime64[ns]')
+    columns = [c for c in rows.columns if c != 'path']
+    pd.testing.assert_frame_equal(rows[columns], want[columns])
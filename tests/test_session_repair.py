@@ -0,0 +1,84 @@
+"""
+Checks repair_batch against clean_data on the segments repair_entry makes,
+and what filling and splitting keep of each session.
+"""
+import numpy as np
+import pandas as pd
+
+import data_cleaner as dc
+import session_repair as sp
+import session_store as ss
+import synthetic_sessions as synth
+
+
+def test_repair_batch_matches_segments(profiles, entries):
+    packed = dc.pack_profiles(profiles)
+    repaired = sp.repair_batch(*packed)
+    segments = [(i, k, segment) for i, entry in enumerate(entries) \
+                for k, segment in enumerate(sp.repair_entry(entry))]
+    assert list(repaired['session']) == [i for i, _, _ in segments]
+    assert list(repaired['segment']) == [k for _, k, _ in segments]
+    for j, (_, _, segment) in enumerate(segments):
+        assert (bool(repaired['is_valid'][j]), repaired['error'][j]) == \
+               tuple(dc.clean_data(segment)[:2])
+        assert repaired['n_points'][j] == segment.n_points
+        assert repaired['max_gap'][j] == dc.max_gap(segment)
+        assert np.isclose(repaired['energy'][j], segment.energyDemand)
+
+
+def test_nothing_repaired_is_clean_batch(profiles):
+    packed = dc.pack_profiles(profiles)
+    repaired = sp.repair_batch(*packed, max_fill = None, \
+                               max_gap_allowed = None)
+    # max_gap_allowed None also turns the BigGap check off
+    is_valid, error = dc.clean_batch(*packed, max_gap_allowed = None)
+    assert np.array_equal(repaired['offsets'], packed[2])
+    assert np.array_equal(repaired['is_valid'], is_valid)
+    assert list(repaired['error']) == list(error)
+    assert not repaired['filled_time'].any()
+
+
+def test_fill_keeps_energy(profiles, entries):
+    times, currents, offsets = dc.pack_profiles(profiles)
+    filled, filled_currents, new_offsets, added = sp.fill_gaps(times, \
+        currents, offsets)
+    assert added.sum() == filled.size - times.size
+    assert np.array_equal(filled[~added], times.astype('datetime64[ns]'))
+    bound = sp.energy_bound(sp.filled_time(filled, new_offsets, added), \
+                            np.array([e.max_power for e in entries]))
+    for i, entry in enumerate(entries):
+        start, end = new_offsets[i], new_offsets[i + 1]
+        session = dc.arrays_to_entry(filled[start:end], \
+                                     filled_currents[start:end])
+        assert np.isclose(session.energyDemand, entry.energyDemand)
+        assert session.max_power == entry.max_power
+        gaps = np.diff(filled[start:end])
+        assert not np.any((gaps > sp.SampleInterval) & (gaps <= sp.MaxFill))
+        assert bound[i] >= 0
+
+
+def test_split_leaves_no_big_gap(profiles):
+    times, _, offsets = dc.pack_profiles(profiles)
+    limit = np.timedelta64(5, 'm')
+    segments, session = sp.split_at_gaps(times, offsets, limit)
+    for k in range(session.size):
+        gaps = np.diff(times[segments[k] : segments[k + 1]])
+        assert np.all(gaps < limit)
+    assert np.array_equal(np.unique(session), np.arange(len(profiles)))
+
+
+def test_repair_directory_and_store(data_root):
+    directory = str(data_root / "Data" / "Sessions") + "/"
+    settings = synth.Settings(gap_rate = 0.8, dropout_rate = 0.3)
+    synth.write_directory(directory, 30, settings = settings)
+    store = str(data_root / "Data" / "Sessions.store")
+    ss.pack_directory(directory, store)
+    from_files = sp.repair_directory(directory, workers = 2)
+    from_store = sp.repair_directory(store)
+    assert list(from_files.columns) == sp.Columns
+    assert from_files.shape == from_store.shape
+    columns = [c for c in sp.Columns if c != 'path']
+    pd.testing.assert_frame_equal(from_files[columns], from_store[columns], \
+                                  check_dtype = False)
+    # Sessions with many gaps still give valid segments
+    assert from_files['is_valid'].sum() > 0
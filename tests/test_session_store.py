@@ -0,0 +1,96 @@
+"""
+Checks that a session store gives back the sessions packed into it, that
+Entries over its memory-mapped arrays clean as those of the files, and that
+a pack that fails leaves no store behind.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_cleaner as dc
+import directory_cleaner as dir_c
+import session_loaders as sl
+import session_store as ss
+import synthetic_sessions as synth
+
+
+@pytest.fixture
+def packed(data_root):
+    """ Returns (directory, session paths, store) of 30 packed sessions. """
+    directory = str(data_root / "Data" / "Sessions") + "/"
+    paths = sorted(synth.write_directory(directory, 30))
+    store = str(data_root / "Data" / "Sessions.store")
+    assert ss.pack_directory(directory, store) == len(paths)
+    return (directory, paths, store)
+
+
+def test_sessions_read_back(packed):
+    directory, paths, store_path = packed
+    store = ss.SessionStore(store_path)
+    assert list(store.names) == [os.path.basename(p) for p in paths]
+    for i, path in enumerate(paths):
+        df = sl.load(path)
+        times, currents = store.arrays(i)
+        assert np.array_equal(times, df.index.values)
+        assert np.array_equal(currents, df['mamps_last'].values)
+        assert not currents.flags.writeable
+        profile = store.profile(i)
+        assert profile.index.name == 'time'
+        assert np.array_equal(profile.index.values, df.index.values)
+        assert list(profile.columns) == ['mamps_last']
+
+
+def test_store_entries_clean_as_files(packed, criteria):
+    directory, paths, store_path = packed
+    store = ss.SessionStore(store_path)
+    for i, path in enumerate(paths):
+        entry = dc.df_to_entry(sl.load(path))
+        view = store.entry(i)
+        assert np.shares_memory(view.times, store.times)
+        assert dc.max_gap(view) == dc.max_gap(entry)
+        assert dc.clean_data(view, **criteria)[:2] == \
+               dc.clean_data(entry, **criteria)[:2]
+
+
+def test_clean_directory_reads_store(packed):
+    directory, paths, store_path = packed
+    from_files = dir_c.clean_directory(directory, dir_c.gap_vals)
+    from_store = dir_c.clean_directory(store_path, dir_c.gap_vals)
+    columns = [c for c in from_files.columns if c != 'path']
+    pd.testing.assert_frame_equal(from_store[columns], from_files[columns], \
+                                  check_dtype = False)
+
+
+def test_interrupted_pack_leaves_no_store(packed, monkeypatch):
+    directory, paths, store_path = packed
+    load = sl.load
+    def interrupted(pathname, columns = None):
+        if pathname == paths[10]: raise KeyboardInterrupt
+        return load(pathname, columns)
+    monkeypatch.setattr(sl, "load", interrupted)
+    # Packed again over the store made by the fixture
+    with pytest.raises(KeyboardInterrupt):
+        ss.pack_directory(directory, store_path)
+    assert not ss.is_store(store_path)
+    assert os.listdir(store_path) == []
+
+
+def test_entry_over_views_copies_nothing(packed):
+    directory, paths, store_path = packed
+    store = ss.SessionStore(store_path)
+    for i, path in enumerate(paths):
+        entry = dc.df_to_entry(sl.load(path))
+        view = store.entry(i)
+        assert dc.datapoint_fraction(view) == dc.datapoint_fraction(entry)
+        assert dc.max_gap(view, True)[0] == dc.max_gap(entry, True)[0]
+        for power in (0, 2000, 5000):
+            assert dc._enough_power(view, power) == \
+                   dc._enough_power(entry, power)
+        assert np.isclose(view.energyDemand, entry.energyDemand)
+        # The helpers worked on the store's arrays, and built no profile
+        assert np.shares_memory(view.currents, store.currents)
+        assert view._profile is None
+        assert np.array_equal(view.profile['mamps_last'].values, \
+                              entry.currents)
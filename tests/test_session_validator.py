@@ -0,0 +1,68 @@
+"""
+Checks that SessionValidator, fed a session's datapoints as they arrive,
+ends with the verdict clean_data gives the whole session, and flags BigGap
+and LongTime in the order the datapoints raise them.
+"""
+import numpy as np
+import pytest
+
+import data_cleaner as dc
+
+
+def test_result_matches_clean_data(profiles, criteria, verdicts):
+    results = []
+    for profile in profiles:
+        validator = dc.SessionValidator(**criteria)
+        validator.add_many(profile.index.values, profile['mamps_last'].values)
+        results.append(tuple(validator.result()[:2]))
+    assert results == verdicts
+
+
+def test_metrics_match_entry(profiles, entries):
+    for profile, entry in list(zip(profiles, entries))[:50]:
+        validator = dc.SessionValidator()
+        validator.add_many(profile.index.values, profile['mamps_last'].values)
+        assert validator.n_points == entry.n_points
+        assert validator.length == entry.length
+        assert validator.max_gap_info[0] == entry.max_gap_info[0]
+        assert validator.energyDemand == pytest.approx(entry.energyDemand)
+        assert validator.max_power == pytest.approx(entry.max_power)
+
+
+def test_flags_in_arrival_order(profiles, criteria):
+    # Sessions short enough to add a datapoint at a time
+    for profile in [p for p in profiles if len(p) < 4000][:12]:
+        validator = dc.SessionValidator(**criteria)
+        flags = []
+        for time, mamps in zip(profile.index, profile['mamps_last']):
+            flags.extend(validator.add(time, mamps))
+        assert flags == validator.flags
+        # Also when the datapoints arrive many at a time
+        for size in (len(profile), 7):
+            batched = dc.SessionValidator(**criteria)
+            for i in range(0, len(profile), size):
+                chunk = profile.iloc[i : i + size]
+                batched.add_many(chunk.index.values, \
+                                 chunk['mamps_last'].values)
+            assert batched.flags == validator.flags
+            assert batched.result()[:2] == validator.result()[:2]
+
+
+def test_flag_raised_by_the_datapoint():
+    validator = dc.SessionValidator()
+    start = np.datetime64("2018-01-01T00:00:00")
+    assert validator.add(start, 8000) == ()
+    assert validator.add(start + np.timedelta64(10, 'm'), 8000) == \
+           (dc.BigGap,)
+    # Each flag is raised once
+    assert validator.add(start + np.timedelta64(30, 'm'), 8000) == ()
+    assert validator.add(start + np.timedelta64(21, 'h'), 8000) == \
+           (dc.LongTime,)
+    assert validator.flags == [dc.BigGap, dc.LongTime]
+
+
+def test_empty_session():
+    validator = dc.SessionValidator()
+    assert validator.add_many(np.array([], dtype='datetime64[ns]'), []) == ()
+    with pytest.raises(ValueError):
+        validator.result()
@@ -0,0 +1,59 @@
+"""
+Checks station lookups against the station tables, the site fallback, bulk
+lookups and the registry cache.
+"""
+import os
+
+import numpy as np
+
+import station_registry as sr
+import synthetic_sessions as synth
+
+
+def load(data_root):
+    return sr.load_registry(sr.DefaultTables, str(data_root / "Data") + "/", \
+                            str(data_root / "Cache"))
+
+
+def test_resolve_matches_tables(data_root):
+    registry = load(data_root)
+    table = sr.stations_info_df(sr.DefaultTables, \
+                                str(data_root / "Data") + "/")
+    for station_id in synth.Stations:
+        if station_id in table.index:
+            want = list(table.loc[station_id, ['type', 'site']])
+        else:
+            want = ["NaN", sr.fallback_site(station_id)]
+        assert registry.resolve(station_id) == want
+    assert registry.resolve(9000001) == ["NaN", "NaN"]
+
+
+def test_resolve_gives_a_new_list(data_root):
+    registry = load(data_root)
+    station_id = synth.Stations[0]
+    row = registry.resolve(station_id)
+    row += ["more", "values"]
+    assert registry.resolve(station_id) == row[:2]
+
+
+def test_resolve_many_matches_resolve(data_root):
+    registry = load(data_root)
+    ids = np.array(list(synth.Stations) + [2000001, 6999999, 9000001, 0])
+    types, sites = registry.resolve_many(ids)
+    assert [[t, s] for t, s in zip(types, sites)] == \
+           [registry.resolve(int(i)) for i in ids]
+
+
+def test_registry_is_cached(data_root):
+    registry = load(data_root)
+    assert os.path.exists(str(data_root / "Cache" / sr.CacheFile))
+    sr._loaded.clear()
+    cached = load(data_root)
+    assert cached.fingerprint() == registry.fingerprint()
+
+    # A table changed, so the registry is built again
+    path = str(data_root / "Data" / sr.DefaultTables[0])
+    with open(path) as file: lines = file.read().splitlines()
+    lines[1] = lines[1].replace("AV", "DC")
+    with open(path, 'w') as file: file.write("\n".join(lines) + "\n")
+    assert load(data_root).fingerprint() != registry.fingerprint()
@@ -0,0 +1,88 @@
+"""
+Checks every combination of a sweep against clean_data with the same
+criteria, and the metrics a sweep reads from a directory or a store.
+"""
+import collections
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_cleaner as dc
+import session_store as ss
+import synthetic_sessions as synth
+import threshold_sweep as ts
+
+Grid = {'min_charge_time' : [None, np.timedelta64(10, 'm'), \
+                             np.timedelta64(2, 'h')], \
+        'max_gap_allowed' : [np.timedelta64(60, 's'), None], \
+        'min_energy' : [0, 1, 20000], \
+        'min_maxpower' : [None, 5000]}
+
+
+def test_sweep_matches_clean_data(profiles, entries):
+    metrics = dc.batch_metrics(*dc.pack_profiles(profiles))
+    table = ts.sweep(metrics, **Grid)
+    assert table.shape[0] == np.prod([len(v) for v in Grid.values()])
+    assert list(table.columns[:len(Grid)]) == \
+           [c for c, _ in dc.BatchOrder if c in Grid]
+    errors = [error for _, error in dc.BatchOrder]
+    for _, row in table.iterrows():
+        criteria = dict((c, None if pd.isna(row[c]) else row[c]) \
+                        for c in Grid)
+        found = [dc.clean_data(entry, **criteria)[:2] for entry in entries]
+        counts = collections.Counter(error for _, error in found)
+        assert row['valid'] == sum(1 for valid, _ in found if valid)
+        assert row['valid_rate'] == row['valid'] / len(entries)
+        assert [row[error] for error in errors] == \
+               [counts[error] for error in errors]
+
+
+def test_sweep_defaults(profiles, entries):
+    metrics = dc.batch_metrics(*dc.pack_profiles(profiles))
+    table = ts.sweep(metrics)
+    assert table.shape[0] == 1
+    assert table['valid'][0] == \
+           sum(1 for entry in entries if dc.clean_data(entry)[0])
+
+
+def test_sweep_refuses_criteria():
+    metrics = dc.batch_metrics(*dc.pack_profiles([]))
+    with pytest.raises(ValueError):
+        ts.sweep(metrics, min_length = [1])
+    with pytest.raises(ValueError):
+        ts.sweep(metrics, min_charge_time = [5])
+    table = ts.sweep(metrics, min_energy = [0, 1])
+    assert list(table['valid']) == [0, 0]
+    assert table['valid_rate'].isna().all()
+
+
+def test_directory_and_store_metrics(data_root):
+    directory = str(data_root / "Data" / "Sessions") + "/"
+    paths = sorted(synth.write_directory(directory, 30))
+    with open(paths[3], 'wb') as file: file.write(b"corrupt")
+    store = str(data_root / "Data" / "Sessions.store")
+    ss.pack_directory(directory, store)
+
+    read, metrics = ts.directory_metrics(directory)
+    assert read == paths[:3] + paths[4:]
+    stored_paths, stored = ts.directory_metrics(store)
+    assert len(stored_paths) == len(read)
+    for key in metrics:
+        assert np.allclose(metrics[key].astype(float), \
+                           stored[key].astype(float))
+
+
+def test_main(data_root, monkeypatch):
+    directory = str(data_root / "Data" / "Sessions") + "/"
+    synth.write_directory(directory, 20)
+    (data_root / "Output").mkdir()
+    monkeypatch.setattr(sys, "argv", ["threshold_sweep.py", directory, \
+                                      "sweep.csv", "--min_energy", "0,1,5", \
+                                      "--max_gap_allowed", "5m,none"])
+    ts.main()
+    table = pd.read_csv(str(data_root / "Output" / "sweep.csv"))
+    assert table.shape[0] == 6
+    # Combinations in clean_data's check order, max_gap_allowed first
+    assert list(table['min_energy']) == [0, 1, 5, 0, 1, 5]